@@ -19,7 +19,7 @@ from cumulus.common import check_status
 from cumulus.ansible.tasks.providers import CloudProvider
 from .inventory import simple_inventory
 import cumulus
-import requests
+from cumulus.common import api
 import os
 from celery.utils.log import get_task_logger
 
@@ -109,7 +109,7 @@ def launch_cluster(playbook, cluster, profile, secret_key, extra_vars,
         }
     }
     headers = {'Girder-Token': girder_token}
-    r = requests.patch(status_url, headers=headers, json=updates)
+    r = api.patch(status_url, headers=headers, json=updates)
     check_status(r)
 
     check_ansible_return_code(ansible, cluster, girder_token)
@@ -136,9 +136,9 @@ def terminate_cluster(playbook, cluster, profile, secret_key, extra_vars,
         master = p.get_master_instance(cluster['_id'])
 
         for volume_id in cluster['volumes']:
-            r = requests.get('%s/volumes/%s' %
-                             (cumulus.config.girder.baseUrl, volume_id),
-                             headers={'Girder-Token': girder_token})
+            r = api.get('%s/volumes/%s' %
+                        (cumulus.config.girder.baseUrl, volume_id),
+                        headers={'Girder-Token': girder_token})
             check_status(r)
             volume = r.json()
 
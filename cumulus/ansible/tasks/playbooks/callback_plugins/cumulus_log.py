@@ -1,4 +1,4 @@
-import requests
+from cumulus.common import api
 import cumulus
 from cumulus.common import get_post_logger
 import os
@@ -81,7 +81,7 @@ class CallbackModule(CallbackBase):
                 'status': 'error'
             }
 
-            r = requests.patch(status_url, headers=headers, json=updates)
+            r = api.patch(status_url, headers=headers, json=updates)
             if r.status_code != 200:
                 print >> sys.stderr, r.content
                 r.raise_for_status()
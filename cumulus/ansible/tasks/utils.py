@@ -20,7 +20,7 @@ import subprocess
 import json
 import select
 import cumulus
-import requests
+from cumulus.common import api
 from cumulus.common import check_status
 from celery.utils.log import get_task_logger
 from cumulus.ssh.tasks.key import _key_path
@@ -107,7 +107,7 @@ def check_girder_cluster_status(cluster, girder_token, post_status):
     headers = {'Girder-Token':  girder_token}
     status_url = '%s/clusters/%s/status' % (cumulus.config.girder.baseUrl,
                                             cluster_id)
-    r = requests.get(status_url, headers=headers)
+    r = api.get(status_url, headers=headers)
     status = r.json()['status']
 
     if status != 'error':
@@ -118,14 +118,14 @@ def check_girder_cluster_status(cluster, girder_token, post_status):
             'status': post_status
         }
 
-        r = requests.patch(status_url, headers=headers, json=updates)
+        r = api.patch(status_url, headers=headers, json=updates)
         check_status(r)
 
 
 def check_ansible_return_code(returncode, cluster, girder_token):
     if returncode != 0:
-        check_status(requests.patch('%s/clusters/%s' %
-                                    (cumulus.config.girder.baseUrl,
-                                     cluster['_id']),
-                                    headers={'Girder-Token': girder_token},
-                                    json={'status': 'error'}))
+        check_status(api.patch('%s/clusters/%s' %
+                               (cumulus.config.girder.baseUrl,
+                                cluster['_id']),
+                               headers={'Girder-Token': girder_token},
+                               json={'status': 'error'}))
@@ -18,7 +18,7 @@
 ###############################################################################
 
 import os
-import requests
+from cumulus.common import api
 import traceback
 import stat
 
@@ -56,7 +56,7 @@ def generate_key_pair(aws_profile, girder_token):
                                                  aws_profile['_id'])
 
     headers = {'Girder-Token':  girder_token}
-    r = requests.patch(update_url, json=aws_profile, headers=headers)
+    r = api.patch(update_url, json=aws_profile, headers=headers)
     check_status(r)
 
 
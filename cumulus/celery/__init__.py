@@ -58,6 +58,9 @@ _routes = {
     'cumulus.tasks.job.monitor_jobs': {
         'queue': 'monitor'
     },
+    'cumulus.tasks.job.monitor_cluster_jobs': {
+        'queue': 'monitor'
+    },
     'cumulus.tasks.job.monitor_process': {
         'queue': 'monitor'
     },
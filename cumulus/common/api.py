@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+from __future__ import absolute_import
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+from girder_client import GirderClient
+
+import cumulus
+from cumulus.common.jsonpath import get_property
+
+# The number of connections kept alive to each host
+DEFAULT_POOL_SIZE = 10
+# The number of times a request is retried on a connection error or one of
+# RETRY_STATUS_CODES
+DEFAULT_RETRIES = 3
+# Retries back off exponentially, sleeping backoff factor * 2^(retry - 1)
+DEFAULT_BACKOFF_FACTOR = 0.5
+# Responses from Girder, or a proxy in front of it, that are worth retrying
+RETRY_STATUS_CODES = (502, 503, 504)
+# Requests that can safely be resent after a response has been received, all
+# of the PATCHs we do are updates setting absolute values. PUT is not included
+# as some of our PUT endpoints are not idempotent, for example marking a task
+# as finished decrements the taskflow's active task count. Requests using other
+# methods are still retried if the connection couldn't be made.
+RETRY_METHODS = frozenset(['HEAD', 'GET', 'PATCH', 'DELETE', 'OPTIONS'])
+
+
+class GirderApi(object):
+    """
+    Process wide client for the worker's calls to the Girder API. All requests
+    go through a single requests session so connections are kept alive and
+    reused, and are retried using the same policy. The session is shared
+    between users so it never holds a token, the token is passed with each
+    call.
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, retries=DEFAULT_RETRIES,
+                 backoff_factor=DEFAULT_BACKOFF_FACTOR):
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self._lock = threading.Lock()
+        self._pid = None
+        self._session = None
+
+    def _create_session(self):
+        retry_kwargs = {
+            'total': self.retries,
+            'backoff_factor': self.backoff_factor,
+            'status_forcelist': RETRY_STATUS_CODES,
+            # Return the last response so check_status(...) can report it.
+            'raise_on_status': False
+        }
+        try:
+            retry = Retry(allowed_methods=RETRY_METHODS, **retry_kwargs)
+        except TypeError:
+            # urllib3 < 1.26
+            retry = Retry(method_whitelist=RETRY_METHODS, **retry_kwargs)
+        adapter = HTTPAdapter(pool_connections=self.pool_size,
+                              pool_maxsize=self.pool_size,
+                              max_retries=retry)
+
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+        return session
+
+    @property
+    def session(self):
+        # Sockets must not be shared with the parent after a fork
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._session = self._create_session()
+
+        return self._session
+
+    def request(self, method, url, girder_token=None, headers=None, **kwargs):
+        """
+        Make a request to Girder, takes the same arguments as
+        requests.request(...).
+
+        :param girder_token: The token to authenticate with, if not already
+                             in headers.
+        """
+        if girder_token is not None:
+            headers = dict(headers or {})
+            headers['Girder-Token'] = girder_token
+
+        return self.session.request(method, url, headers=headers, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request('PATCH', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def girder_client(self, girder_token, api_url=None):
+        """
+        Returns a GirderClient authenticated with girder_token that sends its
+        requests through the shared session.
+
+        :param api_url: The Girder API URL, defaults to the configured one.
+        """
+        if api_url is None:
+            api_url = cumulus.config.girder.baseUrl
+
+        client = GirderClient(apiUrl=api_url)
+        client.token = girder_token
+        # GirderClient.session() closes the session on exit so we can't use
+        # it for a session that outlives the client.
+        client._session = self.session
+
+        return client
+
+
+_api = None
+_api_lock = threading.Lock()
+
+
+def get_girder_api():
+    """
+    Returns the Girder API client for this process, the client is configured
+    using the girder.client section of the cumulus configuration.
+    """
+    global _api
+
+    with _api_lock:
+        if _api is None:
+            _api = GirderApi(
+                pool_size=get_property(
+                    'girder.client.poolSize', cumulus.config,
+                    default=DEFAULT_POOL_SIZE),
+                retries=get_property(
+                    'girder.client.retries', cumulus.config,
+                    default=DEFAULT_RETRIES),
+                backoff_factor=get_property(
+                    'girder.client.backoffFactor', cumulus.config,
+                    default=DEFAULT_BACKOFF_FACTOR))
+
+    return _api
+
+
+def get(url, **kwargs):
+    return get_girder_api().get(url, **kwargs)
+
+
+def put(url, **kwargs):
+    return get_girder_api().put(url, **kwargs)
+
+
+def post(url, **kwargs):
+    return get_girder_api().post(url, **kwargs)
+
+
+def patch(url, **kwargs):
+    return get_girder_api().patch(url, **kwargs)
+
+
+def delete(url, **kwargs):
+    return get_girder_api().delete(url, **kwargs)
+
+
+def girder_client(girder_token, api_url=None):
+    return get_girder_api().girder_client(girder_token, api_url)
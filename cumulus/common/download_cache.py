@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+from __future__ import absolute_import
+import errno
+import hashlib
+import os
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+
+import cumulus
+from cumulus.common.jsonpath import get_property
+
+# The default size budget of the cache, in bytes
+DEFAULT_MAX_SIZE = 10 * 1024 ** 3
+# Files are cached in blocks of this many bytes, so a range can be served from
+# the cache without the whole file having been downloaded.
+DEFAULT_BLOCK_SIZE = 4 * 1024 * 1024
+
+
+class DownloadCache(object):
+    """
+    A read through disk cache for files downloaded from remote assetstores.
+    Files are identified by a key, for example (assetstore id, path, size,
+    mtime), so a file that changes on the remote side is fetched again. Each
+    file is cached as a directory of fixed size blocks, which are fetched as
+    they are needed. When the cache grows beyond its size budget the least
+    recently used files are evicted, using an index of the cached files kept
+    in memory.
+
+    :param path: The directory to cache files in.
+    :param max_size: The size budget in bytes.
+    :param block_size: The size of the blocks files are cached in.
+    """
+
+    def __init__(self, path, max_size=DEFAULT_MAX_SIZE,
+                 block_size=DEFAULT_BLOCK_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        # entry path => size of its cached blocks, least recently used first.
+        # Built from the contents of the cache directory on first use.
+        self._entries = None
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_from_cache = 0
+        self.bytes_fetched = 0
+        self.evictions = 0
+
+    def _entry_path(self, key):
+        digest = hashlib.sha1(repr(tuple(key)).encode('utf8')).hexdigest()
+
+        return os.path.join(self.path, digest)
+
+    def _block_path(self, entry_path, block):
+        return os.path.join(entry_path, str(block))
+
+    def _read_block(self, entry_path, block):
+        try:
+            with open(self._block_path(entry_path, block), 'rb') as fp:
+                return fp.read()
+        except IOError:
+            return None
+
+    def _write_block(self, entry_path, block, data):
+        with self._lock:
+            self._ensure_index()
+
+        try:
+            os.makedirs(entry_path)
+        except OSError as ex:
+            if ex.errno != errno.EEXIST:
+                raise
+
+        # Write under a temporary name, so readers never see part of a block.
+        # The block is linked into place rather than renamed so we know if
+        # another reader has already filled it.
+        block_path = self._block_path(entry_path, block)
+        tmp = '%s.%s' % (block_path, uuid.uuid4().hex)
+        with open(tmp, 'wb') as fp:
+            fp.write(data)
+        try:
+            os.link(tmp, block_path)
+            created = True
+        except OSError as ex:
+            if ex.errno != errno.EEXIST:
+                raise
+            created = False
+        finally:
+            os.remove(tmp)
+
+        with self._lock:
+            if created:
+                self._size += len(data)
+                self._entries[entry_path] = \
+                    self._entries.pop(entry_path, 0) + len(data)
+            self.misses += 1
+            self.bytes_fetched += len(data)
+
+            self._evict(entry_path)
+
+    def _ensure_index(self):
+        """
+        Build the index of cached files from the cache directory, ordered by
+        when they were last used. Must be called with the lock held.
+        """
+        if self._entries is not None:
+            return
+
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            names = []
+
+        entries = []
+        for name in names:
+            entry_path = os.path.join(self.path, name)
+            try:
+                last_used = os.path.getmtime(entry_path)
+                size = sum([os.path.getsize(os.path.join(entry_path, f))
+                            for f in os.listdir(entry_path)])
+            except OSError:
+                continue
+
+            entries.append((last_used, size, entry_path))
+
+        self._entries = OrderedDict(
+            (entry_path, size) for (_, size, entry_path) in sorted(entries))
+        self._size = sum(self._entries.values())
+
+    def _touch(self, entry_path):
+        """
+        Mark a cached file as the most recently used.
+        """
+        with self._lock:
+            self._ensure_index()
+            if entry_path in self._entries:
+                self._entries[entry_path] = self._entries.pop(entry_path)
+
+        # Recorded on disk for when the index is next built
+        try:
+            os.utime(entry_path, None)
+        except OSError:
+            pass
+
+    def _evict(self, current_entry_path):
+        """
+        Remove the least recently used files until the cache is within its
+        size budget. Must be called with the lock held.
+        """
+        for entry_path in list(self._entries):
+            if self._size <= self.max_size:
+                break
+
+            # Don't evict the file being read
+            if entry_path == current_entry_path:
+                continue
+
+            shutil.rmtree(entry_path, ignore_errors=True)
+            self._size -= self._entries.pop(entry_path)
+            self.evictions += 1
+
+    def _fetch_blocks(self, entry_path, first_block, last_block, size, fetch):
+        """
+        Fetch a run of blocks, yielding each (block, data) as it completes.
+        """
+        start = first_block * self.block_size
+        end = min((last_block + 1) * self.block_size, size)
+        block = first_block
+        block_end = min(start + self.block_size, end)
+        buffered = []
+        position = start
+
+        for data in fetch(start, end):
+            while data:
+                needed = block_end - position
+                piece = data[:needed]
+                data = data[needed:]
+                buffered.append(piece)
+                position += len(piece)
+
+                if position == block_end:
+                    block_data = b''.join(buffered)
+                    self._write_block(entry_path, block, block_data)
+                    yield (block, block_data)
+
+                    buffered = []
+                    block += 1
+                    block_end = min(block_end + self.block_size, end)
+
+        if position != end:
+            raise IOError('Expected %d bytes from the remote file, got %d'
+                          % (end - start, position - start))
+
+    def read(self, key, size, offset, end_byte, fetch):
+        """
+        Yields the bytes of a file from offset up to end_byte, from the cache
+        where possible.
+
+        :param key: A tuple identifying the file and its version.
+        :param size: The size of the file.
+        :param fetch: Called with (start, end) to read a range of the remote
+                      file, returns an iterable of bytes.
+        """
+        entry_path = self._entry_path(key)
+        if os.path.isdir(entry_path):
+            self._touch(entry_path)
+
+        end_byte = min(end_byte, size)
+        if offset >= end_byte:
+            return
+
+        first_block = offset // self.block_size
+        last_block = (end_byte - 1) // self.block_size
+
+        block = first_block
+        while block <= last_block:
+            data = self._read_block(entry_path, block)
+            if data is not None:
+                with self._lock:
+                    self.hits += 1
+                    self.bytes_from_cache += len(data)
+
+                blocks = [(block, data)]
+            else:
+                # Fetch the run of missing blocks in one remote read
+                run_end = block
+                while run_end < last_block and not os.path.exists(
+                        self._block_path(entry_path, run_end + 1)):
+                    run_end += 1
+
+                blocks = self._fetch_blocks(entry_path, block, run_end, size,
+                                            fetch)
+
+            for (block, data) in blocks:
+                block_start = block * self.block_size
+                yield data[max(offset - block_start, 0):
+                           end_byte - block_start]
+
+            block += 1
+
+    def stats(self):
+        with self._lock:
+            self._ensure_index()
+            requests = self.hits + self.misses
+
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRate': float(self.hits) / requests if requests else 0.0,
+                'bytesFromCache': self.bytes_from_cache,
+                'bytesFetched': self.bytes_fetched,
+                'evictions': self.evictions,
+                'size': self._size,
+                'maxSize': self.max_size
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_download_cache():
+    """
+    Returns the download cache for this process, or None if downloadCache.path
+    isn't set in the cumulus configuration.
+    """
+    global _cache
+
+    with _cache_lock:
+        if _cache is None:
+            path = get_property('downloadCache.path', cumulus.config)
+            if not path:
+                return None
+
+            _cache = DownloadCache(
+                path,
+                max_size=get_property('downloadCache.maxSize', cumulus.config,
+                                      default=DEFAULT_MAX_SIZE),
+                block_size=get_property('downloadCache.blockSize',
+                                        cumulus.config,
+                                        default=DEFAULT_BLOCK_SIZE))
+
+    return _cache
@@ -19,11 +19,16 @@
 
 from __future__ import absolute_import
 import datetime
+import logging
+import os
+from collections import OrderedDict, defaultdict
 from bson.objectid import ObjectId, InvalidId
+from pymongo import ReturnDocument, UpdateOne
 
+from girder import events
 from girder.api.rest import ModelImporter, RestException, getCurrentUser
-from girder.models.model_base import ValidationException
-from girder.constants import AccessType
+from girder.models.model_base import Model, ValidationException
+from girder.constants import AccessType, SortDir
 
 import cumulus
 from cumulus.constants import ClusterType
@@ -100,6 +105,17 @@ def send_status_notification(resource_type, resource):
     create_notifications(resource_type, 'status', notification, resource)
 
 
+def to_log_records(body):
+    """
+    Log endpoints accept a single record or, so clients can batch them, a list
+    of records. Returns the list of records.
+    """
+    if isinstance(body, list):
+        return body
+
+    return [body]
+
+
 def send_log_notification(resource_name, resource, log):
     notification = {
         '_id': resource['_id'],
@@ -122,3 +138,356 @@ def check_group_membership(user, group):
     if 'groups' not in user or ObjectId(group_id) not in user['groups']:
         raise RestException('The user is not in the required group.',
                             code=403)
+
+
+class LogModel(Model):
+    """
+    Base class for models storing log records outside of the document they
+    belong to. Each record is stored in its own document, keyed by the type
+    and id of the resource it belongs to. Records are numbered using a per log
+    sequence, so they are returned in the order they were added even when
+    they are added by different processes. Subclasses should set the
+    collection name and then call this initialize().
+    """
+
+    # Bumped when migrate(...) needs to run again
+    MIGRATION_VERSION = 1
+
+    def initialize(self):
+        self.ensureIndices([
+            ([('resourceType', 1), ('resourceId', 1), ('seq', 1)], {})
+        ])
+
+    def validate(self, doc):
+        return doc
+
+    @property
+    def _meta(self):
+        # Holds the sequence counter of each log and the migration state
+        return self.collection.database['%s_meta' % self.name]
+
+    def _sequence_id(self, resource_type, resource_id):
+        return 'seq.%s.%s' % (resource_type, resource_id)
+
+    def _reserve(self, resource_type, resource_id, count):
+        """
+        Reserve count sequence numbers for a log.
+
+        :returns: The first number reserved.
+        """
+        doc = self._meta.find_one_and_update(
+            {'_id': self._sequence_id(resource_type, resource_id)},
+            {'$inc': {'seq': count}}, upsert=True,
+            return_document=ReturnDocument.AFTER)
+
+        return doc['seq'] - count + 1
+
+    def _to_doc(self, resource_type, resource_id, record, seq):
+        levelno = None
+        if isinstance(record, dict):
+            levelno = record.get('levelno')
+
+        return {
+            'resourceType': resource_type,
+            'resourceId': ObjectId(resource_id),
+            'seq': seq,
+            'levelno': levelno,
+            'record': record
+        }
+
+    def append(self, resource_type, resource_id, record):
+        """
+        Add a log record to a resource's log.
+        """
+        self.append_many(resource_type, resource_id, [record])
+
+    def append_many(self, resource_type, resource_id, records):
+        """
+        Add a batch of log records to a resource's log, the records are
+        inserted in a single operation and keep their order.
+        """
+        if records:
+            seq = self._reserve(resource_type, resource_id, len(records))
+            self.collection.insert_many(
+                [self._to_doc(resource_type, resource_id, record, seq + i)
+                 for (i, record) in enumerate(records)])
+
+    def records(self, resource_type, resource_id, offset=0, limit=0,
+                after=None, level=None):
+        """
+        Returns a cursor over the log documents for a resource, the record
+        itself is in the 'record' field.
+
+        :param offset: The number of records to skip.
+        :param limit: The maximum number of records to return, 0 for no limit.
+        :param after: Only return records added after the record with this
+                      sequence number.
+        :param level: Only return records with at least this level (levelno).
+        """
+        query = {
+            'resourceType': resource_type,
+            'resourceId': ObjectId(resource_id)
+        }
+        if after is not None:
+            query['seq'] = {'$gt': after}
+        if level is not None:
+            query['levelno'] = {'$gte': level}
+
+        return self.find(query, offset=offset, limit=limit,
+                         sort=[('seq', SortDir.ASCENDING)],
+                         fields=['seq', 'record'])
+
+    def remove_records(self, resource_type, resource_id):
+        self.remove_many_records(resource_type, [resource_id])
+
+    def remove_many_records(self, resource_type, resource_ids):
+        """
+        Remove the logs of several resources of the same type.
+        """
+        resource_ids = [ObjectId(resource_id) for resource_id in resource_ids]
+        if not resource_ids:
+            return
+
+        self.removeWithQuery({
+            'resourceType': resource_type,
+            'resourceId': {'$in': resource_ids}
+        })
+        self._meta.delete_many({
+            '_id': {
+                '$in': [self._sequence_id(resource_type, resource_id)
+                        for resource_id in resource_ids]
+            }
+        })
+
+    def migrate(self, resource_type, model):
+        """
+        Move any log records still embedded in the 'log' array of documents
+        of model into this collection. This only scans model once, the
+        migration is recorded when it completes. The embedded records are
+        numbered from -n to -1, so they come before any records added
+        since, and are upserted, so the copy can be safely repeated if we are
+        interrupted before the embedded log is removed.
+        """
+        migration_id = 'migration.%s' % resource_type
+        migration = self._meta.find_one({'_id': migration_id})
+        if migration and migration.get('version', 0) >= self.MIGRATION_VERSION:
+            return
+
+        cursor = model.find({'log': {'$exists': True}}, fields=['log'])
+        for doc in cursor:
+            records = doc.get('log') or []
+            if records:
+                requests = []
+                for (i, record) in enumerate(records):
+                    log_doc = self._to_doc(resource_type, doc['_id'], record,
+                                           i - len(records))
+                    requests.append(UpdateOne({
+                        'resourceType': log_doc['resourceType'],
+                        'resourceId': log_doc['resourceId'],
+                        'seq': log_doc['seq']
+                    }, {'$setOnInsert': log_doc}, upsert=True))
+                self.collection.bulk_write(requests)
+            model.update({'_id': doc['_id']}, {'$unset': {'log': ''}})
+
+        self._meta.update_one(
+            {'_id': migration_id},
+            {'$set': {'version': self.MIGRATION_VERSION}}, upsert=True)
+
+
+def log_response(log_model, resource_type, resource_id, params):
+    """
+    Build the response for a GET .../log request. Supports offset and cursor
+    ( after ) based pagination and filtering by level. If a limit is given the
+    response includes the cursor to use to fetch the next page.
+    """
+    try:
+        offset = int(params.get('offset', 0))
+        limit = int(params.get('limit', 0))
+    except ValueError:
+        raise RestException('offset and limit must be integers.', code=400)
+
+    level = params.get('level')
+    if level is not None:
+        try:
+            level = int(level)
+        except ValueError:
+            level = logging.getLevelName(level.upper())
+            if not isinstance(level, int):
+                raise RestException('Invalid log level: %s' % params['level'],
+                                    code=400)
+
+    after = params.get('after')
+    if after is not None:
+        try:
+            after = int(after)
+        except ValueError:
+            raise RestException('Invalid cursor: %s' % after, code=400)
+
+    docs = list(log_model.records(resource_type, resource_id, offset=offset,
+                                  limit=limit, after=after, level=level))
+    response = {
+        'log': [doc['record'] for doc in docs]
+    }
+
+    if limit:
+        next_cursor = None
+        if len(docs) == limit:
+            next_cursor = str(docs[-1]['seq'])
+        response['next'] = next_cursor
+
+    return response
+
+
+def _create_folders(user, parent, paths):
+    folder_model = ModelImporter.model('folder')
+    folders = {
+        '.': parent
+    }
+
+    def folder(path):
+        if path not in folders:
+            (parent_path, name) = os.path.split(path)
+            parent_folder = folder(parent_path or '.')
+            try:
+                folders[path] = folder_model.createFolder(
+                    parent_folder, name, parentType='folder', creator=user,
+                    reuseExisting=True)
+            except ValidationException:
+                # Created by a concurrent request
+                folders[path] = folder_model.createFolder(
+                    parent_folder, name, parentType='folder', creator=user,
+                    reuseExisting=True)
+
+        return folders[path]
+
+    return {path: folder(path) for path in paths}
+
+
+def _item_doc(user, folder, name, now):
+    return {
+        'name': name,
+        'lowerName': name.lower(),
+        'description': '',
+        'folderId': folder['_id'],
+        'creatorId': user['_id'],
+        'baseParentType': folder['baseParentType'],
+        'baseParentId': folder['baseParentId'],
+        'created': now,
+        'updated': now,
+        'size': 0,
+        'meta': {}
+    }
+
+
+def _file_doc(user, assetstore, item, entry):
+    file_model = ModelImporter.model('file')
+    doc = file_model.createFile(
+        name=entry['name'], creator=user, item=item, assetstore=assetstore,
+        mimeType=entry.get('mimeType'), size=int(entry['size']),
+        saveFile=False)
+    doc['path'] = entry['path']
+    doc['imported'] = True
+
+    return file_model.validate(doc)
+
+
+def _insert_many(model, docs):
+    """
+    Insert documents without going through Model.save one at a time, the
+    save events are still triggered for each document.
+    """
+    for doc in docs:
+        events.trigger('model.%s.save' % model.name, doc)
+
+    # Sets the _id of each document
+    model.collection.insert_many(docs)
+
+    for doc in docs:
+        events.trigger('model.%s.save.after' % model.name, doc)
+
+
+def _propagate_sizes(items, files):
+    """
+    Add the size of newly created files to their items, folders and the
+    collection or user the folders are in, a single update per document.
+    """
+    item_sizes = defaultdict(int)
+    folder_sizes = defaultdict(int)
+    base_sizes = defaultdict(int)
+    for file in files:
+        item = items[file['itemId']]
+        item_sizes[item['_id']] += file['size']
+        folder_sizes[item['folderId']] += file['size']
+        base_sizes[(item['baseParentType'], item['baseParentId'])] += \
+            file['size']
+
+    item_model = ModelImporter.model('item')
+    item_model.collection.bulk_write([
+        UpdateOne({'_id': item_id}, {'$inc': {'size': size}})
+        for (item_id, size) in item_sizes.items()])
+
+    folder_model = ModelImporter.model('folder')
+    for (folder_id, size) in folder_sizes.items():
+        folder_model.increment(query={'_id': folder_id}, field='size',
+                               amount=size, multi=False)
+
+    for ((base_type, base_id), size) in base_sizes.items():
+        ModelImporter.model(base_type).increment(
+            query={'_id': base_id}, field='size', amount=size, multi=False)
+
+
+def create_imported_files(user, assetstore, parent, files):
+    """
+    Create a batch of imported files in an assetstore, along with any folders
+    and items they need. Folders, items and files that already exist are
+    reused. The items and files are looked up and inserted a folder at a time
+    rather than a file at a time, and the sizes of the items and folders are
+    updated once for the batch.
+
+    :param user: The user creating the files.
+    :param assetstore: The assetstore holding the files.
+    :param parent: The folder the folder paths of the files are relative to.
+    :param files: The files to create, each with the folder path, the name,
+        size and full path of the file and optionally its mimeType.
+    """
+    item_model = ModelImporter.model('item')
+    file_model = ModelImporter.model('file')
+
+    by_folder = OrderedDict()
+    for entry in files:
+        path = os.path.normpath(entry['folder'])
+        by_folder.setdefault(path, OrderedDict())[entry['name']] = entry
+
+    folders = _create_folders(user, parent, by_folder.keys())
+    now = datetime.datetime.utcnow()
+    new_files = []
+    file_items = {}
+
+    for (path, entries) in by_folder.items():
+        folder = folders[path]
+        names = list(entries.keys())
+        items = {item['name']: item for item in item_model.find({
+            'folderId': folder['_id'],
+            'name': {'$in': names}
+        })}
+
+        new_items = [_item_doc(user, folder, name, now)
+                     for name in names if name not in items]
+        if new_items:
+            _insert_many(item_model, new_items)
+            items.update({item['name']: item for item in new_items})
+
+        existing = {(f['itemId'], f['name']) for f in file_model.find({
+            'itemId': {'$in': [item['_id'] for item in items.values()]},
+            'name': {'$in': names}
+        }, fields=['itemId', 'name'])}
+
+        for (name, entry) in entries.items():
+            item = items[name]
+            if (item['_id'], name) not in existing:
+                new_files.append(_file_doc(user, assetstore, item, entry))
+                file_items[item['_id']] = item
+
+    if new_files:
+        _insert_many(file_model, new_files)
+        _propagate_sizes(file_items, new_files)
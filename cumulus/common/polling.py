@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import time
+
+import cumulus
+from cumulus.constants import JobState
+from cumulus.common.jsonpath import get_property
+
+# Used when monitoring a remote process ( upload/download etc. )
+PROCESS = 'process'
+
+# state => factor the interval is multiplied by on each poll without a change
+DEFAULT_BACKOFF = {
+    JobState.QUEUED: 2.0,
+    JobState.RUNNING: 1.5,
+    PROCESS: 1.5
+}
+
+# state => the maximum interval in seconds
+DEFAULT_MAX_INTERVAL = {
+    JobState.QUEUED: 300,
+    JobState.RUNNING: 60,
+    PROCESS: 60
+}
+
+# Used for states that are not listed above
+DEFAULT_STATE_BACKOFF = 1.0
+DEFAULT_STATE_MAX_INTERVAL = 30
+
+
+def _backoff(state):
+    return get_property('monitor.backoff.%s' % state, cumulus.config,
+                        default=DEFAULT_BACKOFF.get(state,
+                                                    DEFAULT_STATE_BACKOFF))
+
+
+def _max_interval(state):
+    return get_property('monitor.maxInterval.%s' % state, cumulus.config,
+                        default=DEFAULT_MAX_INTERVAL.get(
+                            state, DEFAULT_STATE_MAX_INTERVAL))
+
+
+def next_interval(state, interval, previous_interval=None,
+                  state_changed=False, estimated_start=None):
+    """
+    Calculate how long to wait before polling again. We poll at the base
+    interval right after a state change, then back off exponentially while the
+    state stays the same, never exceeding the maximum interval for the state.
+    The backoff factor and maximum interval for each state can be set in the
+    monitor section of the configuration.
+
+    :param state: The current state, a job state or PROCESS.
+    :param interval: The base interval in seconds.
+    :param previous_interval: The interval used before the last poll, None if
+                              this is the first poll.
+    :param state_changed: True if the state changed on the last poll.
+    :param estimated_start: The time, in seconds since the epoch, the scheduler
+                            expects a queued job to start, if known.
+    :returns: The number of seconds to wait before polling again.
+    """
+    maximum = max(_max_interval(state), interval)
+
+    if previous_interval is None or state_changed:
+        next_poll = interval
+    else:
+        next_poll = min(previous_interval * _backoff(state), maximum)
+
+    # No point polling before the job is expected to start, but we still poll
+    # at the maximum interval in case the estimate was too pessimistic.
+    if estimated_start is not None:
+        until_start = estimated_start - time.time()
+        next_poll = min(max(until_start, interval), maximum)
+
+    return next_poll
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+from __future__ import absolute_import
+import hashlib
+import os
+import threading
+
+import six
+from jinja2 import BaseLoader, ChoiceLoader, Environment, PackageLoader, \
+    TemplateNotFound
+from jinja2.utils import LRUCache
+
+import cumulus
+from cumulus.common.jsonpath import get_property
+
+# The number of compiled templates to keep, job commands are compiled as
+# templates so there can be many distinct sources.
+DEFAULT_CACHE_SIZE = 1000
+
+# Scheduler templates are included by the submission script using this name
+SCHEDULER_TEMPLATE = 'schedulers/%s.sh'
+
+
+def _source_hash(source):
+    if isinstance(source, six.text_type):
+        source = source.encode('utf8')
+
+    return hashlib.sha1(source).hexdigest()
+
+
+class _CompilingLoader(BaseLoader):
+    """
+    Wraps a loader so the templates it loads are compiled by the registry.
+    """
+
+    def __init__(self, registry, loader):
+        self._registry = registry
+        self._loader = loader
+
+    def get_source(self, environment, template):
+        return self._loader.get_source(environment, template)
+
+    def list_templates(self):
+        return self._loader.list_templates()
+
+    def load(self, environment, name, globals=None):
+        (source, filename, uptodate) = self.get_source(environment, name)
+
+        return self._registry._from_source(source, name, filename, globals,
+                                           uptodate)
+
+
+class _SchedulerLoader(BaseLoader):
+    """
+    Loads the scheduler templates registered in the configuration, the
+    scheduler.templates section maps a scheduler type to the path of the
+    template to use in place of the one shipped with cumulus.
+    """
+
+    def get_source(self, environment, template):
+        for (scheduler_type, path) in get_property(
+                'scheduler.templates', cumulus.config, default={}).items():
+            if template == SCHEDULER_TEMPLATE % scheduler_type:
+                break
+        else:
+            raise TemplateNotFound(template)
+
+        if not os.path.isfile(path):
+            raise TemplateNotFound(template)
+
+        mtime = os.path.getmtime(path)
+        with open(path, 'rb') as fp:
+            source = fp.read().decode('utf8')
+
+        def uptodate():
+            try:
+                return os.path.getmtime(path) == mtime
+            except OSError:
+                return False
+
+        return (source, path, uptodate)
+
+
+class TemplateRegistry(object):
+    """
+    Compiles templates once and caches the result by a hash of their source,
+    so the same source is never compiled twice, whether it is loaded by name
+    or passed as a string. Named templates are looked up in the scheduler
+    templates registered in the configuration and then in the templates
+    shipped with cumulus.
+    """
+
+    def __init__(self, cache_size=DEFAULT_CACHE_SIZE):
+        self._compiled = LRUCache(cache_size)
+        self.environment = Environment(loader=_CompilingLoader(
+            self, ChoiceLoader([
+                _SchedulerLoader(),
+                PackageLoader('cumulus', 'templates')
+            ])))
+
+    def _compile(self, source, name=None, filename=None):
+        key = (name, _source_hash(source))
+        code = self._compiled.get(key)
+        if code is None:
+            code = self.environment.compile(source, name, filename)
+            self._compiled[key] = code
+
+        return code
+
+    def _from_source(self, source, name=None, filename=None, globals=None,
+                     uptodate=None):
+        code = self._compile(source, name, filename)
+        globals = self.environment.make_globals(globals)
+
+        return self.environment.template_class.from_code(
+            self.environment, code, globals, uptodate)
+
+    def get_template(self, name):
+        """
+        Returns the named template.
+        """
+        return self.environment.get_template(name)
+
+    def from_string(self, source):
+        """
+        Returns a template for source.
+        """
+        return self._from_source(source)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_template_registry():
+    """
+    Returns the template registry for this process.
+    """
+    global _registry
+
+    with _registry_lock:
+        if _registry is None:
+            _registry = TemplateRegistry(
+                cache_size=get_property(
+                    'templates.cacheSize', cumulus.config,
+                    default=DEFAULT_CACHE_SIZE))
+
+    return _registry
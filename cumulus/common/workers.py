@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+from __future__ import absolute_import
+import itertools
+import sys
+import threading
+
+import six
+from six.moves import queue
+
+# Sorts after any real work so workers only see it once the queue is drained
+_STOP_PRIORITY = float('inf')
+
+
+class WorkerPool(object):
+    """
+    A bounded pool of threads processing work items in priority order, lowest
+    first. Work can be submitted before the pool is entered or by the work
+    itself while it is running. Leaving the with block waits for all the work
+    to be done. If any work item raises, the remaining items are skipped and
+    the first exception is re-raised in the thread leaving the block.
+
+        with WorkerPool(4) as pool:
+            for f in files:
+                pool.submit(upload, (f,), priority=-f['size'])
+
+    :param max_workers: The number of threads to use.
+    :param context: Optional callable returning a context manager, entered once
+                    by each thread, the value it yields is passed as the first
+                    argument to each work item run on that thread. This is
+                    useful for per-thread connections.
+    """
+
+    def __init__(self, max_workers, context=None):
+        self._max_workers = max(1, max_workers)
+        self._context = context
+        self._queue = queue.PriorityQueue()
+        self._counter = itertools.count()
+        self._threads = []
+        self._error = None
+        self._error_lock = threading.Lock()
+
+    def submit(self, func, args=(), priority=0):
+        """
+        Queue func(*args) to run on the pool.
+        """
+        self._queue.put((priority, next(self._counter), func, args))
+
+    def _set_error(self):
+        with self._error_lock:
+            if self._error is None:
+                self._error = sys.exc_info()
+
+    def _run_items(self, context_value=None):
+        while True:
+            (priority, _, func, args) = self._queue.get()
+            try:
+                if priority == _STOP_PRIORITY:
+                    return True
+
+                # Skip the remaining work once something has failed
+                if self._error is not None:
+                    continue
+
+                if self._context is not None:
+                    args = (context_value,) + tuple(args)
+
+                func(*args)
+            except Exception:
+                self._set_error()
+            finally:
+                self._queue.task_done()
+
+    def _run(self):
+        stopped = False
+        try:
+            if self._context is None:
+                stopped = self._run_items()
+            else:
+                with self._context() as context_value:
+                    stopped = self._run_items(context_value)
+        except Exception:
+            self._set_error()
+
+        # The context couldn't be entered, the remaining items will be skipped
+        # but still need to be taken off the queue.
+        if not stopped:
+            self._run_items()
+
+    def __enter__(self):
+        for _ in range(self._max_workers):
+            thread = threading.Thread(target=self._run)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+        return self
+
+    def __exit__(self, type, value, traceback):
+        # Skip any remaining work if the with block failed
+        if type is not None:
+            with self._error_lock:
+                if self._error is None:
+                    self._error = (type, value, traceback)
+
+        # Work items can submit more work, so only stop the threads once
+        # everything has been processed.
+        self._queue.join()
+        for _ in self._threads:
+            self._queue.put((_STOP_PRIORITY, next(self._counter), None, ()))
+        for thread in self._threads:
+            thread.join()
+
+        if type is None and self._error is not None:
+            six.reraise(*self._error)
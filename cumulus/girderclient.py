@@ -17,60 +17,225 @@
 #  limitations under the License.
 ###############################################################################
 
+from __future__ import absolute_import
 import requests
-from requests_toolbelt import MultipartEncoder
+from requests.adapters import HTTPAdapter
 import os
 import json
 import argparse
 import sys
-import zipfile
-import tempfile
-import shutil
 import errno
+import stat
 import time
 import re
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 max_chunk_size = 1024 * 1024 * 64
 
+# The size of the chunks downloads are written in
+download_chunk_size = 1024 * 1024
+# The number of files downloaded concurrently
+default_download_workers = 4
+# The number of files uploaded concurrently
+default_upload_workers = 4
+# The block size used to stream a chunk from a file
+upload_block_size = 1024 * 1024
+# Records the uploads in progress so an interrupted upload can be resumed,
+# kept in the directory the uploader is run from. A JSON line is appended for
+# each change.
+upload_journal = '.girder_upload.jsonl'
+# The number of files to fetch per request when listing an item
+file_page_size = 50
+# Suffix of files that are still being downloaded
+partial_suffix = '.part'
+# Link types supported by the input cache
+hard_link = 'hard'
+symbolic_link = 'symbolic'
+
 
 class GirderBase(object):
 
-    def __init__(self, girder_token):
+    def __init__(self, girder_token, max_workers=1):
         self._girder_token = girder_token
         self._headers = {'Girder-Token': self._girder_token}
+        self._max_workers = max(1, max_workers)
+        # Shared by the worker threads, so keep a connection for each
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self._max_workers,
+                              pool_maxsize=self._max_workers)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
 
     def check_status(self, request):
-        if request.status_code != 200:
+        # 206 is returned for range requests
+        if request.status_code not in (200, 206):
             if request.headers['Content-Type'] == 'application/json':
                 print >> sys.stderr, request.json()
             request.raise_for_status()
 
+    def _run_pool(self, func, work):
+        """
+        Call func with each of the items in work using a pool of threads. If
+        any call raises the remaining items are skipped and the first
+        exception is raised once the running calls have finished.
+        """
+        items = queue.Queue()
+        for w in work:
+            items.put(w)
 
-class DirectoryUploader(GirderBase):
+        errors = []
+
+        def run():
+            while not errors:
+                try:
+                    w = items.get_nowait()
+                except queue.Empty:
+                    return
+
+                try:
+                    func(w)
+                except Exception:
+                    errors.append(sys.exc_info())
+
+        threads = []
+        for _ in range(min(self._max_workers, len(work))):
+            thread = threading.Thread(target=run)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            (type, value, traceback) = errors[0]
+            raise value
+
+
+class _FileSection(object):
+    """
+    A read only view of length bytes of a file starting at offset, used to
+    stream a chunk of a file as a request body without reading it into
+    memory.
+    """
+
+    def __init__(self, fp, offset, length):
+        self._fp = fp
+        self._fp.seek(offset)
+        self._remaining = length
+        self._length = length
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        if size < 0 or size > self._remaining:
+            size = self._remaining
 
-    def __init__(self, girder_token, base_url, job_id):
-        self._dir = dir
+        data = self._fp.read(min(size, upload_block_size))
+        self._remaining -= len(data)
+
+        return data
+
+
+class DirectoryUploader(GirderBase):
+    """
+    Uploads a job's output paths to Girder. Several files are uploaded
+    concurrently, each streamed in chunks straight from disk. Chunks of a file
+    have to be sent in order so each file is uploaded by a single thread.
+    Uploads in progress are recorded in a journal, so if the uploader is
+    restarted completed files are skipped and partial uploads are resumed
+    from the offset Girder has received.
+    """
+
+    def __init__(self, girder_token, base_url, job_id,
+                 max_workers=default_upload_workers):
         self._base_url = base_url
         self._job_id = job_id
-        super(DirectoryUploader, self).__init__(girder_token)
+        self._journal = {}
+        self._journal_file = None
+        self._journal_lock = threading.Lock()
+        super(DirectoryUploader, self).__init__(girder_token,
+                                                max_workers=max_workers)
+
+    def _load_journal(self):
+        """
+        Replay the journal, a line of [path, state] is appended for each
+        change, so later lines replace earlier ones.
+        """
+        self._journal = {}
+        try:
+            with open(upload_journal) as fp:
+                for line in fp:
+                    try:
+                        (path, state) = json.loads(line)
+                    except ValueError:
+                        # The last line can be half written if we were killed
+                        continue
+                    self._journal[path] = state
+        except IOError:
+            pass
+
+    def _open_journal(self):
+        """
+        Compact the journal loaded by _load_journal(...), which also drops any
+        half written line, and open it to append to.
+        """
+        journal_tmp = '%s.tmp' % upload_journal
+        with open(journal_tmp, 'w') as fp:
+            for (path, state) in self._journal.items():
+                fp.write('%s\n' % json.dumps([path, state]))
+        os.rename(journal_tmp, upload_journal)
+
+        self._journal_file = open(upload_journal, 'a')
+
+    def _update_journal(self, path, state):
+        line = '%s\n' % json.dumps([path, state])
+        with self._journal_lock:
+            self._journal[path] = state
+            self._journal_file.write(line)
+            self._journal_file.flush()
 
     def run(self):
         job_url = '%s/jobs/%s' % (self._base_url, self._job_id)
 
-        r = requests.get(job_url, headers=self._headers)
+        r = self._session.get(job_url, headers=self._headers)
         self.check_status(r)
 
         job = r.json()
 
+        self._load_journal()
+
         start = time.time()
 
+        files = []
         for i in job['output']:
 
             if 'itemId' in i and 'path' in i:
                 item_id = i['itemId']
                 path_spec = i['path']
                 exclude_regex = i.get('exclude', None)
-                self._upload(item_id, path_spec, exclude_regex=exclude_regex)
+                files += self._files(item_id, path_spec,
+                                     exclude_regex=exclude_regex)
+
+        stats = []
+
+        def upload(file):
+            file_stats = self._upload_file(*file)
+            if file_stats is not None:
+                stats.append(file_stats)
+
+        # Largest first so the big files aren't left until the end
+        files.sort(key=lambda f: os.path.getsize(f[1]), reverse=True)
+        self._open_journal()
+        try:
+            self._run_pool(upload, files)
+        finally:
+            self._journal_file.close()
 
         end = time.time()
 
@@ -78,34 +243,82 @@ class DirectoryUploader(GirderBase):
 
         updates = {
             'timings': {
-                'upload': int(round(upload_time * 1000))
+                'upload': int(round(upload_time * 1000)),
+                'uploadFiles': stats
             }
         }
 
-        r = requests.patch(job_url, json=updates, headers=self._headers)
+        r = self._session.patch(job_url, json=updates, headers=self._headers)
         self.check_status(r)
 
-    def _upload_file(self, name, path, parent_id):
-        datalen = os.path.getsize(path)
+        # Everything is uploaded, nothing left to resume
+        if os.path.exists(upload_journal):
+            os.remove(upload_journal)
+
+    def _upload_offset(self, upload_id):
+        """
+        Returns the offset Girder has received up to for an upload, or None
+        if the upload no longer exists.
+        """
+        r = self._session.get('%s/file/offset' % self._base_url,
+                              params={'uploadId': upload_id},
+                              headers=self._headers)
+        if r.status_code != 200:
+            return None
 
-        params = {
-            'parentType': 'item',
+        return r.json()['offset']
+
+    def _upload_file(self, name, path, parent_id):
+        """
+        Upload a file, returns the time taken and throughput, or None if the
+        file had already been uploaded.
+        """
+        file_stat = os.stat(path)
+        datalen = file_stat.st_size
+        key = os.path.abspath(path)
+        # The journal is only used if the file hasn't changed
+        state = {
             'parentId': parent_id,
-            'name': name,
-            'size': datalen
+            'size': datalen,
+            'mtime': file_stat.st_mtime
         }
 
-        r = requests.post(
-            '%s/file' % self._base_url, params=params, headers=self._headers)
-        self.check_status(r)
-        obj = r.json()
+        journal_state = self._journal.get(key, {})
+        uploaded = None
+        upload_id = None
+        if all(journal_state.get(k) == v for (k, v) in state.items()):
+            if journal_state.get('complete'):
+                return None
 
-        if '_id' in obj:
-            upload_id = obj['_id']
-        else:
-            raise Exception('Unexpected response: ' + json.dumps(obj))
+            upload_id = journal_state.get('uploadId')
+            if upload_id is not None:
+                uploaded = self._upload_offset(upload_id)
+
+        start = time.time()
+
+        if uploaded is None:
+            params = {
+                'parentType': 'item',
+                'parentId': parent_id,
+                'name': name,
+                'size': datalen
+            }
 
-        uploaded = 0
+            r = self._session.post(
+                '%s/file' % self._base_url, params=params,
+                headers=self._headers)
+            self.check_status(r)
+            obj = r.json()
+
+            if '_id' in obj:
+                upload_id = obj['_id']
+            else:
+                raise Exception('Unexpected response: ' + json.dumps(obj))
+
+            uploaded = 0
+            self._update_journal(key, dict(state, uploadId=upload_id))
+
+        resumed_at = uploaded
 
         with open(path, 'rb') as fp:
             while (uploaded != datalen):
@@ -114,25 +327,40 @@ class DirectoryUploader(GirderBase):
                 if chunk_size > max_chunk_size:
                     chunk_size = max_chunk_size
 
-                part = fp.read(chunk_size)
+                params = {
+                    'uploadId': upload_id,
+                    'offset': uploaded
+                }
 
-                m = MultipartEncoder(
-                    fields=[('uploadId',  upload_id),
-                            ('offset', str(uploaded)),
-                            ('chunk', (name, part, 'application/octet-stream'))]
+                r = self._session.post(
+                    '%s/file/chunk' % self._base_url, params=params,
+                    data=_FileSection(fp, uploaded, chunk_size),
+                    headers=self._headers)
+                self.check_status(r)
 
-                )
+                uploaded += chunk_size
 
-                headers = self._headers.copy()
-                headers['Content-Type'] = m.content_type
+        self._update_journal(key, dict(state, complete=True))
 
-                r = requests.post('%s/file/chunk' % self._base_url,
-                                  params=params, data=m, headers=headers)
-                self.check_status(r)
+        upload_time = max(time.time() - start, 0.001)
 
-                uploaded += chunk_size
+        return {
+            'path': name,
+            'size': datalen,
+            'time': int(round(upload_time * 1000)),
+            # Bytes per second, of the data sent by this run
+            'throughput': int((datalen - resumed_at) / upload_time)
+        }
+
+    def _files(self, parent_id, path, exclude_regex=None):
+        """
+        Returns the (name, path, parent id) of each file to upload for an
+        output path.
+        """
+        files = []
+        if exclude_regex:
+            exclude_regex = re.compile(exclude_regex)
 
-    def _upload(self, parent_id, path, exclude_regex=None):
         if os.path.isdir(path):
             for root, _, file_list in os.walk(path):
                 for filename in file_list:
@@ -142,22 +370,187 @@ class DirectoryUploader(GirderBase):
                     if not path.startswith('/'):
                         name = os.path.relpath(file_path, os.getcwd())
 
-                    if exclude_regex and re.compile(exclude_regex).match(name):
+                    if exclude_regex and exclude_regex.match(name):
                         continue
 
-                    self._upload_file(name, file_path, parent_id)
+                    # Don't upload our own bookkeeping
+                    if filename.startswith(upload_journal):
+                        continue
+
+                    files.append((name, file_path, parent_id))
         else:
-            self._upload_file(path, path, parent_id)
+            files.append((path, path, parent_id))
+
+        return files
+
+
+class InputCache(object):
+    """
+    The cluster side of the content addressed input cache, see
+    cumulus.transport.files.cache.InputCache, the two share the same layout.
+    Content is stored in blobs/<sha512> and linked into the job directory,
+    downloads that miss are linked into the cache once complete. Cached
+    content is made read-only so a job can't modify it in place. The least
+    recently used content is evicted when the cache exceeds max_size bytes,
+    content still linked into a job directory is kept.
+    """
+
+    def __init__(self, path, max_size, link=hard_link):
+        self._blobs = os.path.join(os.path.abspath(path), 'blobs')
+        self._max_size = max_size
+        self._link = link
+        self._lock = threading.Lock()
+        self._content_locks = {}
+        self._used = set()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.evicted = 0
 
+        try:
+            os.makedirs(self._blobs)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
 
-class JobInputDownloader(GirderBase):
+    def _blob_path(self, sha512):
+        return os.path.join(self._blobs, sha512)
+
+    def _replace_with_link(self, source, dest):
+        # Link under a temporary name and rename, so dest is never missing
+        # or half written.
+        tmp = '%s.%s.tmp' % (dest, threading.current_thread().ident)
+        if self._link == hard_link:
+            os.link(source, tmp)
+        else:
+            os.symlink(source, tmp)
+        os.rename(tmp, dest)
+
+    def _link_to(self, sha512, dest):
+        blob = self._blob_path(sha512)
+        try:
+            self._replace_with_link(blob, dest)
+            # Mark the content as recently used
+            os.utime(blob, None)
+        except OSError:
+            return False
+
+        return True
+
+    def _make_read_only(self, path):
+        mode = os.stat(path).st_mode
+        os.chmod(path, mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
 
-    def __init__(self, girder_token, base_url, job_id, dest):
+    def _add(self, sha512, path):
+        blob = self._blob_path(sha512)
+        try:
+            # A hard link shares the mode of the file it links to, so the
+            # file is made read-only before it appears in the cache.
+            self._make_read_only(path)
+            if self._link == hard_link:
+                self._replace_with_link(path, blob)
+            else:
+                os.rename(path, blob)
+                try:
+                    os.symlink(blob, path)
+                except OSError:
+                    os.rename(blob, path)
+                    raise
+        except OSError as ex:
+            # For example the cache is on a different file system
+            print >> sys.stderr, 'Unable to cache %s: %s' % (path, ex)
+
+    def stage(self, file, dest, download):
+        """
+        Stage a Girder file at dest from the cache, calling download on a
+        miss. Returns True if the file was in the cache.
+        """
+        sha512 = file.get('sha512')
+        if not sha512:
+            download()
+            return False
+
+        with self._lock:
+            self._used.add(sha512)
+            content_lock = self._content_locks.setdefault(sha512,
+                                                          threading.Lock())
+
+        with content_lock:
+            hit = self._link_to(sha512, dest)
+            if not hit:
+                download()
+                self._add(sha512, dest)
+
+        with self._lock:
+            if hit:
+                self.hits += 1
+                self.bytes_saved += file['size']
+            else:
+                self.misses += 1
+
+        return hit
+
+    def evict(self):
+        """
+        Remove the least recently used content until the cache is within its
+        size budget. Content used by this run or still linked into a job
+        directory is kept. With symbolic links there is no way to tell if
+        content is still linked, so nothing is evicted.
+        """
+        if self._link == symbolic_link:
+            return
+
+        blobs = []
+        for name in os.listdir(self._blobs):
+            try:
+                s = os.stat(os.path.join(self._blobs, name))
+            except OSError:
+                continue
+            blobs.append((s.st_mtime, s.st_size, s.st_nlink, name))
+
+        size = sum([b[1] for b in blobs])
+        for (_, blob_size, links, name) in sorted(blobs):
+            if size <= self._max_size:
+                break
+
+            if name in self._used or links > 1:
+                continue
+
+            try:
+                os.remove(os.path.join(self._blobs, name))
+            except OSError:
+                continue
+
+            size -= blob_size
+            self.evicted += 1
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'bytesSaved': self.bytes_saved,
+            'evicted': self.evicted
+        }
+
+
+class JobInputDownloader(GirderBase):
+    """
+    Downloads a job's input items into its directory. Each file is streamed
+    straight to its destination, several files at a time. Files are written to
+    a .part file that is renamed once complete, so if the download is
+    restarted files that are already complete are skipped and partial ones are
+    resumed using a range request.
+    """
+
+    def __init__(self, girder_token, base_url, job_id, dest,
+                 max_workers=default_download_workers, cache=None):
         self._girder_token = girder_token
         self._base_url = base_url
         self._job_id = job_id
         self._dest = dest
-        super(JobInputDownloader, self).__init__(girder_token)
+        self._cache = cache
+        super(JobInputDownloader, self).__init__(girder_token,
+                                                 max_workers=max_workers)
 
     def _mkdir(self, path):
         try:
@@ -168,77 +561,117 @@ class JobInputDownloader(GirderBase):
             else:
                 raise
 
-    def _download_item(self, item_id, target_path):
-
+    def _item_files(self, item_id):
         item_files_url = '%s/item/%s/files' % (self._base_url, item_id)
-        r = requests.get(item_files_url, headers=self._headers)
-        self.check_status(r)
+        offset = 0
+        while True:
+            params = {
+                'limit': file_page_size,
+                'offset': offset
+            }
+            r = self._session.get(item_files_url, params=params,
+                                  headers=self._headers)
+            self.check_status(r)
+            files = r.json()
 
-        files = r.json()
+            for f in files:
+                yield f
 
-        if len(files) == 1:
-            item_url = '%s/item/%s/download' % (self._base_url, item_id)
-            r = requests.get(item_url, headers=self._headers)
-            self.check_status(r)
-            dest_path = os.path.join(self._dest, target_path, files[0]['name'])
-
-            self._mkdir(os.path.dirname(dest_path))
-            with open(dest_path, 'w') as fp:
-                fp.write(r.content)
-        elif len(files) > 1:
-            # Download the item in zip format
-            item_url = '%s/item/%s/download' % (self._base_url, item_id)
-            r = requests.get(item_url, headers=self._headers, stream=True)
-            self.check_status(r)
-            with tempfile.NamedTemporaryFile(suffix='.zip') as fp:
-                for chunk in r.iter_content(chunk_size=1024):
-                    if chunk:
-                        fp.write(chunk)
+            if len(files) < file_page_size:
+                break
 
-                fp.flush()
-                with zipfile.ZipFile(fp.name, 'r') as files:
-                    dest_path = os.path.join(self._dest, target_path)
+            offset += len(files)
 
-                    temp_dir = None
-                    try:
-                        temp_dir = tempfile.mkdtemp()
-                        files.extractall(temp_dir)
-                        item_dir = os.listdir(temp_dir)
-
-                        if len(item_dir) != 1:
-                            raise Exception(
-                                'Expecting single item directory, got: %s'
-                                % len(item_dir))
-
-                        item_dir = os.path.join(temp_dir, item_dir[0])
-                        if not item_dir.endswith('/'):
-                            item_dir += '/'
-
-                        for dir, subdirs, files in os.walk(item_dir):
-                            for f in files:
-                                src = os.path.join(item_dir, dir, f)
-                                dest = os.path.join(
-                                    dest_path, dir.replace(item_dir, ''), f)
-                                self._mkdir(os.path.dirname(dest))
-                                shutil.copy(src, dest)
-                    finally:
-                        if os.path.exists(temp_dir):
-                            shutil.rmtree(temp_dir)
+    def _download_file(self, file, dest_path):
+        # Already downloaded by a previous run
+        if os.path.isfile(dest_path) and \
+                os.path.getsize(dest_path) == file['size']:
+            return
+
+        self._mkdir(os.path.dirname(dest_path))
+        partial_path = dest_path + partial_suffix
+
+        offset = 0
+        if os.path.isfile(partial_path):
+            offset = os.path.getsize(partial_path)
+            # Not from this file, start again
+            if offset > file['size']:
+                offset = 0
+
+        file_url = '%s/file/%s/download' % (self._base_url, file['_id'])
+        headers = self._headers.copy()
+        if 0 < offset < file['size']:
+            headers['Range'] = 'bytes=%d-' % offset
+
+        r = None
+        try:
+            if offset < file['size']:
+                r = self._session.get(file_url, headers=headers, stream=True)
+                self.check_status(r)
+
+            # Start again if we didn't get a partial response
+            mode = 'ab' if r is None or r.status_code == 206 else 'wb'
+            with open(partial_path, mode) as fp:
+                if r is not None:
+                    for chunk in r.iter_content(chunk_size=download_chunk_size):
+                        if chunk:
+                            fp.write(chunk)
+        finally:
+            if r is not None:
+                r.close()
+
+        if os.path.getsize(partial_path) != file['size']:
+            raise Exception('Incomplete download of %s, expected %d bytes '
+                            'got %d' % (dest_path, file['size'],
+                                        os.path.getsize(partial_path)))
+
+        os.rename(partial_path, dest_path)
+
+    def _download_files(self, files):
+        """
+        Download a list of (file, destination path) pairs using a pool of
+        threads, largest first so the big files aren't left until the end.
+        """
+        files = sorted(files, key=lambda f: f[0]['size'], reverse=True)
+
+        def download(f):
+            (file, dest_path) = f
+            if self._cache is None:
+                self._download_file(file, dest_path)
+            else:
+                self._mkdir(os.path.dirname(dest_path))
+                self._cache.stage(file, dest_path,
+                                  lambda: self._download_file(file, dest_path))
+
+        self._run_pool(download, files)
+
+    def _item_downloads(self, item_id, target_path):
+        """
+        Returns the (file, destination path) pairs for the files in an item,
+        the files are placed directly in target_path.
+        """
+        dest_path = os.path.join(self._dest, target_path)
+
+        return [(f, os.path.join(dest_path, f['name']))
+                for f in self._item_files(item_id)]
 
     def run(self):
         job_url = '%s/jobs/%s' % (self._base_url, self._job_id)
 
-        r = requests.get(job_url, headers=self._headers)
+        r = self._session.get(job_url, headers=self._headers)
         self.check_status(r)
 
         job = r.json()
 
         start = time.time()
 
+        files = []
         for i in job['input']:
             item_id = i['itemId']
             target_path = i['path']
-            self._download_item(item_id, target_path)
+            files += self._item_downloads(item_id, target_path)
+
+        self._download_files(files)
 
         end = time.time()
 
@@ -250,7 +683,11 @@ class JobInputDownloader(GirderBase):
             }
         }
 
-        r = requests.patch(job_url, json=updates, headers=self._headers)
+        if self._cache is not None:
+            self._cache.evict()
+            updates['timings']['downloadCache'] = self._cache.stats()
+
+        r = self._session.patch(job_url, json=updates, headers=self._headers)
         self.check_status(r)
 
 
@@ -271,6 +708,9 @@ def main():
         'upload', help='Upload paths to girder items')
     upload_parser.add_argument(
         '--job', help='The job to upload output for', required=True)
+    upload_parser.add_argument(
+        '--workers', help='The number of files to upload concurrently',
+        type=int, default=default_upload_workers)
 
     # Download
     download_parser = subparsers.add_parser(
@@ -279,14 +719,32 @@ def main():
         '--job', help='The job to download input for', required=True)
     download_parser.add_argument(
         '--dir', help='The target directory', required=True)
+    download_parser.add_argument(
+        '--workers', help='The number of files to download concurrently',
+        type=int, default=default_download_workers)
+    download_parser.add_argument(
+        '--cache-dir', help='The input cache directory, if any')
+    download_parser.add_argument(
+        '--cache-size', help='The input cache size budget in bytes',
+        type=int, default=0)
+    download_parser.add_argument(
+        '--cache-link', help='How to link cached input into the job directory',
+        choices=[hard_link, symbolic_link], default=hard_link)
 
     config = parser.parse_args()
 
     if config.action == 'upload':
-        DirectoryUploader(config.token, config.url, config.job).run()
+        DirectoryUploader(config.token, config.url, config.job,
+                          max_workers=config.workers).run()
     elif config.action == 'download':
+        cache = None
+        if config.cache_dir:
+            cache = InputCache(config.cache_dir, config.cache_size,
+                               link=config.cache_link)
+
         JobInputDownloader(
-            config.token, config.url, config.job, config.dir).run()
+            config.token, config.url, config.job, config.dir,
+            max_workers=config.workers, cache=cache).run()
 
 
 if __name__ == '__main__':
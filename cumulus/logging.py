@@ -18,12 +18,30 @@
 ###############################################################################
 
 from __future__ import absolute_import
+import atexit
 import logging
+import os
 import sys
+import threading
+import time
 import requests
 import json
 import traceback
 import types
+import weakref
+from six.moves import queue
+
+# The maximum number of records sent in a single request
+DEFAULT_BATCH_SIZE = 100
+# The maximum time in seconds a record is buffered before being sent
+DEFAULT_FLUSH_INTERVAL = 1.0
+# How long flush() waits for buffered records to be sent
+FLUSH_TIMEOUT = 30
+
+# Queued to tell the sending thread to send what it has buffered, or to send
+# what it has buffered and exit.
+_FLUSH = object()
+_STOP = object()
 
 
 class LogRecordEncoder(json.JSONEncoder):
@@ -37,25 +55,142 @@ class LogRecordEncoder(json.JSONEncoder):
 
 
 class RESTfulLogHandler(logging.Handler):
+    """
+    Handler that POSTs log records to a Girder log endpoint. Records are
+    buffered and sent in batches, as a JSON array, by a background thread so
+    logging doesn't block on Girder. A batch is sent once batch_size records
+    are buffered or the oldest record has been buffered for flush_interval
+    seconds. Buffered records are also sent when flush() is called, at the end
+    of each Celery task and at exit.
+    """
 
-    def __init__(self, girder_token, url, level=logging.NOTSET):
+    def __init__(self, girder_token, url, level=logging.NOTSET,
+                 batch_size=DEFAULT_BATCH_SIZE,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL):
         super(RESTfulLogHandler, self).__init__(level)
         self._url = url
-        self._headers = {'Girder-Token':  girder_token}
+        self._headers = {
+            'Girder-Token':  girder_token,
+            'Content-Type': 'application/json'
+        }
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._start_lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        _handlers.add(self)
 
-    def emit(self, record):
-        json_str = json.dumps(record.__dict__, cls=LogRecordEncoder)
+    def _ensure_started(self):
+        # The thread doesn't survive a fork so a child process needs its own
+        with self._start_lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _run(self):
+        q = self._queue
+        while True:
+            item = q.get()
+            batch = [item]
+            deadline = time.time() + self._flush_interval
+            while len(batch) < self._batch_size and \
+                    item not in (_FLUSH, _STOP):
+                remaining = deadline - time.time()
+                try:
+                    if remaining > 0:
+                        item = q.get(timeout=remaining)
+                    else:
+                        item = q.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(item)
+
+            records = [r for r in batch if r not in (_FLUSH, _STOP)]
+            try:
+                if records:
+                    self._post(records)
+            finally:
+                for _ in batch:
+                    q.task_done()
+
+            if _STOP in batch:
+                return
+
+    def _post(self, records):
         r = None
         try:
-            r = requests.post(self._url, headers=self._headers, data=json_str)
+            # Imported here as cumulus.common imports this module
+            from cumulus.common.api import get_girder_api
+            r = get_girder_api().post(self._url, headers=self._headers,
+                                      data='[%s]' % ','.join(records))
             r.raise_for_status()
         except requests.exceptions.HTTPError as e:
             if e.response.status_code == 404:
                 sys.stderr.write(
                     'Logging endpoint appears to have disappeared.\n')
             else:
-                raise e
-        except Exception as e:
-            traceback.print_stack()
-            if r:
-                sys.stderr.write('Unable to POST log record: %s\n' % r.content)
+                sys.stderr.write('Unable to POST log records: %s\n'
+                                 % r.content)
+        except Exception:
+            traceback.print_exc()
+            if r is not None:
+                sys.stderr.write('Unable to POST log records: %s\n'
+                                 % r.content)
+
+    def emit(self, record):
+        try:
+            json_str = json.dumps(record.__dict__, cls=LogRecordEncoder)
+        except Exception:
+            self.handleError(record)
+            return
+
+        self._ensure_started()
+        self._queue.put(json_str)
+
+    def flush(self, timeout=FLUSH_TIMEOUT):
+        """
+        Wait for the buffered records to be sent.
+        """
+        if self._pid != os.getpid() or not self._thread.is_alive():
+            return
+
+        self._queue.put(_FLUSH)
+        # Queue.join() doesn't support a timeout so poll
+        deadline = time.time() + timeout
+        while self._queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.01)
+
+    def close(self):
+        if self._pid == os.getpid() and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(FLUSH_TIMEOUT)
+        self._pid = None
+        _handlers.discard(self)
+        super(RESTfulLogHandler, self).close()
+
+
+_handlers = weakref.WeakSet()
+
+
+def flush_handlers():
+    """
+    Send any records buffered by RESTfulLogHandlers in this process.
+    """
+    for handler in list(_handlers):
+        handler.flush()
+
+
+atexit.register(flush_handlers)
+
+try:
+    from celery.signals import task_postrun
+
+    @task_postrun.connect(weak=False)
+    def _task_postrun_handler(**kwargs):
+        flush_handlers()
+except ImportError:
+    pass
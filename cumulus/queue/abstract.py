@@ -17,6 +17,75 @@
 #  limitations under the License.
 ###############################################################################
 
+import re
+
+from cumulus.constants import JobQueueState
+
+_MEMORY_UNITS = 'kmgtp'
+
+# Printed before the output of each command in a batched submission
+SUBMIT_MARKER = 'cumulus-submit:'
+
+
+def parse_duration(value):
+    """
+    Parse a scheduler duration, [days-][[hours:]minutes:]seconds or a plain
+    number of seconds, optionally with fractional seconds.
+
+    :returns: The duration in seconds or None if value can't be parsed.
+    """
+    value = value.strip().rstrip('s')
+    days = 0
+    if '-' in value:
+        (days, _, value) = value.partition('-')
+    try:
+        seconds = 0.0
+        for part in value.split(':'):
+            seconds = seconds * 60 + float(part)
+
+        return int(days) * 86400 + seconds
+    except ValueError:
+        return None
+
+
+def parse_memory(value):
+    """
+    Parse a scheduler memory value, a number with an optional binary unit
+    suffix, for example 1024, 2868kb, 123456K or 1.5G.
+
+    :returns: The number of bytes or None if value can't be parsed.
+    """
+    m = re.match('^([\\d.]+)\\s*([%s]?)i?b?$' % _MEMORY_UNITS,
+                 value.strip().lower())
+    if not m:
+        return None
+
+    try:
+        number = float(m.group(1))
+    except ValueError:
+        return None
+    if m.group(2):
+        number *= 1024 ** (_MEMORY_UNITS.index(m.group(2)) + 1)
+
+    return int(number)
+
+
+def array_indices(array):
+    """
+    Returns the indices of the elements of a job array, array is the job's
+    array specification, containing start, end and optionally step.
+    """
+    return range(int(array['start']), int(array['end']) + 1,
+                 int(array.get('step', 1)))
+
+
+def array_element_id(queue_job_id, index):
+    """
+    Returns the id used for an element of a job array in parsed status and
+    accounting output.
+    """
+    return '%s_%s' % (queue_job_id, index)
+
 
 class AbstractQueueAdapter(object):
     QUEUE_JOB_ID = 'queueJobId'
@@ -25,11 +94,136 @@ class AbstractQueueAdapter(object):
         self._cluster = cluster
         self._cluster_connection = cluster_connection
 
+    def to_job_queue_state(self, scheduler_state):
+        raise NotImplementedError('Subclasses should implement this')
+
+    def _job_queue_states(self, jobs, scheduler_states):
+        """
+        Look up the state of each job in the scheduler states parsed from the
+        status output, keyed by queue job id or, for the elements of a job
+        array, by array_element_id(...). The states of the elements of a job
+        array are stored in job['elements'], elements that have left the queue
+        are marked complete. An array job is running while any element is
+        running, queued while any element is waiting, in error once all its
+        elements have finished if any of them failed and has otherwise left
+        the queue.
+
+        :returns: List of (job, JobQueueState) tuples.
+        """
+        states = []
+        for job in jobs:
+            job_id = job[AbstractQueueAdapter.QUEUE_JOB_ID]
+            if not job.get('array'):
+                states.append((job, self.to_job_queue_state(
+                    scheduler_states.get(job_id))))
+                continue
+
+            elements = job.setdefault('elements', {})
+            active = set()
+            for index in array_indices(job['array']):
+                state = self.to_job_queue_state(
+                    scheduler_states.get(array_element_id(job_id, index)))
+                if state:
+                    active.add(state)
+                elif elements.get(str(index)) != JobQueueState.ERROR:
+                    state = JobQueueState.COMPLETE
+                else:
+                    state = JobQueueState.ERROR
+                elements[str(index)] = state
+
+            state = None
+            if JobQueueState.RUNNING in active:
+                state = JobQueueState.RUNNING
+            elif JobQueueState.QUEUED in active:
+                state = JobQueueState.QUEUED
+            elif JobQueueState.ERROR in elements.values():
+                state = JobQueueState.ERROR
+            states.append((job, state))
+
+        return states
+
     def submit_job(self, job, job_script):
         raise NotImplementedError('Subclasses should implement this')
 
+    def _submit_command(self, job, job_script):
+        raise NotImplementedError('Subclasses should implement this')
+
+    def submit_jobs(self, jobs):
+        """
+        Submit several jobs using a single remote command, the command for
+        each job is run in turn and its output, prefixed by a marker, is used
+        to extract its queue job id. A job failing to submit doesn't affect
+        the others.
+
+        :param jobs: List of (job, job_script) tuples, the scripts should
+                     already be in the job directories.
+        :returns: List of (queue_job_id, error) tuples in the same order as
+                  jobs, error is None if the job was submitted, otherwise
+                  queue_job_id is None and error describes the failure.
+        """
+        if not jobs:
+            return []
+
+        command = '; '.join([
+            'echo %s%d; (%s) 2>&1' % (
+                SUBMIT_MARKER, i, self._submit_command(job, job_script))
+            for (i, (job, job_script)) in enumerate(jobs)])
+        output = self._cluster_connection.execute(command)
+
+        job_output = [None] * len(jobs)
+        current = None
+        for line in output:
+            if line.startswith(SUBMIT_MARKER):
+                current = int(line[len(SUBMIT_MARKER):])
+                job_output[current] = []
+            elif current is not None:
+                job_output[current].append(line)
+
+        results = []
+        for lines in job_output:
+            if lines is None:
+                results.append((None, 'No submission output'))
+                continue
+
+            queue_job_id = None
+            for line in lines:
+                try:
+                    queue_job_id = self._parse_job_id([line])
+                    break
+                except Exception:
+                    pass
+
+            if queue_job_id is None:
+                results.append(
+                    (None, 'Unexpected submission output: %s' % lines))
+            else:
+                results.append((queue_job_id, None))
+
+        return results
+
     def terminate_job(self, job):
         raise NotImplementedError('Subclasses should implement this')
 
     def job_statuses(self, jobs):
         raise NotImplementedError('Subclasses should implement this')
+
+    def estimated_start_times(self, jobs):
+        """
+        Returns a dict mapping queue job ids to the time, in seconds since the
+        epoch, the scheduler expects the job to start. Jobs without an estimate
+        are omitted. Adapters for schedulers that provide estimates should
+        override this, by default no estimates are returned.
+        """
+        return {}
+
+    def job_accounting(self, jobs):
+        """
+        Look up jobs that are no longer known to the scheduler in its
+        accounting database. Returns a dict mapping queue job ids to a dict
+        containing the final state of the job, a JobQueueState, and where
+        available its exitCode, elapsed and cpuTime in seconds and maxMemory
+        in bytes. Jobs without an accounting record are omitted. Adapters for
+        schedulers that keep accounting records should override this, by
+        default no records are returned.
+        """
+        return {}
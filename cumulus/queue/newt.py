@@ -22,7 +22,7 @@ import os
 from jsonpath_rw import parse
 import requests
 
-from cumulus.queue.slurm import SlurmQueueAdapter, AbstractQueueAdapter
+from cumulus.queue.slurm import SlurmQueueAdapter
 from cumulus.common import check_status
 from cumulus.transport.newt import NEWT_BASE_URL
 
@@ -61,6 +61,17 @@ class NewtQueueAdapter(SlurmQueueAdapter):
 
         return json_response['jobid']
 
+    def submit_jobs(self, jobs):
+        # The NEWT API takes a single job file per request
+        results = []
+        for (job, job_script) in jobs:
+            try:
+                results.append((self.submit_job(job, job_script), None))
+            except Exception as ex:
+                results.append((None, str(ex)))
+
+        return results
+
     def job_statuses(self, jobs):
         user = parse('config.user').find(self._cluster)
 
@@ -74,21 +85,21 @@ class NewtQueueAdapter(SlurmQueueAdapter):
         check_status(r)
         json_response = r.json()
 
-        states = []
-        for job in jobs:
-            slurm_state = self._extract_job_status(json_response, job)
-            state = self.to_job_queue_state(slurm_state)
-            states.append((job, state))
-
-        return states
+        return self._job_queue_states(
+            jobs, self._parse_job_statuses(json_response))
 
-    def _extract_job_status(self, response, job):
-        status = None
+    def estimated_start_times(self, jobs):
+        # The NEWT queue API doesn't provide estimates
+        return {}
 
-        for job_entry in response:
-            if job_entry['jobid'] == job[AbstractQueueAdapter.QUEUE_JOB_ID] and\
-                    'status' in job_entry:
-                status = job_entry['status']
-                break
+    def job_accounting(self, jobs):
+        # The NEWT queue API doesn't provide accounting records
+        return {}
 
-        return status
+    def _parse_job_statuses(self, response):
+        """
+        Returns a dict of job id => slurm state for the entries in a NEWT queue
+        response.
+        """
+        return {job_entry['jobid']: job_entry['status']
+                for job_entry in response if 'status' in job_entry}
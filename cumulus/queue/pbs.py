@@ -1,5 +1,6 @@
 import re
-from cumulus.queue.abstract import AbstractQueueAdapter
+from cumulus.queue.abstract import AbstractQueueAdapter, array_element_id, \
+    parse_duration, parse_memory
 from cumulus.constants import JobQueueState
 
 
@@ -14,14 +15,20 @@ class PbsQueueAdapter(AbstractQueueAdapter):
     # Queued states
     QUEUED_STATE = ['q', 'h', 't', 'w', 's']
 
+    def _queue_job_id(self, job):
+        # Job arrays are referred to as <id>[]
+        job_id = job[AbstractQueueAdapter.QUEUE_JOB_ID]
+
+        return '%s[]' % job_id if job.get('array') else job_id
+
     def terminate_job(self, job):
-        command = 'qdel %s' % job['queueJobId']
+        command = 'qdel %s' % self._queue_job_id(job)
         output = self._cluster_connection.execute(command)
 
         return output
 
     def _parse_job_id(self, submit_output):
-        m = re.match('^(\\d+)\..*', submit_output[0])
+        m = re.match('^(\\d+)(?:\\[\\])?\\..*', submit_output[0])
         if not m:
             raise Exception('Unable to extraction job id from: %s'
                             % submit_output[0])
@@ -29,8 +36,11 @@ class PbsQueueAdapter(AbstractQueueAdapter):
 
         return sge_id
 
+    def _submit_command(self, job, job_script):
+        return 'cd %s && qsub ./%s' % (job['dir'], job_script)
+
     def submit_job(self, job, job_script):
-        command = 'cd %s && qsub ./%s' % (job['dir'], job_script)
+        command = self._submit_command(job, job_script)
         output = self._cluster_connection.execute(command)
 
         if len(output) != 1:
@@ -40,39 +50,94 @@ class PbsQueueAdapter(AbstractQueueAdapter):
 
     def job_statuses(self, jobs):
 
-        job_ids = ' '.join(
-            [job[AbstractQueueAdapter.QUEUE_JOB_ID] for job in jobs])
+        job_ids = ' '.join([self._queue_job_id(job) for job in jobs])
 
-        output = self._cluster_connection.execute('qstat %s' % job_ids)
+        # -t lists each element of a job array on its own line
+        command = 'qstat %s'
+        if any([job.get('array') for job in jobs]):
+            command = 'qstat -t %s'
 
-        states = []
-        for job in jobs:
-            state = None
-            pbs_state = self._extract_job_status(output, job)
+        output = self._cluster_connection.execute(command % job_ids)
 
-            if pbs_state:
-                if pbs_state in PbsQueueAdapter.RUNNING_STATE:
-                    state = JobQueueState.RUNNING
-                elif pbs_state in PbsQueueAdapter.ERROR_STATE:
-                    state = JobQueueState.ERROR
-                elif pbs_state in PbsQueueAdapter.QUEUED_STATE:
-                    state = JobQueueState.QUEUED
-                elif pbs_state in PbsQueueAdapter.COMPLETE_STATE:
-                    state = JobQueueState.COMPLETE
+        return self._job_queue_states(jobs, self._parse_job_statuses(output))
 
-            states.append((job, state))
-
-        return states
+    def job_accounting(self, jobs):
+        # tracejob only takes a single job id, so run it for each job in a
+        # single command.
+        command = '; '.join(
+            ['tracejob -q -n 2 %s 2>/dev/null'
+             % job[AbstractQueueAdapter.QUEUE_JOB_ID] for job in jobs])
+        output = self._cluster_connection.execute(command)
 
-    def _extract_job_status(self, job_status_output, job):
+        return self._parse_job_accounting(output)
+
+    def _parse_job_accounting(self, output):
+        """
+        Parse tracejob output, each job starts with a "Job: <id>" line and its
+        usage is logged as name=value pairs when the job exits.
+        """
+        accounting = {}
+        job_id = None
+        for line in output:
+            m = re.match('^\\s*Job:\\s+(\\d+)', line)
+            if m:
+                job_id = m.group(1)
+                continue
+
+            m = re.search('Exit_status=(-?\\d+)', line)
+            if not job_id or not m:
+                continue
+
+            values = dict(re.findall('(\\S+)=(\\S+)', line))
+            exit_code = int(m.group(1))
+            record = {
+                'state': JobQueueState.COMPLETE if exit_code == 0
+                else JobQueueState.ERROR,
+                'exitCode': exit_code,
+                'elapsed': parse_duration(
+                    values.get('resources_used.walltime', '')),
+                'cpuTime': parse_duration(
+                    values.get('resources_used.cput', '')),
+                'maxMemory': parse_memory(
+                    values.get('resources_used.mem', ''))
+            }
+            accounting[job_id] = {key: value for (key, value) in record.items()
+                                  if value is not None}
+
+        return accounting
+
+    def to_job_queue_state(self, pbs_state):
         state = None
-        job_id = job[AbstractQueueAdapter.QUEUE_JOB_ID]
-        for line in job_status_output:
-            m = re.match('^\\s*(\\d+)\\S*\\s+\\S+\\s+\\S+\\s+\\S+\\s+(\\w+)',
-                         line)
-
-            if m and m.group(1) == job_id:
-                state = m.group(2).lower()
-                break
+        if pbs_state in PbsQueueAdapter.RUNNING_STATE:
+            state = JobQueueState.RUNNING
+        elif pbs_state in PbsQueueAdapter.ERROR_STATE:
+            state = JobQueueState.ERROR
+        elif pbs_state in PbsQueueAdapter.QUEUED_STATE:
+            state = JobQueueState.QUEUED
+        elif pbs_state in PbsQueueAdapter.COMPLETE_STATE:
+            state = JobQueueState.COMPLETE
 
         return state
+
+    def _parse_job_statuses(self, job_status_output):
+        """
+        Parse the fixed column output of qstat into a dict of job id => lower
+        case PBS state. The job id column includes the server name, which is
+        dropped. The elements of job arrays, <id>[<index>], are added as
+        array_element_id(...).
+        """
+        states = {}
+        for line in job_status_output:
+            fields = line.split()
+            # Job id, name, user, time used, state and queue
+            if len(fields) < 6:
+                continue
+
+            m = re.match('^(\\d+)(?:\\[(\\d*)\\])?', fields[0])
+            if m and m.group(2):
+                states[array_element_id(m.group(1), m.group(2))] = \
+                    fields[4].lower()
+            elif m:
+                states[m.group(1)] = fields[4].lower()
+
+        return states
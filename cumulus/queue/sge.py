@@ -18,9 +18,15 @@
 ###############################################################################
 
 import re
-from cumulus.queue.abstract import AbstractQueueAdapter
+from xml.etree import ElementTree
+
+from cumulus.queue.abstract import AbstractQueueAdapter, array_element_id, \
+    parse_duration, parse_memory
 from cumulus.constants import JobQueueState
 
+# The closing tag of the document qstat -xml prints
+QSTAT_XML_END = '</job_info>'
+
 
 class SgeQueueAdapter(AbstractQueueAdapter):
     # Running states
@@ -38,7 +44,8 @@ class SgeQueueAdapter(AbstractQueueAdapter):
         return output
 
     def _parse_job_id(self, submit_output):
-        m = re.match('^[Yy]our job (\\d+)', submit_output[0])
+        # Job arrays are reported as "Your job-array <id>.<tasks> ..."
+        m = re.match('^[Yy]our job(?:-array)? (\\d+)', submit_output[0])
         if not m:
             raise Exception('Unable to extraction job id from: %s'
                             % submit_output[0])
@@ -46,8 +53,11 @@ class SgeQueueAdapter(AbstractQueueAdapter):
 
         return sge_id
 
+    def _submit_command(self, job, job_script):
+        return 'cd %s && qsub -cwd ./%s' % (job['dir'], job_script)
+
     def submit_job(self, job, job_script):
-        command = 'cd %s && qsub -cwd ./%s' % (job['dir'], job_script)
+        command = self._submit_command(job, job_script)
         output = self._cluster_connection.execute(command)
 
         if len(output) != 1:
@@ -56,37 +66,144 @@ class SgeQueueAdapter(AbstractQueueAdapter):
         return self._parse_job_id(output)
 
     def job_statuses(self, jobs):
-        output = self._cluster_connection.execute('qstat')
+        output = self._cluster_connection.execute('qstat -xml')
 
-        states = []
-        for job in jobs:
-            state = None
-            sge_state = self._extract_job_status(output, job)
+        return self._job_queue_states(jobs, self._parse_job_statuses(output))
 
-            if sge_state:
-                if sge_state in SgeQueueAdapter.RUNNING_STATE:
-                    state = JobQueueState.RUNNING
-                elif sge_state in SgeQueueAdapter.ERROR_STATE:
-                    state = JobQueueState.ERROR
-                elif sge_state in SgeQueueAdapter.QUEUED_STATE:
-                    state = JobQueueState.QUEUED
-
-            states.append((job, state))
+    def job_accounting(self, jobs):
+        # qacct only takes a single job id, so run it for each job in a single
+        # command.
+        command = '; '.join(
+            ['qacct -j %s 2>/dev/null' % job[AbstractQueueAdapter.QUEUE_JOB_ID]
+             for job in jobs])
+        output = self._cluster_connection.execute(command)
 
-        return states
+        return self._parse_job_accounting(output)
 
-    def _extract_job_status(self, job_status_output, job):
+    def _parse_job_accounting(self, output):
+        """
+        Parse qacct -j output, a block of "name value" lines per job, or task
+        for array jobs, separated by lines of '='. The tasks of an array job
+        are combined, and also added as array_element_id(...).
+        """
+        records = []
+        record = {}
+        for line in output:
+            line = line.strip()
+            if line.startswith('==='):
+                records.append(record)
+                record = {}
+                continue
+
+            (name, _, value) = line.partition(' ')
+            record[name] = value.strip()
+        records.append(record)
+
+        accounting = {}
+        for record in records:
+            job_id = record.get('jobnumber')
+            if not job_id:
+                continue
+
+            # failed is 0 or a code followed by a reason
+            failed = record.get('failed', '0').split(' ')[0]
+            exit_code = record.get('exit_status', '').split(' ')[0]
+            task = {
+                'state': JobQueueState.COMPLETE
+                if failed == '0' and exit_code in ('', '0')
+                else JobQueueState.ERROR,
+                'elapsed': parse_duration(record.get('ru_wallclock', '')),
+                'cpuTime': parse_duration(record.get('cpu', '')),
+                'maxMemory': parse_memory(record.get('maxvmem', ''))
+            }
+            if exit_code.isdigit():
+                task['exitCode'] = int(exit_code)
+            task = {key: value for (key, value) in task.items()
+                    if value is not None}
+
+            task_id = record.get('taskid', '')
+            if task_id.isdigit():
+                accounting[array_element_id(job_id, task_id)] = dict(task)
+
+            if job_id not in accounting:
+                accounting[job_id] = task
+                continue
+
+            job = accounting[job_id]
+            if task['state'] == JobQueueState.ERROR:
+                job['state'] = JobQueueState.ERROR
+            if task.get('exitCode'):
+                job['exitCode'] = task['exitCode']
+            for key in ['elapsed', 'maxMemory']:
+                if key in task:
+                    job[key] = max(job.get(key, 0), task[key])
+            if 'cpuTime' in task:
+                job['cpuTime'] = job.get('cpuTime', 0) + task['cpuTime']
+
+        return accounting
+
+    def to_job_queue_state(self, sge_state):
         state = None
-        job_id = job[AbstractQueueAdapter.QUEUE_JOB_ID]
-        for line in job_status_output:
-            m = re.match('^\\s*(\\d+)\\s+\\S+\\s+\\S+\\s+\\S+\\s+(\\w+)',
-                         line)
-            if m and m.group(1) == job_id:
-                state = m.group(2).lower()
-                break
+        if sge_state in SgeQueueAdapter.RUNNING_STATE:
+            state = JobQueueState.RUNNING
+        elif sge_state in SgeQueueAdapter.ERROR_STATE:
+            state = JobQueueState.ERROR
+        elif sge_state in SgeQueueAdapter.QUEUED_STATE:
+            state = JobQueueState.QUEUED
 
         return state
 
+    def _parse_task_ids(self, tasks):
+        """
+        Expand the task ids of an array job listed by qstat, for example
+        "3,5-9:2".
+        """
+        task_ids = []
+        for task_range in tasks.split(','):
+            (task_range, _, step) = task_range.partition(':')
+            (start, _, end) = task_range.partition('-')
+            try:
+                task_ids += range(int(start), int(end or start) + 1,
+                                  int(step or 1))
+            except ValueError:
+                continue
+
+        return task_ids
+
+    def _parse_job_statuses(self, job_status_output):
+        """
+        Parse the output of qstat -xml into a dict of job id => lower case
+        SGE state. The tasks of array jobs are also added as
+        array_element_id(...), the job id itself is given the state of the
+        first task listed. The output can include stderr and anything the
+        shell's profile prints, so only the XML document is parsed.
+        """
+        output = '\n'.join(job_status_output)
+        start = output.find('<?xml')
+        end = output.rfind(QSTAT_XML_END)
+        if start < 0 or end < 0:
+            raise Exception('Unexpected qstat output: %s' % output)
+
+        try:
+            root = ElementTree.fromstring(
+                output[start:end + len(QSTAT_XML_END)])
+        except ElementTree.ParseError as ex:
+            raise Exception('Unable to parse qstat output: %s' % ex)
+
+        states = {}
+        for job in root.iter('job_list'):
+            job_id = job.findtext('JB_job_number')
+            state = job.findtext('state')
+            if not job_id or not state:
+                continue
+
+            state = state.strip().lower()
+            states.setdefault(job_id, state)
+            for task_id in self._parse_task_ids(job.findtext('tasks') or ''):
+                states[array_element_id(job_id, task_id)] = state
+
+        return states
+
     def number_of_slots(self, parallel_env):
         slots = -1
         output = self._cluster_connection.execute('qconf -sp %s' % parallel_env)
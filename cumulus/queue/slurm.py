@@ -1,5 +1,7 @@
 import re
-from cumulus.queue.abstract import AbstractQueueAdapter
+import time
+from cumulus.queue.abstract import AbstractQueueAdapter, parse_duration, \
+    parse_memory
 from cumulus.constants import JobQueueState
 
 
@@ -34,6 +36,15 @@ class SlurmQueueAdapter(AbstractQueueAdapter):
     # Queued states
     QUEUED_STATE = ['cf', 'pd']
 
+    # The final states reported by sacct, other states are for jobs that
+    # haven't finished.
+    ACCOUNTING_COMPLETE_STATE = ['completed', 'preempted']
+
+    ACCOUNTING_ERROR_STATE = ['boot_fail', 'cancelled', 'deadline', 'failed',
+                              'node_fail', 'out_of_memory', 'timeout']
+
+    ACCOUNTING_FORMAT = 'JobID,State,ExitCode,ElapsedRaw,TotalCPU,MaxRSS'
+
     def terminate_job(self, job):
         command = 'scancel %s' % job['queueJobId']
         output = self._cluster_connection.execute(command)
@@ -49,8 +60,11 @@ class SlurmQueueAdapter(AbstractQueueAdapter):
 
         return slurm_id
 
+    def _submit_command(self, job, job_script):
+        return 'cd %s && sbatch ./%s' % (job['dir'], job_script)
+
     def submit_job(self, job, job_script):
-        command = 'cd %s && sbatch ./%s' % (job['dir'], job_script)
+        command = self._submit_command(job, job_script)
         output = self._cluster_connection.execute(command)
 
         if len(output) != 1:
@@ -61,10 +75,91 @@ class SlurmQueueAdapter(AbstractQueueAdapter):
     def job_statuses(self, jobs):
         job_ids = ','.join(
             [job[AbstractQueueAdapter.QUEUE_JOB_ID] for job in jobs])
-        output = self._cluster_connection.execute('squeue -j %s'
-                                                  % job_ids)
+        # --array lists each element of a job array on its own line
+        output = self._cluster_connection.execute(
+            'squeue --noheader --array --format="%%i|%%t" -j %s' % job_ids)
 
-        return self._extract_job_statuses(output, jobs)
+        return self._job_queue_states(jobs, self._parse_job_statuses(output))
+
+    def estimated_start_times(self, jobs):
+        job_ids = ','.join(
+            [job[AbstractQueueAdapter.QUEUE_JOB_ID] for job in jobs])
+        output = self._cluster_connection.execute(
+            'squeue --start -h -o "%%i %%S" -j %s' % job_ids)
+
+        start_times = {}
+        for line in output:
+            m = re.match('^\\s*(\\d+)\\s+(\\S+)', line)
+            if not m:
+                continue
+            try:
+                start = time.strptime(m.group(2), '%Y-%m-%dT%H:%M:%S')
+            # N/A is reported if slurm has no estimate
+            except ValueError:
+                continue
+            start_times[m.group(1)] = time.mktime(start)
+
+        return start_times
+
+    def job_accounting(self, jobs):
+        job_ids = ','.join(
+            [job[AbstractQueueAdapter.QUEUE_JOB_ID] for job in jobs])
+        output = self._cluster_connection.execute(
+            'sacct --noheader --parsable2 --format=%s -j %s'
+            % (SlurmQueueAdapter.ACCOUNTING_FORMAT, job_ids))
+
+        return self._parse_job_accounting(output)
+
+    def _parse_job_accounting(self, output):
+        """
+        Parse sacct --parsable2 output, there is a line for the job followed
+        by a line for each of its steps, memory is only reported for steps.
+        """
+        accounting = {}
+        for line in output:
+            fields = line.strip().split('|')
+            if len(fields) != 6:
+                continue
+
+            (job_id, state, exit_code, elapsed, cpu_time, max_rss) = fields
+            (job_id, _, step) = job_id.partition('.')
+
+            if not step:
+                # For example "CANCELLED by 1000"
+                state = state.split(' ')[0].lower()
+                if state in SlurmQueueAdapter.ACCOUNTING_COMPLETE_STATE:
+                    queue_state = JobQueueState.COMPLETE
+                elif state in SlurmQueueAdapter.ACCOUNTING_ERROR_STATE:
+                    queue_state = JobQueueState.ERROR
+                else:
+                    continue
+
+                # The exit code is reported as <exit code>:<signal>
+                (exit_code, _, signal) = exit_code.partition(':')
+                record = {
+                    'state': queue_state,
+                    'elapsed': parse_duration(elapsed),
+                    'cpuTime': parse_duration(cpu_time)
+                }
+                if exit_code.isdigit():
+                    record['exitCode'] = int(exit_code)
+                    if record['exitCode'] != 0 or signal not in ('', '0'):
+                        record['state'] = JobQueueState.ERROR
+
+                accounting[job_id] = record
+            elif job_id in accounting:
+                memory = parse_memory(max_rss)
+                record = accounting[job_id]
+                if memory is not None and \
+                        memory > record.get('maxMemory', -1):
+                    record['maxMemory'] = memory
+
+        for record in accounting.values():
+            for key in ['elapsed', 'cpuTime']:
+                if record[key] is None:
+                    del record[key]
+
+        return accounting
 
     def to_job_queue_state(self, slurm_state):
         state = None
@@ -80,24 +175,16 @@ class SlurmQueueAdapter(AbstractQueueAdapter):
 
         return state
 
-    def _extract_job_statuses(self, job_status_output, jobs):
-        states = []
-        for job in jobs:
-            slurm_state = self._extract_job_status(job_status_output, job)
-            state = self.to_job_queue_state(slurm_state)
-            states.append((job, state))
-
-        return states
-
-    def _extract_job_status(self, job_status_output, job):
-        state = None
-        job_id = job[AbstractQueueAdapter.QUEUE_JOB_ID]
+    def _parse_job_statuses(self, job_status_output):
+        """
+        Parse the output of squeue --format="%i|%t" into a dict of job id =>
+        lower case slurm state. The elements of job arrays are listed as
+        <job id>_<index>.
+        """
+        states = {}
         for line in job_status_output:
-            m = re.match('^\\s*(\\d+)\\s+\\S+\\s+\\S+\\s+\\S+\\s+(\\w+)',
-                         line)
-
-            if m and m.group(1) == job_id:
-                state = m.group(2).lower()
-                break
+            (job_id, sep, state) = line.strip().partition('|')
+            if sep:
+                states[job_id] = state.lower()
 
-        return state
+        return states
@@ -22,7 +22,7 @@ import string
 import os
 import stat
 from paramiko.rsakey import RSAKey
-import requests
+from cumulus.common import api
 
 
 import cumulus
@@ -73,11 +73,11 @@ def generate_key_pair(cluster, girder_token=None):
 
         patch_url = '%s/clusters/%s' % (cumulus.config.girder.baseUrl,
                                         cluster_id)
-        request = requests.patch(patch_url, json=config_update, headers=headers)
+        request = api.patch(patch_url, json=config_update, headers=headers)
         check_status(request)
     except Exception as ex:
-        r = requests.patch(status_url, headers=headers,
-                           json={'status': 'error'})
+        r = api.patch(status_url, headers=headers,
+                      json={'status': 'error'})
         check_status(r)
         # Log the error message
         log.error(ex)
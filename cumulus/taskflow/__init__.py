@@ -24,7 +24,7 @@ from functools import wraps
 import json
 import threading
 
-from girder_client import GirderClient, HttpError
+from girder_client import HttpError
 
 from celery.signals import before_task_publish, task_prerun, task_failure, \
     task_success
@@ -34,6 +34,7 @@ from celery import current_task
 from celery.utils.log import get_task_logger
 
 import cumulus.celery
+from cumulus.common import api
 from cumulus.logging import RESTfulLogHandler
 
 
@@ -82,10 +83,7 @@ def _get_task_logger(id, girder_api_url, girder_token):
 
 
 def _create_girder_client(girder_api_url, girder_token):
-    client = GirderClient(apiUrl=girder_api_url)
-    client.token = girder_token
-
-    return client
+    return api.girder_client(girder_token, girder_api_url)
 
 
 def task(func):
@@ -335,8 +333,7 @@ def _taskflow_task_finished(taskflow, taskflow_task_id):
     girder_token = taskflow['girder_token']
     girder_api_url = taskflow['girder_api_url']
 
-    client = GirderClient(apiUrl=girder_api_url)
-    client.token = girder_token
+    client = _create_girder_client(girder_api_url, girder_token)
     url = 'taskflows/%s/tasks/%s/finished' % (taskflow.id, taskflow_task_id)
 
     return client.put(url)
@@ -409,9 +406,6 @@ def task_before_sent_handler(headers=None, body=None, **kwargs):
         girder_token = taskflow['girder_token']
         girder_api_url = taskflow['girder_api_url']
 
-        client = GirderClient(apiUrl=girder_api_url)
-        client.token = girder_token
-
         client = _create_girder_client(girder_api_url, girder_token)
 
         # If this is a retry then we have already create a task get it from
@@ -28,9 +28,10 @@ import cumulus.ansible.tasks.volume
 from cumulus.ansible.tasks.providers import CloudProvider, InstanceState
 from cumulus.tasks.job import terminate_job
 from cumulus.constants import JobState
+from cumulus.common import api
 from cumulus.ansible.tasks.utils import check_girder_cluster_status
 
-from girder_client import GirderClient, HttpError
+from girder_client import HttpError
 
 from girder.api.rest import getCurrentUser
 from girder.constants import AccessType
@@ -368,10 +369,7 @@ def _attach_volume(task, profile, volume, cluster):
 
 
 def create_girder_client(girder_api_url, girder_token):
-    client = GirderClient(apiUrl=girder_api_url)
-    client.token = girder_token
-
-    return client
+    return api.girder_client(girder_token, girder_api_url)
 
 
 def terminate_jobs(task, client, cluster, jobs):
@@ -24,7 +24,7 @@ from cumulus.common import get_cluster_logger
 import cumulus
 from cumulus.transport import get_connection
 
-import requests
+from cumulus.common import api
 # import time
 
 # TODO refactor remove
@@ -166,7 +166,7 @@ def test_connection(cluster, log_write_url=None, girder_token=None):
     try:
         # First fetch the cluster with this 'admin' token so we get the
         # passphrase filled out.
-        r = requests.get(cluster_url, headers=headers)
+        r = api.get(cluster_url, headers=headers)
         check_status(r)
         cluster = r.json()
 
@@ -178,11 +178,11 @@ def test_connection(cluster, log_write_url=None, girder_token=None):
             log.error('Unable connect to cluster')
             status = 'error'
 
-        r = requests.patch(
+        r = api.patch(
             cluster_url, headers=headers, json={'status': status})
         check_status(r)
     except Exception as ex:
-        r = requests.patch(cluster_url, headers=headers,
-                           json={'status': 'error'})
+        r = api.patch(cluster_url, headers=headers,
+                      json={'status': 'error'})
         # Log the error message
         log.exception(ex)
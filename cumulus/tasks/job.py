@@ -22,32 +22,98 @@ import traceback
 from cumulus.common import check_status
 from cumulus.common import get_post_logger, get_job_logger
 from cumulus.common import get_cluster_logger
+from cumulus.common.jsonpath import get_property
+from cumulus.common import polling
+from cumulus.common import api
+from cumulus.common.templates import get_template_registry
 from cumulus.celery import command, monitor
 import cumulus
 import cumulus.girderclient
 import cumulus.constants
 from cumulus.constants import ClusterType, JobQueueState
 from cumulus.queue import get_queue_adapter
-from cumulus.queue.abstract import AbstractQueueAdapter
+from cumulus.queue.abstract import AbstractQueueAdapter, array_element_id, \
+    array_indices
 from cumulus.transport import get_connection
 from cumulus.transport.files.download import download_path
 from cumulus.transport.files.upload import upload_path
-from cumulus.transport.files import get_assetstore_url_base, get_assetstore_id
-import requests
+from cumulus.transport.files.cache import InputCache, input_cache_config
+from cumulus.transport.files import get_assetstore_url_base, \
+    get_assetstore_id, batch_commands
 import os
 import re
 import inspect
 import time
 import uuid
+import six
 from six import StringIO
+from six.moves import shlex_quote
 from celery import signature
 from celery.exceptions import Retry
-from jinja2 import Environment, Template, PackageLoader
 from jsonpath_rw import parse
-import tempfile
 from girder_client import HttpError
 import paramiko
 
+# The maximum amount of a tailed output file to fetch each time we poll
+TAIL_MAX_BYTES_PER_POLL = 1024 * 1024
+
+# Printed with grep's exit status when scanning output files for errors
+GREP_STATUS_MARKER = 'cumulus-grep-status:'
+
+# Characters that have the same meaning escaped in Python and POSIX extended
+# regular expressions
+ERE_ESCAPABLE = '.[](){}*+?|^$\\/'
+
+# The maximum length of the line included in the log when an error is found
+ERROR_EXCERPT_LENGTH = 1024
+
+# The minimum number of seconds between input staging progress messages
+STAGING_PROGRESS_INTERVAL = 10
+
+# Added to the monitor interval when calculating the cluster monitor lease
+CLUSTER_MONITOR_LEASE_PADDING = 60
+
+# The maximum number of jobs submitted by a single remote command
+SUBMIT_BATCH_SIZE = 500
+
+
+def _is_ere_compatible(regex):
+    """
+    Returns True if the Python regular expression regex has the same meaning
+    as a POSIX extended regular expression. This is conservative, anything
+    using a Python specific construct such as \\d, a (?...) group, a lazy
+    quantifier or an escape within a bracket expression is rejected.
+    """
+    in_bracket = False
+    i = 0
+    while i < len(regex):
+        c = regex[i]
+        following = regex[i + 1] if i + 1 < len(regex) else ''
+        if in_bracket:
+            if c == '\\' or (c == '[' and following and following in ':.='):
+                return False
+            elif c == ']':
+                in_bracket = False
+        elif c == '\\':
+            if not following or following not in ERE_ESCAPABLE:
+                return False
+            i += 1
+        elif c == '[':
+            in_bracket = True
+            # A leading ] (after an optional ^) is part of the expression
+            if following == '^':
+                i += 1
+                following = regex[i + 1] if i + 1 < len(regex) else ''
+            if following == ']':
+                i += 1
+        elif c == '(' and following == '?':
+            return False
+        elif c in '*+?}' and following == '?':
+            return False
+        i += 1
+
+    return True
+
 
 def _put_script(conn, script_commands):
     script_name = uuid.uuid4().hex
@@ -95,8 +161,8 @@ def download_job_input_items(cluster, job, log_write_url=None,
             with open(path, 'r') as fp:
                 conn.put(fp, os.path.basename(path))
 
-            r = requests.patch(status_url, json={'status': 'downloading'},
-                               headers=headers)
+            r = api.patch(status_url, json={'status': 'downloading'},
+                          headers=headers)
             check_status(r)
 
             download_cmd = 'python girderclient.py --token %s --url "%s" ' \
@@ -104,6 +170,13 @@ def download_job_input_items(cluster, job, log_write_url=None,
                 % (girder_token, cumulus.config.girder.baseUrl,
                    job_directory(cluster, job), job_id)
 
+            cache = input_cache_config(cluster)
+            if cache is not None:
+                download_cmd += ' --cache-dir %s --cache-size %d ' \
+                                '--cache-link %s' \
+                    % (shlex_quote(cache['path']), cache['maxSize'],
+                       shlex_quote(cache['link']))
+
             download_output = '%s.download.out' % job_id
             download_cmd = 'nohup %s  &> %s  &\n' % (download_cmd,
                                                      download_output)
@@ -132,23 +205,67 @@ def download_job_input_items(cluster, job, log_write_url=None,
                               girder_token=girder_token)
 
     except Exception as ex:
-        r = requests.patch(status_url, headers=headers,
-                           json={'status': 'error'})
+        r = api.patch(status_url, headers=headers,
+                      json={'status': 'error'})
         check_status(r)
         get_job_logger(job, girder_token).exception(str(ex))
 
 
+def _staging_progress(log, path):
+    """
+    Returns a progress callback for upload_path(...) that logs the progress of
+    staging input to path, at most every STAGING_PROGRESS_INTERVAL seconds.
+    """
+    last_logged = [0]
+
+    def progress(files_done, files_total, bytes_done, bytes_total):
+        now = time.time()
+        if files_done == files_total or \
+                now - last_logged[0] > STAGING_PROGRESS_INTERVAL:
+            last_logged[0] = now
+            log.info('Staged %d of %d files (%d of %d bytes) to %s'
+                     % (files_done, files_total, bytes_done, bytes_total,
+                        path))
+
+    return progress
+
+
 def download_job_input_folders(cluster, job, log_write_url=None,
                                girder_token=None, submit=True):
     job_dir = job_directory(cluster, job)
+    log = get_job_logger(job, girder_token)
+    staging = {
+        'total': 0,
+        'files': []
+    }
+    cache = InputCache.from_cluster(cluster)
 
     with get_connection(girder_token, cluster) as conn:
+        if cache is not None:
+            cache.setup(conn)
+
         for input in job['input']:
             if 'folderId' in input and 'path' in input:
                 folder_id = input['folderId']
-                path = input['path']
-                upload_path(conn, girder_token, folder_id,
-                            os.path.join(job_dir, path))
+                path = os.path.join(job_dir, input['path'])
+                timings = upload_path(conn, girder_token, folder_id, path,
+                                      progress=_staging_progress(log, path),
+                                      cache=cache)
+                staging['total'] += timings['total']
+                staging['files'] += timings['files']
+
+        if cache is not None:
+            cache.evict(conn)
+            staging['cache'] = cache.stats()
+            log.info('Input cache: %(hits)d hits, %(misses)d misses, '
+                     '%(bytesSaved)d bytes not transferred, %(evicted)d '
+                     'evicted' % staging['cache'])
+
+    # Report the time taken to stage the input
+    status_url = '%s/jobs/%s' % (cumulus.config.girder.baseUrl, job['_id'])
+    r = api.patch(status_url, headers={'Girder-Token': girder_token},
+                  json={'timings': {'inputStaging': staging}})
+    check_status(r)
 
     if submit:
         submit_job.delay(cluster, job, log_write_url=log_write_url,
@@ -192,7 +309,7 @@ def _is_terminating(job, girder_token):
     headers = {'Girder-Token':  girder_token}
     status_url = '%s/jobs/%s/status' % (cumulus.config.girder.baseUrl,
                                         job['_id'])
-    r = requests.get(status_url, headers=headers)
+    r = api.get(status_url, headers=headers)
     check_status(r)
     current_status = r.json()['status']
 
@@ -200,21 +317,63 @@ def _is_terminating(job, girder_token):
 
 
 def _generate_submission_script(job, cluster, job_params):
-    env = Environment(loader=PackageLoader('cumulus', 'templates'))
-    template = env.get_template('template.sh')
-    script = template.render(cluster=cluster, job=job,
-                             baseUrl=cumulus.config.girder.baseUrl,
-                             **job_params)
-
-    # We now render again to ensure any template variable in the jobs
-    # commands are filled out.
-    script = Template(script).render(cluster=cluster, job=job,
-                                     baseUrl=cumulus.config.girder.baseUrl,
-                                     **job_params)
+    registry = get_template_registry()
+    variables = dict(job_params, cluster=cluster, job=job,
+                     baseUrl=cumulus.config.girder.baseUrl)
+
+    # The job's commands can themselves contain template variables, so they
+    # are rendered first, as a single template in case a block spans several
+    # commands.
+    commands = job.get('commands', [])
+    if commands:
+        commands = [registry.from_string('\n'.join(commands))
+                    .render(**variables)]
+
+    template = registry.get_template('template.sh')
+    script = template.render(dict(variables, job=dict(job, commands=commands)))
 
     return script
 
 
+def _resolve_slots(cluster, conn, job, job_params, env_slots=None):
+    """
+    Work out the number of slots to use for a job, updating job_params with
+    the parallel environment and the number of slots where they are needed
+    by the submission script.
+
+    :param env_slots: Optional dict used to cache the number of slots of each
+                      parallel environment, when submitting several jobs.
+    :returns: The number of slots, -1 if unknown.
+    """
+    slots = -1
+
+    # Try job parameters first
+    slots = int(job_params.get('numberOfSlots', slots))
+
+    if slots == -1:
+        # Try the cluster
+        slots = int(cluster['config'].get('numberOfSlots', slots))
+
+    parallel_env = _get_parallel_env(cluster, job)
+    if parallel_env:
+        job_params['parallelEnvironment'] = parallel_env
+
+        # If the number of slots has not been provided we will get
+        # the number of slots from the parallel environment
+        if slots == -1:
+            if env_slots is not None and parallel_env in env_slots:
+                slots = env_slots[parallel_env]
+            else:
+                slots = int(get_queue_adapter(cluster, conn)
+                            .number_of_slots(parallel_env))
+                if env_slots is not None:
+                    env_slots[parallel_env] = slots
+            if slots > 0:
+                job_params['numberOfSlots'] = slots
+
+    return slots
+
+
 def _get_on_complete(job):
     on_complete = parse('onComplete.cluster').find(job)
 
@@ -254,26 +413,7 @@ def submit_job(cluster, job, log_write_url=None, girder_token=None,
             job_dir = job_directory(cluster, job, user_home=user_home)
             job['dir'] = job_dir
 
-            slots = -1
-
-            # Try job parameters first
-            slots = int(job_params.get('numberOfSlots', slots))
-
-            if slots == -1:
-                # Try the cluster
-                slots = int(cluster['config'].get('numberOfSlots', slots))
-
-            parallel_env = _get_parallel_env(cluster, job)
-            if parallel_env:
-                job_params['parallelEnvironment'] = parallel_env
-
-                # If the number of slots has not been provided we will get
-                # the number of slots from the parallel environment
-                if slots == -1:
-                    slots = int(get_queue_adapter(cluster, conn)
-                                .number_of_slots(parallel_env))
-                    if slots > 0:
-                        job_params['numberOfSlots'] = slots
+            slots = _resolve_slots(cluster, conn, job, job_params)
 
             script = _generate_submission_script(job, cluster, job_params)
 
@@ -297,31 +437,153 @@ def submit_job(cluster, job, log_write_url=None, girder_token=None,
                 'dir': job_dir
             }
 
-            r = requests.patch(status_url, headers=headers, json=patch_data)
+            r = api.patch(status_url, headers=headers, json=patch_data)
             check_status(r)
             job = r.json()
             job['queuedTime'] = time.time()
 
             # Now monitor the jobs progress
-            if monitor:
+            if monitor and _monitor_per_cluster():
+                monitor_cluster_jobs.s(
+                    cluster, girder_token=girder_token).apply_async(countdown=5)
+            elif monitor:
                 monitor_job.s(
                     cluster, job, log_write_url=log_write_url,
                     girder_token=girder_token).apply_async(countdown=5)
 
         # Now update the status of the job
         headers = {'Girder-Token':  girder_token}
-        r = requests.patch(status_url, headers=headers,
-                           json={'status': JobState.QUEUED})
+        r = api.patch(status_url, headers=headers,
+                      json={'status': JobState.QUEUED})
         check_status(r)
     except Exception as ex:
         traceback.print_exc()
-        r = requests.patch(status_url, headers=headers,
-                           json={'status': JobState.UNEXPECTEDERROR})
+        r = api.patch(status_url, headers=headers,
+                      json={'status': JobState.UNEXPECTEDERROR})
         check_status(r)
         get_job_logger(job, girder_token).exception(str(ex))
         raise
 
 
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+@command.task
+def submit_jobs(cluster, jobs, girder_token=None, monitor=True):
+    """
+    Submit a batch of jobs to a cluster. The jobs share a single connection,
+    their directories are created using a single remote command and they are
+    submitted to the scheduler in batches of SUBMIT_BATCH_SIZE. A job that
+    fails to submit is put into the unexpected error state without affecting
+    the rest of the batch.
+    """
+    headers = {'Girder-Token':  girder_token}
+
+    def _set_error(job, msg):
+        status_url = '%s/jobs/%s' % (cumulus.config.girder.baseUrl, job['_id'])
+        r = api.patch(status_url, headers=headers,
+                      json={'status': JobState.UNEXPECTEDERROR})
+        check_status(r)
+        get_job_logger(job, girder_token).error(msg)
+
+    # if terminating skip the job
+    jobs = [job for job in jobs if not _is_terminating(job, girder_token)]
+    if not jobs:
+        return
+
+    submitted = []
+    failed = []
+    try:
+        with get_connection(girder_token, cluster) as conn:
+            output = conn.execute('pwd')
+            if len(output) != 1:
+                raise Exception('Unable to fetch users home directory.')
+
+            user_home = output[0].strip()
+            adapter = get_queue_adapter(cluster, conn)
+
+            env_slots = {}
+            scripts = []
+            for job in jobs:
+                job_params = job.get('params', {})
+                job['dir'] = job_directory(cluster, job, user_home=user_home)
+                _resolve_slots(cluster, conn, job, job_params,
+                               env_slots=env_slots)
+                script = _generate_submission_script(job, cluster, job_params)
+                scripts.append((job, script))
+
+            for mkdir in batch_commands(
+                    'mkdir -p', [job['dir'] for job in jobs]):
+                conn.execute(mkdir)
+
+            for (job, script) in scripts:
+                conn.put(StringIO(script), os.path.join(job['dir'],
+                                                        job['name']))
+
+            for chunk in _chunks(jobs, SUBMIT_BATCH_SIZE):
+                results = adapter.submit_jobs(
+                    [(job, job['name']) for job in chunk])
+
+                for (job, (queue_job_id, error)) in zip(chunk, results):
+                    if error is not None:
+                        failed.append(job['_id'])
+                        _set_error(job, 'Unable to submit job: %s' % error)
+                        continue
+
+                    # Update the state and queue job id
+                    job[AbstractQueueAdapter.QUEUE_JOB_ID] = queue_job_id
+                    status_url = '%s/jobs/%s' % (
+                        cumulus.config.girder.baseUrl, job['_id'])
+                    patch_data = {
+                        'status': JobState.QUEUED,
+                        AbstractQueueAdapter.QUEUE_JOB_ID: queue_job_id,
+                        'dir': job['dir']
+                    }
+                    r = api.patch(status_url, headers=headers,
+                                  json=patch_data)
+                    check_status(r)
+                    job = r.json()
+                    job['queuedTime'] = time.time()
+                    submitted.append(job)
+    except Exception as ex:
+        traceback.print_exc()
+        handled = set([job['_id'] for job in submitted] + failed)
+        for job in jobs:
+            if job['_id'] not in handled:
+                _set_error(job, str(ex))
+        raise
+    finally:
+        # Monitor the jobs that made it into the queue
+        if submitted and monitor and _monitor_per_cluster():
+            monitor_cluster_jobs.s(
+                cluster, girder_token=girder_token).apply_async(countdown=5)
+        elif submitted and monitor:
+            monitor_jobs.s(
+                cluster, submitted,
+                girder_token=girder_token).apply_async(countdown=5)
+
+
+def submit_batch(girder_token, cluster, jobs):
+    """
+    Submit a batch of jobs, jobs with input to download are staged and
+    submitted individually, the rest are submitted together by a single
+    submit_jobs task.
+    """
+    batch = []
+    for job in jobs:
+        if 'input' in job and len(job['input']) > 0:
+            log_url = '%s/jobs/%s/log' % (cumulus.config.girder.baseUrl,
+                                          job['_id'])
+            submit(girder_token, cluster, job, log_url)
+        else:
+            batch.append(job)
+
+    if batch:
+        submit_jobs.delay(cluster, batch, girder_token=girder_token)
+
+
 def submit(girder_token, cluster, job, log_url):
     # Do we inputs to download ?
     if 'input' in job and len(job['input']) > 0:
@@ -424,26 +686,50 @@ class Running(JobState):
                                       self.job['_id'])
         log = get_post_logger(self.job['_id'], self.girder_token, job_url)
 
+        max_bytes = get_property('tail.maxBytesPerPoll', cumulus.config,
+                                 default=TAIL_MAX_BYTES_PER_POLL)
+
         # Do we need to tail any output files
         for output in self.job.get('output', []):
             if 'tail' in output and output['tail']:
                 path = output['path']
-                offset = 0
-                if 'content' in output:
-                    offset = len(output['content'])
-                else:
-                    output['content'] = []
+                output.setdefault('content', [])
+                # The byte offset of the data we have already read, jobs
+                # tailed before we tracked the offset just have the content.
+                if 'offset' not in output:
+                    output['offset'] = len(
+                        ''.join(output['content']).encode('utf8'))
+                offset = output['offset']
                 tail_path = os.path.join(self.job['dir'], path)
-                command = 'tail -n +%d %s' % (offset, tail_path)
                 try:
                     # Only tail if file exists
-                    if self.conn.isfile(tail_path):
-                        stdout = self.conn.execute(command)
-                        output['content'] = output['content'] + stdout
-                    else:
+                    if not self.conn.isfile(tail_path):
                         log.info('Skipping tail of %s as file doesn\'t '
                                  'currently exist' %
                                  tail_path)
+                        continue
+
+                    size = self.conn.stat(tail_path).st_size
+                    # The file has been truncated so start again
+                    if size < offset:
+                        offset = 0
+                        output['content'] = []
+
+                    if size > offset:
+                        data = self.conn.read(tail_path, offset,
+                                              min(size - offset, max_bytes))
+                        # Only take complete lines, unless a single line is
+                        # bigger than our limit, the rest will be picked up on
+                        # the next poll.
+                        end = data.rfind(b'\n') + 1
+                        if end == 0 and len(data) == max_bytes:
+                            end = len(data)
+                        data = data[:end]
+                        offset += len(data)
+                        output['content'] += \
+                            data.decode('utf8', 'replace').splitlines(True)
+
+                    output['offset'] = offset
                 except Exception as ex:
                     get_job_logger(self.job,
                                    self.girder_token).exception(str(ex))
@@ -465,9 +751,66 @@ class Running(JobState):
 
 
 class Complete(JobState):
+    def _remote_error_scan(self, path, regex):
+        """
+        Use grep on the cluster to find the first line in path matching regex,
+        so the file doesn't have to be transferred.
+
+        :returns: The matching line, False if there is no match or None if the
+                  scan couldn't be done remotely, for example if the expression
+                  isn't a valid POSIX extended regular expression.
+        """
+        if self.cluster['type'] == ClusterType.NEWT:
+            return None
+
+        # grep would silently give a different answer for an expression that
+        # means something else as ERE, for example \d.
+        if not _is_ere_compatible(regex):
+            return None
+
+        # Anchor the expression to match the semantics of re.match(...)
+        command = 'grep -m1 -E -e %s %s; echo %s$?' % (
+            shlex_quote('^(%s)' % regex), shlex_quote(path), GREP_STATUS_MARKER)
+        output = self.conn.execute(command)
+
+        for (i, line) in enumerate(output):
+            if line.startswith(GREP_STATUS_MARKER):
+                status = line[len(GREP_STATUS_MARKER):].strip()
+                if status == '0':
+                    return output[0] if i > 0 else ''
+                elif status == '1':
+                    return False
+                break
+
+        return None
+
+    def _stream_error_scan(self, path, regex):
+        """
+        Stream path from the cluster stopping at the first line matching
+        regex.
+
+        :returns: The matching line or False if there is no match.
+        """
+        error_regex = re.compile(regex)
+        with self.conn.get(path) as fp:
+            for line in fp:
+                if isinstance(line, bytes):
+                    line = line.decode('utf8', 'replace')
+                if error_regex.match(line):
+                    return line
+
+        return False
+
     def next(self, job_queue_status):
+        job_url = '%s/jobs/%s/log' % (cumulus.config.girder.baseUrl,
+                                      self.job['_id'])
+        log = get_post_logger(self.job['_id'], self.girder_token, job_url)
+
+        # The elements of a job array each have their own output files, so
+        # their failures are picked up from the scheduler instead.
+        if self.job.get('array'):
+            return self
 
-        error = False
         for output in self.job.get('output', []):
             if 'errorRegEx' in output and output['errorRegEx']:
                 stdout_file = '%s-%s.o%s' % (self.job['name'],
@@ -482,27 +825,18 @@ class Complete(JobState):
                     'stderr': stderr_file
                 }
 
-                tmp_path = None
-                try:
-                    path = Template(output['path']).render(**variables)
-                    tmp_path = os.path.join(tempfile.tempdir, path)
-                    path = os.path.join(self.job['dir'], path)
-                    self.conn.get(path, localpath=tmp_path)
-                    error_regex = re.compile(output['errorRegEx'])
-                    with open(tmp_path, 'r') as fp:
-                        for line in fp:
-                            if error_regex.match(line):
-                                error = True
-                                break
-                finally:
-                    if tmp_path and os.path.exists(tmp_path):
-                        os.remove(tmp_path)
+                path = get_template_registry().from_string(
+                    output['path']).render(**variables)
+                path = os.path.join(self.job['dir'], path)
+                match = self._remote_error_scan(path, output['errorRegEx'])
+                if match is None:
+                    match = self._stream_error_scan(path,
+                                                    output['errorRegEx'])
 
-            if error:
-                break
-
-        if error:
-            return Error(self)
+                if match is not False:
+                    log.error('Error found in "%s": %s' %
+                              (path, match.strip()[:ERROR_EXCERPT_LENGTH]))
+                    return Error(self)
 
         return self
 
@@ -519,7 +853,9 @@ class Complete(JobState):
 
 class Terminating(JobState):
     def next(self, job_queue_status):
-        if not job_queue_status or job_queue_status == JobQueueState.COMPLETE:
+        # The accounting records of a terminated job may report it as failed
+        if not job_queue_status or job_queue_status in [
+                JobQueueState.COMPLETE, JobQueueState.ERROR]:
             return Terminated(self)
         else:
             return self
@@ -605,82 +941,232 @@ def from_string(s, **kwargs):
     return state
 
 
+# Job states that still require monitoring
+_running_states = set(
+    [JobState.CREATED, JobState.QUEUED,
+     JobState.RUNNING, JobState.TERMINATING]
+)
+
+
+def _element_states(jobs):
+    """
+    Returns the element states of each job array, keyed by job id, these are
+    the states stored in Girder until the jobs are next updated.
+    """
+    return {job['_id']: dict(job.get('elements', {})) for job in jobs}
+
+
+def _changed_elements(job, previous_states):
+    """
+    Returns the elements of a job array whose state differs from their
+    previous state.
+    """
+    return {index: state for (index, state) in six.iteritems(
+        job.get('elements', {})) if previous_states.get(index) != state}
+
+
+def _update_job_state(task, cluster, conn, job, queue_state, current_status,
+                      log_write_url, girder_token, elements=None):
+    """
+    Move a job through the state machine based on its queue state and update
+    the job in Girder.
+
+    :param elements: The elements of a job array whose state has changed.
+    :returns: The new status of the job.
+    """
+    headers = {'Girder-Token':  girder_token}
+
+    job_status = from_string(current_status, task=task,
+                             cluster=cluster, job=job,
+                             log_write_url=log_write_url,
+                             girder_token=girder_token,
+                             conn=conn)
+    job_status = job_status.next(queue_state)
+    job['status'] = str(job_status)
+    job_status.run()
+    json = {
+        'status': str(job_status),
+        'timings': job.get('timings', {}),
+        'output': job['output']
+    }
+    if elements:
+        json['elements'] = elements
+    job_url = '%s/jobs/%s' % (cumulus.config.girder.baseUrl,
+                              job['_id'])
+    r = api.patch(job_url, headers=headers, json=json)
+    check_status(r)
+
+    return job['status']
+
+
+def _job_queue_states(adapter, jobs):
+    """
+    Get the queue state of each job. Jobs that are no longer known to the
+    scheduler are looked up in its accounting records, in a single call, to
+    find out whether they failed. Their exit code, elapsed and CPU time, in
+    milliseconds, and peak memory are recorded in the job's timings. A job
+    array is in error if any of its elements failed.
+
+    :returns: List of (job, queue state) tuples.
+    """
+    job_queue_states = adapter.job_statuses(jobs)
+
+    vanished = [job for (job, state) in job_queue_states if not state]
+    if not vanished:
+        return job_queue_states
+
+    try:
+        accounting = adapter.job_accounting(vanished)
+    except Exception:
+        # Without accounting records the job is assumed to have completed
+        traceback.print_exc()
+        return job_queue_states
+
+    states = []
+    for (job, state) in job_queue_states:
+        record = accounting.get(job[AbstractQueueAdapter.QUEUE_JOB_ID])
+        if not state and job.get('array'):
+            # Pick up the elements that failed
+            for index in array_indices(job['array']):
+                element_record = accounting.get(
+                    array_element_id(job[AbstractQueueAdapter.QUEUE_JOB_ID],
+                                     index))
+                if element_record:
+                    job['elements'][str(index)] = element_record['state']
+
+            if JobQueueState.ERROR in job['elements'].values():
+                state = JobQueueState.ERROR
+
+        if not state and record:
+            state = record['state']
+            timings = job.setdefault('timings', {})
+            for key in ['elapsed', 'cpuTime']:
+                if key in record:
+                    timings[key] = int(round(record[key] * 1000))
+            for key in ['exitCode', 'maxMemory']:
+                if key in record:
+                    timings[key] = record[key]
+
+        states.append((job, state))
+
+    return states
+
+
+def _next_poll_interval(adapter, transitions, monitor_interval,
+                        poll_interval):
+    """
+    Work out when we should next poll a set of jobs, jobs that have just
+    changed state are polled at the monitor interval, otherwise we back off
+    based on the state the jobs are in.
+
+    :param adapter: The queue adapter for the cluster.
+    :param transitions: List of (job, previous status, new status) tuples.
+    :param monitor_interval: The base interval.
+    :param poll_interval: The interval used for the last poll.
+    """
+    active = [(job, new) for (job, previous, new) in transitions
+              if new in _running_states]
+    changed = any([previous != new for (_, previous, new) in transitions])
+
+    # If everything is waiting in the queue see if the scheduler can tell us
+    # when things are going to start.
+    estimates = {}
+    if not changed and all([new == JobState.QUEUED for (_, new) in active]):
+        try:
+            estimates = adapter.estimated_start_times(
+                [job for (job, _) in active])
+        except Exception:
+            # Estimates are only an optimization
+            traceback.print_exc()
+
+    intervals = [
+        polling.next_interval(
+            new, monitor_interval, previous_interval=poll_interval,
+            state_changed=changed,
+            estimated_start=estimates.get(
+                job[AbstractQueueAdapter.QUEUE_JOB_ID]))
+        for (job, new) in active]
+
+    return min(intervals) if intervals else monitor_interval
+
+
 def _monitor_jobs(task, cluster, jobs, log_write_url=None, girder_token=None,
-                  monitor_interval=5):
+                  monitor_interval=5, poll_interval=None, single=False):
+    """
+    :param single: True if the task monitors a single job, rather than a list
+                   of jobs, this determines the arguments it is retried with.
+    """
     headers = {'Girder-Token':  girder_token}
 
+    # The jobs are updated as we go, for example with the offset reached when
+    # tailing their output, so they must be passed on to the next poll.
+    def _retry_args():
+        return (cluster, jobs[0] if single else jobs)
+
     cluster_url = '%s/clusters/%s' % (
         cumulus.config.girder.baseUrl, cluster['_id'])
     try:
         with get_connection(girder_token, cluster) as conn:
 
             try:
-                job_queue_states \
-                    = get_queue_adapter(cluster, conn).job_statuses(jobs)
+                adapter = get_queue_adapter(cluster, conn)
+                element_states = _element_states(jobs)
+                job_queue_states = _job_queue_states(adapter, jobs)
 
-                new_states = set()
+                transitions = []
                 for (job, state) in job_queue_states:
                     job_id = job['_id']
                     # First get the current status
                     status_url = '%s/jobs/%s/status' % (
                         cumulus.config.girder.baseUrl, job_id)
-                    r = requests.get(status_url, headers=headers)
+                    r = api.get(status_url, headers=headers)
                     check_status(r)
                     current_status = r.json()['status']
 
                     if current_status == JobState.TERMINATED:
                         continue
 
-                    job_status = from_string(current_status, task=task,
-                                             cluster=cluster, job=job,
-                                             log_write_url=log_write_url,
-                                             girder_token=girder_token,
-                                             conn=conn)
-                    job_status = job_status.next(state)
-                    job['status'] = str(job_status)
-                    job_status.run()
-                    json = {
-                        'status': str(job_status),
-                        'timings': job.get('timings', {}),
-                        'output': job['output']
-                    }
-                    job_url = '%s/jobs/%s' % (cumulus.config.girder.baseUrl,
-                                              job['_id'])
-                    r = requests.patch(job_url, headers=headers, json=json)
-                    check_status(r)
-
-                    new_states.add(job['status'])
-
-                # Now see if we still have jobs to monitor
-                running_states = set(
-                    [JobState.CREATED, JobState.QUEUED,
-                     JobState.RUNNING, JobState.TERMINATING]
-                )
+                    new_status = _update_job_state(
+                        task, cluster, conn, job, state, current_status,
+                        log_write_url, girder_token,
+                        elements=_changed_elements(
+                            job, element_states[job_id]))
+                    transitions.append((job, current_status, new_status))
 
                 # Do we have any job still in a running state?
-                if new_states & running_states:
-                    task.retry(countdown=monitor_interval)
+                new_states = set([new for (_, _, new) in transitions])
+                if new_states & _running_states:
+                    poll_interval = _next_poll_interval(
+                        adapter, transitions, monitor_interval,
+                        poll_interval)
+                    task.retry(
+                        countdown=poll_interval, args=_retry_args(), kwargs={
+                            'log_write_url': log_write_url,
+                            'girder_token': girder_token,
+                            'monitor_interval': monitor_interval,
+                            'poll_interval': poll_interval
+                        })
             except EOFError:
                 # Try again
-                task.retry(countdown=5)
+                task.retry(countdown=5, args=_retry_args())
                 return
             except paramiko.ssh_exception.NoValidConnectionsError as ex:
                 # Try again
-                task.retry(countdown=5)
+                task.retry(countdown=5, args=_retry_args())
                 return
     # Ensure that the Retry exception will get through
     except Retry:
         raise
     except paramiko.ssh_exception.NoValidConnectionsError as ex:
-        r = requests.patch(cluster_url, headers=headers,
-                           json={'status': 'error'})
+        r = api.patch(cluster_url, headers=headers,
+                      json={'status': 'error'})
         check_status(r)
         get_cluster_logger(cluster, girder_token).exception(str(ex))
 
     except Exception as ex:
         traceback.print_exc()
-        r = requests.patch(cluster_url, headers=headers,
-                           json={'status': 'error'})
+        r = api.patch(cluster_url, headers=headers,
+                      json={'status': 'error'})
         check_status(r)
         get_cluster_logger(cluster, girder_token).exception(str(ex))
         raise
@@ -688,16 +1174,215 @@ def _monitor_jobs(task, cluster, jobs, log_write_url=None, girder_token=None,
 
 @monitor.task(bind=True, max_retries=None, throws=(Retry,))
 def monitor_job(task, cluster, job, log_write_url=None, girder_token=None,
-                monitor_interval=5):
+                monitor_interval=5, poll_interval=None):
     _monitor_jobs(task, cluster, [job], log_write_url, girder_token,
-                  monitor_interval=monitor_interval)
+                  monitor_interval=monitor_interval,
+                  poll_interval=poll_interval, single=True)
 
 
 @monitor.task(bind=True, max_retries=None, throws=(Retry,))
 def monitor_jobs(task, cluster, jobs, log_write_url=None, girder_token=None,
-                 monitor_interval=5):
+                 monitor_interval=5, poll_interval=None):
     _monitor_jobs(task, cluster, jobs, log_write_url, girder_token,
-                  monitor_interval=monitor_interval)
+                  monitor_interval=monitor_interval,
+                  poll_interval=poll_interval)
+
+
+def _monitor_per_cluster():
+    return get_property('monitor.perCluster', cumulus.config, default=False)
+
+
+def _cluster_monitor_lease_ttl(poll_interval):
+    # Long enough to cover the wait between polls and a slow poll
+    return 2 * poll_interval + CLUSTER_MONITOR_LEASE_PADDING
+
+
+def _acquire_cluster_monitor(task, cluster, girder_token, ttl):
+    headers = {'Girder-Token':  girder_token}
+    monitor_url = '%s/clusters/%s/monitor' % (cumulus.config.girder.baseUrl,
+                                              cluster['_id'])
+    r = api.put(monitor_url, headers=headers,
+                params={'taskId': task.request.id, 'ttl': ttl})
+    check_status(r)
+
+    return r.json()
+
+
+def _release_cluster_monitor(task, cluster, girder_token):
+    headers = {'Girder-Token':  girder_token}
+    monitor_url = '%s/clusters/%s/monitor' % (cumulus.config.girder.baseUrl,
+                                              cluster['_id'])
+    r = api.delete(monitor_url, headers=headers,
+                   params={'taskId': task.request.id})
+    check_status(r)
+
+
+def _active_cluster_jobs(cluster, girder_token):
+    headers = {'Girder-Token':  girder_token}
+    jobs_url = '%s/jobs' % cumulus.config.girder.baseUrl
+    params = {
+        'clusterId': cluster['_id'],
+        'status': ','.join([JobState.QUEUED, JobState.RUNNING,
+                            JobState.TERMINATING])
+    }
+    r = api.get(jobs_url, headers=headers, params=params)
+    check_status(r)
+
+    # Only jobs that have made it into the queue can be monitored
+    return [job for job in r.json()
+            if AbstractQueueAdapter.QUEUE_JOB_ID in job]
+
+
+def _update_cluster_job_state(task, cluster, conn, job, queue_state,
+                              girder_token, elements=None):
+    """
+    Update the state of a job monitored by monitor_cluster_jobs(...), a problem
+    with one job shouldn't stop us monitoring the others, so errors are logged
+    against the job and it is left in its current state to be tried again on
+    the next poll.
+
+    :returns: The new status of the job.
+    """
+    current_status = job['status']
+    log_write_url = '%s/jobs/%s/log' % (cumulus.config.girder.baseUrl,
+                                        job['_id'])
+    try:
+        return _update_job_state(task, cluster, conn, job, queue_state,
+                                 current_status, log_write_url, girder_token,
+                                 elements=elements)
+    except (Retry, EOFError, paramiko.ssh_exception.NoValidConnectionsError):
+        raise
+    except Exception as ex:
+        traceback.print_exc()
+        get_job_logger(job, girder_token).exception(str(ex))
+
+        return current_status
+
+
+def _poll_cluster_jobs(task, cluster, conn, adapter, jobs, job_timers,
+                       girder_token):
+    """
+    Update the state of all the active jobs on a cluster using a single call
+    to the queue adapter.
+
+    :param job_timers: The queued and running start times of the jobs from the
+                       last poll.
+    :returns: Tuple of the list of (job, previous status, new status) tuples
+              and the job timers to carry on to the next poll.
+    """
+    element_states = _element_states(jobs)
+    job_queue_states = _job_queue_states(adapter, jobs)
+
+    transitions = []
+    timers = {}
+    for (job, state) in job_queue_states:
+        job_id = job['_id']
+        current_status = job['status']
+        job.update(job_timers.get(job_id, {}))
+        if current_status == JobState.QUEUED:
+            job.setdefault('queuedTime', time.time())
+
+        new_status = _update_cluster_job_state(
+            task, cluster, conn, job, state, girder_token,
+            elements=_changed_elements(job, element_states[job_id]))
+        transitions.append((job, current_status, new_status))
+
+        timers[job_id] = {
+            key: job[key] for key in ['queuedTime', 'runningTime']
+            if key in job
+        }
+
+    return (transitions, timers)
+
+
+@monitor.task(bind=True, max_retries=None, throws=(Retry,))
+def monitor_cluster_jobs(task, cluster, girder_token=None, monitor_interval=5,
+                         poll_interval=None, job_timers=None,
+                         lease_retry=True):
+    """
+    Monitor all the active jobs on a cluster, a single call to the queue
+    adapter is made for all the jobs each time we poll, so the load on the
+    scheduler doesn't grow with the number of jobs. Only one instance of this
+    task runs per cluster, this is ensured using a lease held on the cluster.
+
+    :param poll_interval: The interval used for the last poll.
+    :param job_timers: The queued and running start times of the jobs being
+                       monitored, these are carried across retries.
+    :param lease_retry: If True and the lease is held elsewhere try once more
+                        when the current lease would have expired.
+    """
+    headers = {'Girder-Token':  girder_token}
+    cluster_url = '%s/clusters/%s' % (
+        cumulus.config.girder.baseUrl, cluster['_id'])
+    kwargs = {
+        'girder_token': girder_token,
+        'monitor_interval': monitor_interval,
+        'poll_interval': poll_interval,
+        'job_timers': job_timers or {},
+        'lease_retry': lease_retry
+    }
+
+    lease = _acquire_cluster_monitor(
+        task, cluster, girder_token,
+        _cluster_monitor_lease_ttl(poll_interval or monitor_interval))
+    if not lease['acquired']:
+        # Another task is monitoring this cluster, however, the lease may be
+        # stale so check again once it would have expired.
+        if lease_retry:
+            kwargs['lease_retry'] = False
+            # expiresIn is None if the lease has just been released
+            expires_in = lease.get('expiresIn') or 0
+            task.retry(countdown=max(expires_in, 0) + 1, kwargs=kwargs)
+        return
+
+    # Once we have the lease we hold onto it while there are jobs
+    kwargs['lease_retry'] = False
+
+    try:
+        jobs = _active_cluster_jobs(cluster, girder_token)
+        if not jobs:
+            _release_cluster_monitor(task, cluster, girder_token)
+            return
+
+        with get_connection(girder_token, cluster) as conn:
+            try:
+                adapter = get_queue_adapter(cluster, conn)
+                (transitions, timers) = _poll_cluster_jobs(
+                    task, cluster, conn, adapter, jobs, kwargs['job_timers'],
+                    girder_token)
+                kwargs['poll_interval'] = _next_poll_interval(
+                    adapter, transitions, monitor_interval, poll_interval)
+            except (EOFError, paramiko.ssh_exception.NoValidConnectionsError):
+                # Try again
+                task.retry(countdown=5, kwargs=kwargs)
+                return
+
+        # Poll again, we will stop once there are no active jobs left
+        # Make sure the lease covers the time until we next poll
+        kwargs['job_timers'] = timers
+        lease = _acquire_cluster_monitor(
+            task, cluster, girder_token,
+            _cluster_monitor_lease_ttl(kwargs['poll_interval']))
+        if not lease['acquired']:
+            # Our lease expired and another task has taken over monitoring
+            # this cluster, leave it to that task.
+            return
+        task.retry(countdown=kwargs['poll_interval'], kwargs=kwargs)
+    # Ensure that the Retry exception will get through
+    except Retry:
+        raise
+    except Exception as ex:
+        traceback.print_exc()
+        try:
+            _release_cluster_monitor(task, cluster, girder_token)
+        except Exception:
+            pass
+        r = api.patch(cluster_url, headers=headers,
+                      json={'status': 'error'})
+        check_status(r)
+        get_cluster_logger(cluster, girder_token).exception(str(ex))
+        if not isinstance(ex, paramiko.ssh_exception.NoValidConnectionsError):
+            raise
 
 
 def upload_job_output_to_item(cluster, job, log_write_url=None, job_dir=None,
@@ -760,8 +1445,8 @@ def upload_job_output_to_item(cluster, job, log_write_url=None, job_dir=None,
                               girder_token=girder_token)
 
     except Exception as ex:
-        r = requests.patch(status_url, headers=headers,
-                           json={'status': JobState.UNEXPECTEDERROR})
+        r = api.patch(status_url, headers=headers,
+                      json={'status': JobState.UNEXPECTEDERROR})
         check_status(r)
         get_job_logger(job, girder_token).exception(str(ex))
 
@@ -788,8 +1473,8 @@ def upload_job_output_to_folder(cluster, job, log_write_url=None, job_dir=None,
         url = '%s/jobs/%s/log' % (cumulus.config.girder.baseUrl, job['_id'])
         logger = get_post_logger('job', girder_token, url)
         logger.exception(e.responseText)
-        r = requests.patch(status_url, headers=headers,
-                           json={'status': JobState.ERROR})
+        r = api.patch(status_url, headers=headers,
+                      json={'status': JobState.ERROR})
         check_status(r)
 
     if _get_on_complete(job) == 'terminate':
@@ -810,8 +1495,8 @@ def upload_job_output_to_folder(cluster, job, log_write_url=None, job_dir=None,
         job_status = Complete(job_status)
         job_status = job_status.next(JobQueueState.COMPLETE)
         job_status.run()
-        r = requests.patch(status_url, headers=headers,
-                           json={'status': str(job_status)})
+        r = api.patch(status_url, headers=headers,
+                      json={'status': str(job_status)})
         check_status(r)
 
 
@@ -837,7 +1522,7 @@ def upload_job_output(cluster, job, log_write_url=None, job_dir=None,
 def monitor_process(task, cluster, job, pid, nohup_out_path,
                     log_write_url=None, on_complete=None,
                     output_message='Job download/upload error: %s',
-                    girder_token=None):
+                    girder_token=None, poll_interval=None):
     job_url = '%s/jobs/%s/log' % (cumulus.config.girder.baseUrl, job['_id'])
     log = get_post_logger(job['_id'], girder_token, job_url)
     headers = {'Girder-Token':  girder_token}
@@ -856,10 +1541,18 @@ def monitor_process(task, cluster, job, pid, nohup_out_path,
                                   source_profile=False)
 
             if len(output) > 0:
-                # Process is still running so schedule self again in about 5
-                # secs
+                # Process is still running so schedule self again, backing off
+                # the longer the process runs.
+                poll_interval = polling.next_interval(
+                    polling.PROCESS, 5, previous_interval=poll_interval)
                 # N.B. throw=False to prevent Retry exception being raised
-                task.retry(throw=False, countdown=5)
+                task.retry(throw=False, countdown=poll_interval, kwargs={
+                    'log_write_url': log_write_url,
+                    'on_complete': on_complete,
+                    'output_message': output_message,
+                    'girder_token': girder_token,
+                    'poll_interval': poll_interval
+                })
             else:
                 try:
                     nohup_out_file_name = os.path.basename(nohup_out_path)
@@ -871,8 +1564,8 @@ def monitor_process(task, cluster, job, pid, nohup_out_path,
                             log.error(output_message % output)
                             # If we have output then set the error state on the
                             # job and return
-                            r = requests.patch(status_url, headers=headers,
-                                               json={'status': JobState.ERROR})
+                            r = api.patch(status_url, headers=headers,
+                                          json={'status': JobState.ERROR})
                             check_status(r)
                             return
                 finally:
@@ -894,16 +1587,16 @@ def monitor_process(task, cluster, job, pid, nohup_out_path,
                     job_status = Complete(job_status)
                     job_status = job_status.next(JobQueueState.COMPLETE)
                     job_status.run()
-                    r = requests.patch(status_url, headers=headers,
-                                       json={'status': str(job_status)})
+                    r = api.patch(status_url, headers=headers,
+                                  json={'status': str(job_status)})
                     check_status(r)
 
     except EOFError:
         # Try again
         task.retry(throw=False, countdown=5)
     except Exception as ex:
-        r = requests.patch(status_url, headers=headers,
-                           json={'status': JobState.UNEXPECTEDERROR})
+        r = api.patch(status_url, headers=headers,
+                      json={'status': JobState.UNEXPECTEDERROR})
         check_status(r)
         get_job_logger(job, girder_token).exception(str(ex))
         raise
@@ -923,13 +1616,13 @@ def terminate_job(cluster, job, log_write_url=None, girder_token=None):
                 queue_adapter = get_queue_adapter(cluster, conn)
                 output = queue_adapter.terminate_job(job)
             else:
-                r = requests.patch(status_url, headers=headers,
-                                   json={'status': JobState.TERMINATED})
+                r = api.patch(status_url, headers=headers,
+                              json={'status': JobState.TERMINATED})
                 check_status(r)
 
             if 'onTerminate' in job:
                 commands = '\n'.join(job['onTerminate']['commands']) + '\n'
-                commands = Template(commands) \
+                commands = get_template_registry().from_string(commands) \
                     .render(cluster=cluster,
                             job=job,
                             base_url=cumulus.config.girder.baseUrl)
@@ -961,8 +1654,8 @@ def terminate_job(cluster, job, log_write_url=None, girder_token=None):
                                       girder_token=girder_token)
 
     except Exception as ex:
-        r = requests.patch(status_url, headers=headers,
-                           json={'status': JobState.UNEXPECTEDERROR})
+        r = api.patch(status_url, headers=headers,
+                      json={'status': JobState.UNEXPECTEDERROR})
         check_status(r)
         get_job_logger(job, girder_token).exception(str(ex))
         raise
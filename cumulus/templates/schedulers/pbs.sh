@@ -8,6 +8,13 @@
 {% if maxWallTime -%}
 #PBS -l walltime={{maxWallTime.hours}}:{{maxWallTime.minutes}}:{{maxWallTime.seconds}}
 {% endif -%}
+{% if job.array -%}
+{% if job.array.step and job.array.step|int > 1 -%}
+#PBS -t {{range(job.array.start|int, job.array.end|int + 1, job.array.step|int)|join(',')}}{{'%%%s' % job.array.limit if job.array.limit}}
+{% else -%}
+#PBS -t {{job.array.start}}-{{job.array.end}}{{'%%%s' % job.array.limit if job.array.limit}}
+{% endif -%}
+{% endif -%}
 {% if queue -%}
 #PBS -q {{queue}}
 {% endif -%}
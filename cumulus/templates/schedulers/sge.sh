@@ -11,6 +11,12 @@
 {% if gpus -%}
 #$ -l gpus={{gpus}}
 {% endif -%}
+{% if job.array -%}
+#$ -t {{job.array.start}}-{{job.array.end}}{{':%s' % job.array.step if job.array.step}}
+{% if job.array.limit -%}
+#$ -tc {{job.array.limit}}
+{% endif -%}
+{% endif -%}
 {% if queue -%}
 #$ -q {{queue}}
 {% endif -%}
@@ -1,7 +1,7 @@
 #
 #SBATCH --job-name={{job.name}}-{{job._id}}
-#SBATCH --output={{job.name}}-{{job._id}}.o%j
-#SBATCH --error={{job.name}}-{{job._id}}.e%j
+#SBATCH --output={{job.name}}-{{job._id}}.o{{'%A_%a' if job.array else '%j'}}
+#SBATCH --error={{job.name}}-{{job._id}}.e{{'%A_%a' if job.array else '%j'}}
 #SBATCH --workdir={{job.dir}}
 {% if numberOfSlots -%}
 #SBATCH --ntasks={{numberOfSlots}}
@@ -17,6 +17,9 @@
 {% if maxWallTime -%}
 #SBATCH --time={{maxWallTime.hours}}:{{maxWallTime.minutes}}:{{maxWallTime.seconds}}
 {% endif -%}
+{% if job.array -%}
+#SBATCH --array={{job.array.start}}-{{job.array.end}}{{':%s' % job.array.step if job.array.step}}{{'%%%s' % job.array.limit if job.array.limit}}
+{% endif -%}
 {% if queue -%}
 #SBATCH --partition={{queue}}
 {% endif -%}
@@ -8,8 +8,10 @@
 #
 {% include "schedulers/" + cluster.config.scheduler.type + ".sh" -%}
 
+{% if job.array -%}
+export CUMULUS_ARRAY_INDEX=${{ {'slurm': 'SLURM_ARRAY_TASK_ID', 'sge': 'SGE_TASK_ID', 'pbs': 'PBS_ARRAYID'}[cluster.config.scheduler.type] }}
+{% endif -%}
 {% for command in job.commands %}
 {{ command -}}
 {% endfor %}
 
-
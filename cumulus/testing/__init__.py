@@ -21,6 +21,27 @@ import json
 import re
 
 
+class LogHandlerMixin(object):
+    """
+    This mixin stops RESTfulLogHandlers POSTing log records during a test, the
+    records are passed to the self.log_post mock instead. Buffered records are
+    flushed at the end of each test so none are sent once the mock is
+    removed.
+    """
+
+    def setUp(self):
+        super(LogHandlerMixin, self).setUp()
+
+        import mock
+        from cumulus.logging import flush_handlers
+
+        patcher = mock.patch('cumulus.logging.RESTfulLogHandler._post')
+        self.log_post = patcher.start()
+        # Cleanups run last in first out, so we flush before removing the mock
+        self.addCleanup(patcher.stop)
+        self.addCleanup(flush_handlers)
+
+
 class AssertCallsMixin(object):
     """
     This mixin add support for asserting mock call_args_lists.
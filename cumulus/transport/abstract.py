@@ -17,18 +17,132 @@
 #  limitations under the License.
 ###############################################################################
 
+import os
+from contextlib import contextmanager
+import stat
+
+# Chunk size used when skipping to an offset
+READ_CHUNK_SIZE = 64 * 1024
+
+# The find -printf format used to walk a tree in one command, each entry is
+# the type, permissions, size, mtime, uid, gid and the path relative to the
+# starting point. The path comes last so it can contain spaces.
+FIND_WALK_FORMAT = '%y %m %s %T@ %U %G %P'
+
+_find_types = {
+    'd': stat.S_IFDIR,
+    'f': stat.S_IFREG,
+    'l': stat.S_IFLNK,
+    'p': stat.S_IFIFO,
+    's': stat.S_IFSOCK,
+    'b': stat.S_IFBLK,
+    'c': stat.S_IFCHR
+}
+
+
+def parse_find_entry(entry):
+    """
+    Parse an entry output by find using FIND_WALK_FORMAT into an object of the
+    form yielded by AbstractConnection.walk(...).
+    """
+    (type, perms, size, mtime, uid, gid, path) = entry.split(' ', 6)
+
+    return {
+        'path': path,
+        'name': os.path.basename(path),
+        'user': int(uid),
+        'group': int(gid),
+        'mode': _find_types.get(type, 0) | int(perms, 8),
+        'date': int(float(mtime)),
+        'size': int(size)
+    }
+
+
+def walk_listing(list_directory, root):
+    """
+    Recursively list root one directory at a time, see
+    AbstractConnection.walk(...).
+
+    :param list_directory: Called with the path of a directory, returns the
+        entries in it in the form returned by AbstractConnection.list(...).
+    :param root: The directory to list.
+    """
+    directories = ['']
+    while directories:
+        directory = directories.pop()
+        for entry in list_directory(os.path.join(root, directory)):
+            if entry['name'] in ['.', '..']:
+                continue
+
+            entry['path'] = os.path.join(directory, entry['name'])
+            yield entry
+
+            if stat.S_ISDIR(entry['mode']):
+                directories.append(entry['path'])
+
 
 class AbstractConnection(object):
 
+    # Whether tar_writer(...) and tar_reader(...) are supported
+    supports_tar = False
+
     def execute(self, command, ignore_exit_status=False, source_profile=True):
         raise NotImplementedError('Implemented by subclass')
 
     def get(self, remote_path):
         raise NotImplementedError('Implemented by subclass')
 
+    def read(self, remote_path, offset=0, size=-1):
+        """
+        Read up to size bytes from remote_path starting at offset, if size is
+        negative the rest of the file is read. This implementation reads
+        through the file to reach the offset, subclasses that can seek should
+        override it.
+        """
+        with self.get(remote_path) as fp:
+            while offset > 0:
+                data = fp.read(min(offset, READ_CHUNK_SIZE))
+                if not data:
+                    return b''
+                offset -= len(data)
+
+            if size < 0:
+                return fp.read()
+
+            return fp.read(size)
+
     def isfile(self, remote_path):
         raise NotImplementedError('Implemented by subclass')
 
+    @contextmanager
+    def transfer_channel(self):
+        """
+        Yields a connection that file operations can be performed on from
+        another thread, alongside those on this connection. Subclasses whose
+        file operations can't be shared between threads should override this,
+        by default the connection itself is yielded.
+        """
+        yield self
+
+    def tar_writer(self, remote_path, compress=False):
+        """
+        Returns a context manager yielding a writable stream, a tar archive
+        written to it is extracted into remote_path, which is created if
+        needed. The extraction is checked on exit.
+
+        :param compress: True if the archive is gzip compressed.
+        """
+        raise NotImplementedError('Implemented by subclass')
+
+    def tar_reader(self, remote_path, compress=False):
+        """
+        Returns a context manager yielding a readable stream of a tar archive
+        of the contents of remote_path.
+
+        :param compress: True if the archive should be gzip compressed.
+        """
+        raise NotImplementedError('Implemented by subclass')
+
     def mkdir(self, path, ignore_failure=False):
         raise NotImplementedError('Implemented by subclass')
 
@@ -58,3 +172,14 @@ class AbstractConnection(object):
         }
         """
         raise NotImplementedError('Implemented by subclass')
+
+    def walk(self, root):
+        """
+        Recursively list root, yielding an object of the form returned by
+        list(...) for each file and directory below it, with an additional
+        'path' key giving its path relative to root. Directories are yielded
+        before their contents. This implementation lists one directory at a
+        time, subclasses that can list the whole tree in one round trip should
+        override it.
+        """
+        return walk_listing(self.list, root)
@@ -16,14 +16,75 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 ###############################################################################
-import requests
+from cumulus.common import api
 from jsonpath_rw import parse
+from six.moves import shlex_quote
 
 import cumulus
 from cumulus.common import check_status
+from cumulus.common.jsonpath import get_property
 
 ssh_cluster = ['trad', 'ec2']
 
+# Trees of at least this many files, averaging no more than
+# DEFAULT_TAR_MAX_AVERAGE_SIZE bytes, are transferred as a single tar stream
+# rather than file by file.
+DEFAULT_TAR_MIN_FILES = 100
+DEFAULT_TAR_MAX_AVERAGE_SIZE = 1024 * 1024
+
+# Keep batched remote commands well below the system's argument limit
+MAX_COMMAND_LENGTH = 128 * 1024
+
+
+def batch_commands(command, args, max_length=MAX_COMMAND_LENGTH):
+    """
+    Returns the commands needed to run command with all of args, quoted,
+    keeping the length of each command below max_length.
+    """
+    commands = []
+    current = command
+    for arg in args:
+        arg = shlex_quote(arg)
+        if current != command and \
+                len(current) + len(arg) + 1 > max_length:
+            commands.append(current)
+            current = command
+        current = '%s %s' % (current, arg)
+
+    if current != command:
+        commands.append(current)
+
+    return commands
+
+
+def use_tar(cluster_connection, file_count, total_size):
+    """
+    Returns True if a set of files should be transferred as a tar stream, the
+    thresholds can be set in the transfer.tar section of the configuration.
+    """
+    if not cluster_connection.supports_tar:
+        return False
+
+    if not get_property('transfer.tar.enabled', cumulus.config, default=True):
+        return False
+
+    min_files = get_property('transfer.tar.minFiles', cumulus.config,
+                             default=DEFAULT_TAR_MIN_FILES)
+    max_average_size = get_property('transfer.tar.maxAverageSize',
+                                    cumulus.config,
+                                    default=DEFAULT_TAR_MAX_AVERAGE_SIZE)
+
+    return file_count >= min_files and \
+        total_size <= max_average_size * file_count
+
+
+def tar_compress():
+    """
+    Returns True if tar streams should be compressed.
+    """
+    return get_property('transfer.tar.compress', cumulus.config,
+                        default=False)
+
 
 def get_assetstore_url_base(cluster):
     if cluster['type'] in ssh_cluster:
@@ -50,7 +111,7 @@ def get_assetstore_id(girder_token, cluster):
         if user:
             body['user'] = user[0].value
 
-        r = requests.post(create_url, json=body, headers=headers)
+        r = api.post(create_url, json=body, headers=headers)
         check_status(r)
 
         cluster['assetstoreId'] = r.json()['_id']
@@ -60,7 +121,7 @@ def get_assetstore_id(girder_token, cluster):
         body = {
             'assetstoreId': cluster['assetstoreId']
         }
-        r = requests.patch(cluster_url, json=body, headers=headers)
+        r = api.patch(cluster_url, json=body, headers=headers)
         check_status(r)
 
     return cluster['assetstoreId']
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import os
+import threading
+import uuid
+
+from jsonpath_rw import parse
+from six.moves import shlex_quote
+
+# The default size budget for a cluster's input cache, in bytes
+DEFAULT_MAX_SIZE = 100 * 1024 ** 3
+# Staged files are hard linked to the cached copy by default, symbolic links
+# can be used when the cache is on a different file system to the jobs.
+HARD_LINK = 'hard'
+SYMBOLIC_LINK = 'symbolic'
+# The directory holding the cached content, named by the sha512 of the
+# content.
+BLOBS_DIR = 'blobs'
+
+
+def input_cache_config(cluster):
+    """
+    Returns the input cache configuration of a cluster, the inputCache section
+    of the cluster's config, or None if the cluster doesn't have a cache.
+
+        "inputCache": {
+            "path": "/scratch/cumulus/cache",
+            "maxSize": 107374182400,
+            "link": "hard"
+        }
+    """
+    config = parse('config.inputCache').find(cluster)
+    if not config or not config[0].value.get('path'):
+        return None
+
+    config = config[0].value
+
+    return {
+        'path': config['path'],
+        'maxSize': int(config.get('maxSize', DEFAULT_MAX_SIZE)),
+        'link': config.get('link', HARD_LINK)
+    }
+
+
+class InputCache(object):
+    """
+    A content addressed cache of job input on a cluster, keyed by the sha512
+    Girder computes for each file. Input already in the cache is linked into
+    the job directory rather than transferred again, input that isn't is
+    transferred to the job directory as usual and then added to the cache.
+    Files without a sha512 are always transferred. Cached content is made
+    read-only so a job can't modify it in place. The least recently used
+    content is evicted once the cache grows beyond its size budget, content
+    still hard linked into a job directory is kept.
+
+    Note that with symbolic links there is no way to tell if content is still
+    used by a job, so nothing is evicted and the cache has to be cleaned up
+    by other means.
+
+    :param path: The cache directory on the cluster, relative paths are
+                 relative to the user's home directory.
+    :param max_size: The size budget in bytes.
+    :param link: HARD_LINK or SYMBOLIC_LINK.
+    """
+
+    def __init__(self, path, max_size=DEFAULT_MAX_SIZE, link=HARD_LINK):
+        if link not in (HARD_LINK, SYMBOLIC_LINK):
+            raise ValueError('Unsupported link type: %s' % link)
+
+        self._path = path
+        self.max_size = max_size
+        self._link = link
+        self._lock = threading.Lock()
+        # sha512 => lock, so content is only transferred once per run
+        self._content_locks = {}
+        # The content used by this run, this is never evicted
+        self._used = set()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.evicted = 0
+
+    @staticmethod
+    def from_cluster(cluster):
+        """
+        Returns the input cache for a cluster, or None if it doesn't have one.
+        """
+        config = input_cache_config(cluster)
+        if config is None:
+            return None
+
+        return InputCache(config['path'], max_size=config['maxSize'],
+                          link=config['link'])
+
+    @property
+    def _blobs_path(self):
+        return os.path.join(self._path, BLOBS_DIR)
+
+    def _blob_path(self, sha512):
+        return os.path.join(self._blobs_path, sha512)
+
+    def setup(self, connection):
+        """
+        Create the cache directory, must be called before staging any files.
+        """
+        # Symbolic links need an absolute target
+        if self._path[0] != '/':
+            home = connection.execute('pwd')[0].strip()
+            self._path = os.path.abspath(os.path.join(home, self._path))
+
+        connection.makedirs(self._blobs_path)
+
+    def _execute(self, connection, command):
+        """
+        Run a command, returns False if it fails.
+        """
+        try:
+            connection.execute(command, ignore_exit_status=True,
+                               source_profile=False)
+        except Exception:
+            return False
+
+        return True
+
+    def _link_to(self, connection, sha512, dest):
+        blob = shlex_quote(self._blob_path(sha512))
+        dest = shlex_quote(dest)
+        # Touching the content marks it as recently used
+        if self._link == HARD_LINK:
+            command = 'ln -f %s %s && touch -c %s' % (blob, dest, blob)
+        else:
+            command = 'test -f %s && ln -sf %s %s && touch -c %s' % (
+                blob, blob, dest, blob)
+
+        return self._execute(connection, command)
+
+    def _add(self, connection, sha512, path):
+        blob = self._blob_path(sha512)
+        if self._link == HARD_LINK:
+            # Link under a temporary name first, so the content only appears
+            # in the cache once complete.
+            tmp = '%s.%s' % (blob, uuid.uuid4().hex)
+            command = 'ln -f %s %s && chmod a-w %s && mv -f %s %s' % (
+                shlex_quote(path), shlex_quote(tmp), shlex_quote(tmp),
+                shlex_quote(tmp), shlex_quote(blob))
+        else:
+            command = 'mv -f %s %s && chmod a-w %s && ln -s %s %s' % (
+                shlex_quote(path), shlex_quote(blob), shlex_quote(blob),
+                shlex_quote(blob), shlex_quote(path))
+
+        return self._execute(connection, command)
+
+    def stage(self, connection, file, dest, transfer):
+        """
+        Stage a Girder file at dest on the cluster, from the cache if
+        possible.
+
+        :param connection: The connection to the cluster to use.
+        :param file: The Girder file object.
+        :param dest: The path to stage the file to.
+        :param transfer: Called to transfer the file to dest on a miss.
+        :returns: True if the file was staged from the cache.
+        """
+        sha512 = file.get('sha512')
+        if not sha512:
+            transfer()
+            return False
+
+        with self._lock:
+            self._used.add(sha512)
+            content_lock = self._content_locks.setdefault(sha512,
+                                                          threading.Lock())
+
+        with content_lock:
+            hit = self._link_to(connection, sha512, dest)
+            if not hit:
+                transfer()
+                self._add(connection, sha512, dest)
+
+        with self._lock:
+            if hit:
+                self.hits += 1
+                self.bytes_saved += file.get('size', 0)
+            else:
+                self.misses += 1
+
+        return hit
+
+    def _list_blobs(self, connection):
+        """
+        Returns the name, size, modification time and number of links of
+        each blob.
+        """
+        command = "find %s -maxdepth 1 -type f -printf '%%f %%s %%T@ %%n\\n'" \
+            % shlex_quote(self._blobs_path)
+        blobs = []
+        for line in connection.execute(command, source_profile=False):
+            fields = line.split()
+            # Skip any diagnostics
+            if len(fields) != 4:
+                continue
+
+            (name, size, date, links) = fields
+            blobs.append({
+                'name': name,
+                'size': int(size),
+                'date': float(date),
+                'links': int(links)
+            })
+
+        return blobs
+
+    def evict(self, connection):
+        """
+        Remove the least recently used content until the cache is within its
+        size budget. Content used by this run or still hard linked into a job
+        directory is kept, with symbolic links nothing is evicted.
+
+        :returns: The number of files evicted.
+        """
+        if self._link == SYMBOLIC_LINK:
+            return 0
+
+        blobs = self._list_blobs(connection)
+        size = sum([b['size'] for b in blobs])
+
+        evicted = 0
+        for blob in sorted(blobs, key=lambda b: b['date']):
+            if size <= self.max_size:
+                break
+
+            if blob['name'] in self._used or blob['links'] > 1:
+                continue
+
+            connection.remove(os.path.join(self._blobs_path, blob['name']))
+            size -= blob['size']
+            evicted += 1
+
+        with self._lock:
+            self.evicted += evicted
+
+        return evicted
+
+    def stats(self):
+        """
+        Returns the hit and miss statistics of this run.
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'bytesSaved': self.bytes_saved,
+            'evicted': self.evicted
+        }
@@ -22,12 +22,21 @@ import stat
 import json
 import re
 import six
-
-from girder_client import GirderClient
+import tarfile
+import threading
 
 import cumulus
+from cumulus.common import api
+from cumulus.common.jsonpath import get_property
+from cumulus.common.workers import WorkerPool
 from cumulus.transport import get_connection
 from cumulus.transport.files import get_assetstore_url_base, get_assetstore_id
+from cumulus.transport.files import use_tar, tar_compress
+
+# The number of batches imported, or files uploaded, concurrently
+DEFAULT_MAX_WORKERS = 4
+# The number of files created by each request to the bulk import endpoint
+DEFAULT_BATCH_SIZE = 500
 
 
 def _include(path, includes, excludes):
@@ -123,77 +132,155 @@ def _ensure_path(girder_client, girder_folders, parent, path):
     return parent_id
 
 
-def _import_path(cluster_connection, girder_client, parent, root_path,
-                 assetstore_url, assetstore_id, upload=False,
-                 include=None, exclude=None, path='.', girder_folders=None):
+class _PathImporter(object):
     """
-    :params cluster_connection: The cluster connection to access the cluster.
-    :params girder_client: The Girder client to use to access Girder.
-    :params parent: The target folder to import the path into.
-    :params root_path: The path on the cluster being imported.
-    :params assetstore_url: The url for the assetstore to use for the import.
-    :params assetstore_id: The id of the asseststore to import into.
-    :params upload: Indicate if the import should upload the file data or just
-                    the metadata, the default is False.
-    :params include: List of include regexs
-    :params exclude: List of exclude regexs,
-    :params path: The current subdirectory of root_path that is being imported.
+    Imports a path on a cluster into Girder. The directory tree is listed in a
+    single walk of the cluster connection. When only the metadata is being
+    imported, files are created in Girder in batches, along with their folders
+    and items, using the assetstore's bulk endpoint. Otherwise each file is
+    uploaded concurrently, each thread using its own channel from the cluster
+    connection, or for trees of many small files read from a single tar stream
+    of the tree, see use_tar(...).
     """
-    if girder_folders is None:
-        girder_folders = {}
-
-    if root_path[0] != '/':
-        # If we don't have a full path, assume the path is relative to the users
-        # home directory.
-        home = cluster_connection.execute('pwd')[0]
-        root_path = os.path.abspath(os.path.join(home, root_path))
-
-    cluster_path = os.path.normpath(os.path.join(root_path, path))
-    for p in cluster_connection.list(cluster_path):
-        name = p['name']
-
-        full_path = os.path.normpath(os.path.join(path, name))
-        if name in ['.', '..']:
-            continue
-
-        if stat.S_ISDIR(p['mode']):
-            _import_path(cluster_connection, girder_client, parent,
-                         root_path, assetstore_url, assetstore_id,
-                         upload=upload, path=full_path,
-                         include=include,
-                         exclude=exclude, girder_folders=girder_folders)
-        else:
-
-            # Should we include this path?
-            if not _include(full_path, include, exclude):
-                continue
 
-            # Create any folders we might need
+    def __init__(self, cluster_connection, girder_client, parent, root_path,
+                 assetstore_url, assetstore_id, upload=False, include=None,
+                 exclude=None, max_workers=None, batch_size=None):
+        self._cluster_connection = cluster_connection
+        self._girder_client = girder_client
+        self._parent = parent
+        self._root_path = root_path
+        self._assetstore_url = assetstore_url
+        self._assetstore_id = assetstore_id
+        self._upload = upload
+        self._include = include
+        self._exclude = exclude
+        self._max_workers = max_workers or get_property(
+            'download.maxWorkers', cumulus.config,
+            default=DEFAULT_MAX_WORKERS)
+        self._batch_size = batch_size or get_property(
+            'download.batchSize', cumulus.config, default=DEFAULT_BATCH_SIZE)
+        self._lock = threading.Lock()
+        self._batch = []
+        # Map of paths to existing Girder folder ids, used when uploading
+        self._girder_folders = {}
+
+    def _add_to_batch(self, pool, path, name, size):
+        cluster_path = os.path.normpath(
+            os.path.join(self._root_path, path, name))
+        file = {
+            'folder': path,
+            'name': name,
+            'size': size,
+            'path': cluster_path
+        }
+
+        with self._lock:
+            self._batch.append(file)
+            if len(self._batch) < self._batch_size:
+                return
+
+            batch = self._batch
+            self._batch = []
+
+        pool.submit(self._import_batch, (batch,))
+
+    def _import_batch(self, channel, batch):
+        url = '%s/%s/files/bulk' % (self._assetstore_url, self._assetstore_id)
+        body = {
+            'parentId': self._parent,
+            'files': batch
+        }
+        self._girder_client.post(url, data=json.dumps(body))
+
+    def _upload_stream(self, path, name, size, stream):
+        # Create the folders one thread at a time, so they are only created
+        # once.
+        with self._lock:
             if path == '.':
-                folder_id = parent
+                folder_id = self._parent
             else:
-                folder_id = _ensure_path(girder_client, girder_folders, parent,
+                folder_id = _ensure_path(self._girder_client,
+                                         self._girder_folders, self._parent,
                                          path)
 
-            size = p['size']
-            item = girder_client.createItem(folder_id, name, '')
-
-            if not upload:
-
-                url = '%s/%s/files' % (assetstore_url, assetstore_id)
-                body = {
-                    'name': name,
-                    'itemId': item['_id'],
-                    'size': size,
-                    'path': os.path.join(root_path, full_path)
-                }
-                girder_client.post(url, data=json.dumps(body))
+        item = self._girder_client.createItem(folder_id, name, '')
+        self._girder_client.uploadFile(item['_id'], stream, name, size,
+                                       parentType='item')
+
+    def _upload_file(self, channel, path, name, size):
+        cluster_path = os.path.normpath(
+            os.path.join(self._root_path, path, name))
+        with channel.get(cluster_path) as stream:
+            self._upload_stream(path, name, size, stream)
+
+    def _upload_tar(self, files):
+        """
+        Upload files, a list of (path, name, size), reading them from a tar
+        stream of the root path.
+        """
+        wanted = set([os.path.join(path, name) for (path, name, _) in files])
+        compress = tar_compress()
+        with self._cluster_connection.tar_reader(self._root_path,
+                                                 compress=compress) as stream:
+            tar = tarfile.open(fileobj=stream,
+                               mode='r|gz' if compress else 'r|')
+            for member in tar:
+                if not member.isfile():
+                    continue
+
+                (path, name) = os.path.split(os.path.normpath(member.name))
+                path = path or '.'
+                # Excluded files are still in the stream
+                if os.path.join(path, name) not in wanted:
+                    continue
+
+                self._upload_stream(path, name, member.size,
+                                    tar.extractfile(member))
+
+    def run(self):
+        if self._root_path[0] != '/':
+            # If we don't have a full path, assume the path is relative to the
+            # users home directory.
+            home = self._cluster_connection.execute('pwd')[0].strip()
+            self._root_path = os.path.abspath(
+                os.path.join(home, self._root_path))
+
+        # (path, name, size) of the files to upload
+        files = []
+        # The size of the whole tree, a tar stream includes excluded files
+        tree_size = 0
+        with WorkerPool(self._max_workers,
+                        self._cluster_connection.transfer_channel) as pool:
+            # The tree is listed in a single walk on this connection while
+            # the files are imported on the pool.
+            for p in self._cluster_connection.walk(self._root_path):
+                if stat.S_ISDIR(p['mode']):
+                    continue
+
+                tree_size += int(p['size'])
+                full_path = os.path.normpath(p['path'])
+                if not _include(full_path, self._include, self._exclude):
+                    continue
+
+                (path, name) = os.path.split(full_path)
+                path = path or '.'
+                if self._upload:
+                    files.append((path, name, p['size']))
+                else:
+                    self._add_to_batch(pool, path, name, p['size'])
+
+            if files and use_tar(self._cluster_connection, len(files),
+                                 tree_size):
+                self._upload_tar(files)
             else:
-                cluster_path = os.path.normpath(
-                    os.path.join(root_path, full_path))
-                with cluster_connection.get(cluster_path) as stream:
-                    girder_client.uploadFile(item['_id'], stream, name, size,
-                                             parentType='item')
+                for (path, name, size) in files:
+                    pool.submit(self._upload_file, (path, name, size),
+                                priority=-size)
+
+        if self._batch:
+            self._import_batch(None, self._batch)
+            self._batch = []
 
 
 def download_path(cluster_connection, girder_token, parent, path,
@@ -213,12 +300,12 @@ def download_path(cluster_connection, girder_token, parent, path,
     :params include: List of include regexs
     :params exclude: List of exclude regexs,
     """
-    girder_client = GirderClient(apiUrl=cumulus.config.girder.baseUrl)
-    girder_client.token = girder_token
+    girder_client = api.girder_client(girder_token)
 
-    _import_path(cluster_connection, girder_client, parent, path,
-                 assetstore_url, assetstore_id, upload=upload, include=include,
-                 exclude=exclude)
+    importer = _PathImporter(cluster_connection, girder_client, parent, path,
+                             assetstore_url, assetstore_id, upload=upload,
+                             include=include, exclude=exclude)
+    importer.run()
 
 
 def download_path_from_cluster(cluster, girder_token, parent, path,
@@ -15,16 +15,35 @@
 #  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
-###############################################################################
 
+import io
 import os
+import sys
+import tarfile
+import threading
+import time
 
-from girder_client import GirderClient
-import requests
+import six
+from six.moves import queue
 
 import cumulus
+from cumulus.common import api
 from cumulus.common import check_status
+from cumulus.common.jsonpath import get_property
+from cumulus.common.workers import WorkerPool
 from cumulus.transport import get_connection
+from cumulus.transport.files import use_tar, tar_compress, batch_commands
+
+# The number of files transferred, or folders listed, concurrently
+DEFAULT_MAX_WORKERS = 4
+# The page size used when listing the files in an item
+FILE_PAGE_SIZE = 50
+# Files sent as a tar stream are downloaded ahead of the stream by the worker
+# threads, up to this many files per worker. Files larger than
+# MAX_PREFETCH_SIZE are downloaded by the tar writer instead of being held in
+# memory.
+PREFETCH_PER_WORKER = 8
+MAX_PREFETCH_SIZE = 4 * 1024 * 1024
 
 
 def _upload_file(cluster_connection, girder_client, file, path):
@@ -37,55 +56,277 @@ def _upload_file(cluster_connection, girder_client, file, path):
     :param path: The path on the cluster to upload to.
     """
 
-    r = requests.get(
+    r = _download(girder_client, file)
+    cluster_connection.put(r.raw, os.path.join(path, file['name']))
+
+
+def _download(girder_client, file):
+    """
+    Returns a streamed response for the contents of a Girder file.
+    """
+    r = api.get(
         '%s/file/%s/download' % (girder_client.urlBase, file['_id']),
         headers={'Girder-Token': girder_client.token}, stream=True)
     check_status(r)
-    cluster_connection.put(r.raw, os.path.join(path, file['name']))
 
+    return r
 
-def _upload_item(cluster_connection, girder_client, item, path):
-    offset = 0
-    params = {
-        'limit': 50,
-        'offset': offset
-    }
 
+def _prefetch(girder_client, file, slot):
+    """
+    Download a file into memory, putting (data, exc_info) in slot. data is
+    None if the file is too large to prefetch.
+    """
+    try:
+        data = None
+        if file.get('size', 0) <= MAX_PREFETCH_SIZE:
+            r = _download(girder_client, file)
+            try:
+                data = r.raw.read()
+            finally:
+                r.close()
+        slot.put((data, None))
+    except Exception:
+        slot.put((None, sys.exc_info()))
+
+
+def _item_files(girder_client, item):
+    offset = 0
     while True:
+        params = {
+            'limit': FILE_PAGE_SIZE,
+            'offset': offset
+        }
         files = girder_client.get('item/%s/files' % item['_id'],
                                   parameters=params)
 
         for file in files:
-            _upload_file(cluster_connection, girder_client, file, path)
+            yield file
 
         offset += len(files)
-        if len(files) < 50:
+        if len(files) < FILE_PAGE_SIZE:
             break
 
 
-def _upload_items(cluster_connection, girder_client, folder_id, path):
-    for item in girder_client.listItem(folder_id):
-        _upload_item(cluster_connection, girder_client, item, path)
+def _max_workers():
+    return get_property('upload.maxWorkers', cumulus.config,
+                        default=DEFAULT_MAX_WORKERS)
+
+
+class _PathUploader(object):
+    """
+    Stages a Girder folder on a cluster. The folder tree is listed
+    concurrently, then the files are transferred concurrently, largest first
+    so a few big files don't end up holding up the end of the transfer. Each
+    transfer thread uses its own channel from the cluster connection. Trees of
+    many small files are instead sent as a single tar stream, which is
+    extracted on the cluster, see use_tar(...).
+    """
+
+    def __init__(self, cluster_connection, girder_client, progress=None,
+                 max_workers=None, cache=None):
+        self._cluster_connection = cluster_connection
+        self._girder_client = girder_client
+        self._progress = progress
+        self._cache = cache
+        self._max_workers = max_workers or _max_workers()
+        self._lock = threading.Lock()
+        # (file, path) for each file to upload
+        self._files = []
+        # The folders to create, parents before their children
+        self._folders = []
+        self._files_done = 0
+        self._bytes_done = 0
+        self._bytes_total = 0
+        self._timings = []
+
+    def _list_folder(self, pool, folder_id, path):
+        files = []
+        for item in self._girder_client.listItem(folder_id):
+            for file in _item_files(self._girder_client, item):
+                files.append((file, path))
+
+        folders = []
+        for folder in self._girder_client.listFolder(folder_id):
+            folders.append((folder['_id'], os.path.join(path, folder['name'])))
+
+        with self._lock:
+            self._files += files
+            self._folders += [folder_path for (_, folder_path) in folders]
+
+        for (sub_folder_id, folder_path) in folders:
+            pool.submit(self._list_folder, (pool, sub_folder_id, folder_path))
+
+    def _file_done(self, file):
+        with self._lock:
+            self._files_done += 1
+            self._bytes_done += file.get('size', 0)
+
+            if self._progress:
+                self._progress(self._files_done, len(self._files),
+                               self._bytes_done, self._bytes_total)
+
+    def _add_to_tar(self, tar, info, file, data):
+        if data is not None:
+            tar.addfile(info, io.BytesIO(data))
+            return
+
+        r = _download(self._girder_client, file)
+        try:
+            tar.addfile(info, r.raw)
+        finally:
+            r.close()
 
+    def _upload_tar(self, files, path):
+        """
+        Send files, below path, as a tar stream over a single channel. The
+        files are downloaded ahead of the stream using the worker pool, the
+        stream itself is written by this thread.
+        """
+        start = time.time()
+        compress = tar_compress()
+        window = self._max_workers * PREFETCH_PER_WORKER
+        slots = [queue.Queue(1) for _ in files]
 
-def _upload_path(cluster_connection, girder_client, folder_id, path):
-    # First process items
-    _upload_items(cluster_connection, girder_client, folder_id, path)
+        with WorkerPool(self._max_workers) as pool:
+            def prefetch(i):
+                if i < len(files):
+                    pool.submit(_prefetch,
+                                (self._girder_client, files[i][0], slots[i]))
 
-    # Now folders
-    for folder in girder_client.listFolder(folder_id):
-        folder_path = os.path.join(path, folder['name'])
-        cluster_connection.mkdir(folder_path)
-        _upload_path(cluster_connection, girder_client, folder['_id'],
-                     folder_path)
+            for i in range(window):
+                prefetch(i)
 
+            with self._cluster_connection.tar_writer(
+                    path, compress=compress) as stream:
+                tar = tarfile.open(fileobj=stream,
+                                   mode='w|gz' if compress else 'w|')
+                for (i, (file, file_path)) in enumerate(files):
+                    (data, error) = slots[i].get()
+                    prefetch(i + window)
+                    if error is not None:
+                        six.reraise(*error)
 
-def upload_path(cluster_connection, girder_token, folder_id, path):
-    girder_client = GirderClient(apiUrl=cumulus.config.girder.baseUrl)
-    girder_client.token = girder_token
+                    info = tarfile.TarInfo(os.path.relpath(
+                        os.path.join(file_path, file['name']), path))
+                    info.size = file.get('size', 0)
+                    info.mtime = start
+                    info.mode = 0o644
+                    self._add_to_tar(tar, info, file, data)
+
+                    self._file_done(file)
+
+                # Only finish the archive if everything was added, so a
+                # failure doesn't look like a complete transfer.
+                tar.close()
+
+        self._timings.append({
+            'path': path,
+            'size': sum([f.get('size', 0) for (f, _) in files]),
+            'time': int(round((time.time() - start) * 1000)),
+            'files': len(files),
+            'archive': True
+        })
+
+    def _upload(self, channel, file, path):
+        start = time.time()
+
+        def transfer():
+            _upload_file(channel, self._girder_client, file, path)
+
+        cached = False
+        if self._cache is None:
+            transfer()
+        else:
+            cached = self._cache.stage(channel, file,
+                                       os.path.join(path, file['name']),
+                                       transfer)
+        elapsed = time.time() - start
+
+        with self._lock:
+            self._timings.append({
+                'path': os.path.join(path, file['name']),
+                'size': file.get('size', 0),
+                'time': int(round(elapsed * 1000)),
+                'cached': cached
+            })
+
+        self._file_done(file)
+
+    def run(self, folder_id, path):
+        """
+        Upload the contents of a folder to path on the cluster.
+
+        :returns: The timings for the upload, a dict containing the 'total'
+                  time and 'files', a list of the path, size and time of each
+                  file transferred. Times are in milliseconds. Files sent as
+                  a tar stream have a single entry for the stream, marked as
+                  an 'archive'.
+        """
+        start = time.time()
+
+        with WorkerPool(self._max_workers) as pool:
+            pool.submit(self._list_folder, (pool, folder_id, path))
+
+        for mkdir in batch_commands('mkdir -p', self._folders):
+            self._cluster_connection.execute(mkdir)
+
+        self._bytes_total = sum([f.get('size', 0) for (f, _) in self._files])
+
+        # Files that can come from the cache are always staged individually
+        files = []
+        archived = self._files
+        if self._cache is not None:
+            files = [(f, p) for (f, p) in self._files if f.get('sha512')]
+            archived = [(f, p) for (f, p) in self._files
+                        if not f.get('sha512')]
+
+        archived_size = sum([f.get('size', 0) for (f, _) in archived])
+        if use_tar(self._cluster_connection, len(archived), archived_size):
+            self._upload_tar(archived, path)
+        else:
+            files = self._files
+
+        # Queue everything before the threads start, so the largest files
+        # really are transferred first.
+        pool = WorkerPool(self._max_workers,
+                          self._cluster_connection.transfer_channel)
+        for (file, file_path) in files:
+            pool.submit(self._upload, (file, file_path),
+                        priority=-file.get('size', 0))
+
+        with pool:
+            pass
+
+        return {
+            'total': int(round((time.time() - start) * 1000)),
+            'files': self._timings
+        }
+
+
+def upload_path(cluster_connection, girder_token, folder_id, path,
+                progress=None, cache=None):
+    """
+    Upload the contents of a Girder folder to a cluster.
+
+    :param cluster_connection: The connection to access the cluster by.
+    :param girder_token: The Girder token for Girder access.
+    :param folder_id: The id of the folder to upload.
+    :param path: The path on the cluster to upload to.
+    :param progress: Optional callable that is called after each file is
+                     transferred with the number of files transferred, the
+                     total number of files and the same for bytes.
+    :param cache: Optional InputCache to stage the files through, it must
+                  already be set up.
+    :returns: The timings for the upload, see _PathUploader.run(...)
+    """
+    girder_client = api.girder_client(girder_token)
     cluster_connection.makedirs(path)
 
-    _upload_path(cluster_connection, girder_client, folder_id, path)
+    uploader = _PathUploader(cluster_connection, girder_client,
+                             progress=progress, cache=cache)
+
+    return uploader.run(folder_id, path)
 
 
 def upload_file(cluster, girder_token, file, path):
@@ -97,8 +338,7 @@ def upload_file(cluster, girder_token, file, path):
     :param file: The Girder file object.
     :param path: The path on the cluster to upload to.
     """
-    girder_client = GirderClient(apiUrl=cumulus.config.girder.baseUrl)
-    girder_client.token = girder_token
+    girder_client = api.girder_client(girder_token)
     with get_connection(girder_token, cluster) as conn:
         conn.makedirs(os.path.dirname(path))
         _upload_file(conn, girder_client, file, path)
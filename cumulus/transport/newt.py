@@ -22,15 +22,18 @@ from contextlib import contextmanager
 import stat
 import re
 import six
+from six.moves import shlex_quote
 
 import requests
 from paramiko import SFTPAttributes
 
 from jsonpath_rw import parse
 
-from .abstract import AbstractConnection
+from .abstract import AbstractConnection, FIND_WALK_FORMAT, \
+    parse_find_entry
 import cumulus
 from cumulus.common import check_status
+from cumulus.common import api
 
 NEWT_BASE_URL = 'https://newt.nersc.gov/newt'
 
@@ -45,6 +48,7 @@ commands = {
     'rm': '/bin/rm',
     'pwd': '/bin/pwd',
     'tail': '/usr/bin/tail',
+    'find': '/usr/bin/find',
     # This may be very machine dependant!
     'squeue': '/opt/slurm/default/bin/squeue'
 }
@@ -90,7 +94,7 @@ class NewtClusterConnection(AbstractConnection):
         if not self._newt_session_id:
             headers = {'Girder-Token':  self._girder_token}
             url = '%s/newt/sessionId' % cumulus.config.girder.baseUrl
-            r = requests.get(url, headers=headers)
+            r = api.get(url, headers=headers)
             check_status(r)
 
             session_id = parse('sessionId').find(r.json())
@@ -261,6 +265,32 @@ class NewtClusterConnection(AbstractConnection):
             path['mode'] = self._perms_to_mode(perms)
             yield path
 
+    def walk(self, root):
+        """
+        Lists the whole tree with a single find command rather than a request
+        per directory. NEWT returns the command output as text so entries are
+        newline terminated, if find fails we fall back to listing each
+        directory.
+        """
+        if root[0] != '/':
+            root = os.path.abspath(os.path.join(self._home_dir(), root))
+
+        command = 'find %s -mindepth 1 -printf %s' % (
+            shlex_quote(os.path.join(root, '')),
+            shlex_quote(FIND_WALK_FORMAT + '\\n'))
+        try:
+            output = self.execute(command)
+        except NewtException:
+            output = None
+
+        if output is None:
+            for entry in super(NewtClusterConnection, self).walk(root):
+                yield entry
+        else:
+            for entry in output:
+                if entry:
+                    yield parse_find_entry(entry)
+
     @property
     def session_id(self):
         """
@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import os
+import threading
+import time
+
+import cumulus
+from cumulus.common.jsonpath import get_property
+
+# The maximum number of open connections ( idle or in use ) to a single host
+DEFAULT_MAX_CONNECTIONS_PER_HOST = 4
+# Idle connections are closed after this many seconds
+DEFAULT_IDLE_TIMEOUT = 300
+# How long to wait for a connection slot before giving up
+DEFAULT_ACQUIRE_TIMEOUT = 120
+# Idle connections older than this are probed before they are reused
+HEALTH_CHECK_INTERVAL = 30
+
+
+class SshConnectionPoolException(Exception):
+    pass
+
+
+class PooledConnection(object):
+    """
+    An SSH client owned by the pool along with its bookkeeping. The object
+    also provides somewhere to hang state that should live as long as the
+    underlying connection.
+    """
+    def __init__(self, key, client):
+        self.key = key
+        self.client = client
+        self.last_used = time.time()
+        # SFTP session opened over this connection, see SshClusterConnection
+        self.sftp = None
+
+    @property
+    def host(self):
+        return self.key[:2]
+
+    def close(self):
+        try:
+            if self.sftp is not None:
+                self.sftp.close()
+            self.client.close()
+        except Exception:
+            pass
+
+
+class SshConnectionPool(object):
+    """
+    A worker process wide pool of authenticated SSH clients. Clients are keyed
+    by (hostname, port, username, key path, key mtime) so a regenerated key
+    results in a new connection. A client is only ever handed to one user at a
+    time, the number of connections to a given (hostname, port) is capped.
+    """
+
+    def __init__(self,
+                 max_connections_per_host=DEFAULT_MAX_CONNECTIONS_PER_HOST,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 acquire_timeout=DEFAULT_ACQUIRE_TIMEOUT):
+        self.max_connections_per_host = max_connections_per_host
+        self.idle_timeout = idle_timeout
+        self.acquire_timeout = acquire_timeout
+        self._condition = threading.Condition()
+        self._reset()
+
+    @staticmethod
+    def from_config(section,
+                    max_connections_per_host=DEFAULT_MAX_CONNECTIONS_PER_HOST,
+                    idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                    acquire_timeout=DEFAULT_ACQUIRE_TIMEOUT):
+        """
+        Returns a pool configured using a section of the cumulus
+        configuration, the arguments give the defaults for any setting the
+        section doesn't have.
+
+        :param section: The configuration section, for example 'ssh.pool'.
+        """
+        def setting(name, default):
+            return get_property('%s.%s' % (section, name), cumulus.config,
+                                default=default)
+
+        return SshConnectionPool(
+            max_connections_per_host=setting('maxConnectionsPerHost',
+                                             max_connections_per_host),
+            idle_timeout=setting('idleTimeout', idle_timeout),
+            acquire_timeout=setting('acquireTimeout', acquire_timeout))
+
+    def _reset(self):
+        self._pid = os.getpid()
+        # key => [PooledConnection, ...] ordered by last use
+        self._idle = {}
+        # (hostname, port) => number of open connections
+        self._host_counts = {}
+
+    def _check_pid(self):
+        # Sockets must not be shared with the parent after a fork, so a child
+        # worker process starts with an empty pool.
+        if self._pid != os.getpid():
+            self._reset()
+
+    def _is_healthy(self, pooled):
+        transport = pooled.client.get_transport()
+        if transport is None or not transport.is_active():
+            return False
+
+        if time.time() - pooled.last_used > HEALTH_CHECK_INTERVAL:
+            try:
+                transport.send_ignore()
+            except Exception:
+                return False
+
+        return True
+
+    def _close(self, pooled):
+        count = self._host_counts.get(pooled.host, 0)
+        self._host_counts[pooled.host] = max(count - 1, 0)
+        pooled.close()
+        self._condition.notify_all()
+
+    def _evict_idle(self):
+        now = time.time()
+        for key in list(self._idle):
+            idle = self._idle[key]
+            for pooled in list(idle):
+                if now - pooled.last_used > self.idle_timeout:
+                    idle.remove(pooled)
+                    self._close(pooled)
+
+            if not idle:
+                del self._idle[key]
+
+    def _evict_lru_for_host(self, host):
+        """
+        Close the least recently used idle connection to a host, this is used
+        to make room for a connection with different credentials.
+        """
+        candidates = [(idle[0].last_used, key)
+                      for (key, idle) in self._idle.items()
+                      if idle and key[:2] == host]
+        if not candidates:
+            return False
+
+        (_, key) = min(candidates)
+        self._close(self._idle[key].pop(0))
+        if not self._idle[key]:
+            del self._idle[key]
+
+        return True
+
+    def acquire(self, key, connect):
+        """
+        Return a PooledConnection for the given key, reusing a healthy idle
+        connection if one exists, otherwise connect() is called to create a new
+        client.
+
+        :param key: The pool key, the first two elements must be the hostname
+                    and port.
+        :param connect: Callable returning a new connected SSHClient.
+        """
+        host = key[:2]
+        deadline = time.time() + self.acquire_timeout
+
+        with self._condition:
+            self._check_pid()
+            self._evict_idle()
+
+            while True:
+                idle = self._idle.get(key, [])
+                while idle:
+                    pooled = idle.pop()
+                    if self._is_healthy(pooled):
+                        return pooled
+                    self._close(pooled)
+
+                if self._host_counts.get(host, 0) \
+                        < self.max_connections_per_host or \
+                        self._evict_lru_for_host(host):
+                    self._host_counts[host] = self._host_counts.get(host, 0) + 1
+                    break
+
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise SshConnectionPoolException(
+                        'Timed out waiting for a connection to %s:%s' % host)
+
+                self._condition.wait(remaining)
+
+        # Do the handshake outside the lock
+        try:
+            client = connect()
+        except Exception:
+            with self._condition:
+                self._host_counts[host] = \
+                    max(self._host_counts.get(host, 0) - 1, 0)
+                self._condition.notify_all()
+            raise
+
+        return PooledConnection(key, client)
+
+    def release(self, pooled, discard=False):
+        """
+        Return a connection to the pool.
+
+        :param pooled: The PooledConnection returned by acquire(...)
+        :param discard: If True the connection is closed rather than pooled,
+                        this should be used when the connection is suspect.
+        """
+        with self._condition:
+            # Connection acquired by our parent process
+            if self._pid != os.getpid():
+                return
+
+            transport = pooled.client.get_transport()
+            if discard or transport is None or not transport.is_active():
+                self._close(pooled)
+            else:
+                pooled.last_used = time.time()
+                self._idle.setdefault(pooled.key, []).append(pooled)
+                self._condition.notify_all()
+
+    def close_all(self):
+        """
+        Close all idle connections.
+        """
+        self.close_idle()
+
+    def close_idle(self, match=None):
+        """
+        Close the idle connections whose key match(key) returns True for, or
+        all idle connections if match is None. This can be used when the
+        credentials used for some connections are no longer valid.
+        """
+        with self._condition:
+            self._check_pid()
+            for key in list(self._idle):
+                if match is None or match(key):
+                    for pooled in self._idle.pop(key):
+                        self._close(pooled)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_ssh_connection_pool():
+    """
+    Returns the SSH connection pool for this process, the pool is configured
+    using the ssh.pool section of the cumulus configuration.
+    """
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = SshConnectionPool.from_config('ssh.pool')
+
+    return _pool
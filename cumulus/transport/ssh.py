@@ -19,16 +19,24 @@
 
 import os
 from contextlib import contextmanager
+import socket
 import stat
 from jsonpath_rw import parse
+from six.moves import shlex_quote
 
-from .abstract import AbstractConnection
+from .abstract import AbstractConnection, READ_CHUNK_SIZE, \
+    FIND_WALK_FORMAT, parse_find_entry, walk_listing
+from .pool import get_ssh_connection_pool
 import cumulus
 
 from paramiko.client import SSHClient
 from paramiko import RSAKey
+from paramiko.ssh_exception import SSHException
 import paramiko
 
+# Seconds between keepalive packets on pooled connections
+KEEPALIVE_INTERVAL = 30
+
 
 class SshCommandException(Exception):
     def __init__(self, command, exit_code, output):
@@ -39,18 +47,90 @@ class SshCommandException(Exception):
         self.output = output
 
 
+class _SftpChannel(object):
+    """
+    Holds the SFTP session of a transfer channel, stands in for the
+    PooledConnection a connection normally keeps its session on.
+    """
+    def __init__(self):
+        self.sftp = None
+
+
+def sftp_list(sftp, remote_path):
+    """
+    List a directory using an SFTP session, yields entries of the form
+    returned by AbstractConnection.list(...).
+    """
+    for path in sftp.listdir_iter(remote_path):
+        yield {
+            'name': path.filename,
+            'user': path.st_uid,
+            'group': path.st_gid,
+            'mode': path.st_mode,
+            # For now just pass mtime through
+            'date': path.st_mtime,
+            'size': path.st_size
+        }
+
+
+def find_walk(client, root, list_directory):
+    """
+    Lists the whole tree below root with a single remote find, yielding
+    entries of the form yielded by AbstractConnection.walk(...). The entries
+    are NUL terminated so any file name can be parsed and are yielded as they
+    arrive. If find fails before producing any output, for example because
+    it doesn't support -printf, we fall back to listing each directory using
+    list_directory.
+
+    :param client: The connected SSHClient to run find with.
+    :param root: The directory to list.
+    :param list_directory: Called with the path of a directory, returns the
+        entries in it in the form returned by AbstractConnection.list(...).
+    """
+    # The trailing / makes find follow root if it is a symlink
+    command = 'find %s -mindepth 1 -printf %s 2>/dev/null' % (
+        shlex_quote(os.path.join(root, '')),
+        shlex_quote(FIND_WALK_FORMAT + '\\0'))
+
+    found = False
+    chan = client.get_transport().open_session()
+    try:
+        chan.exec_command(command)
+        remainder = b''
+        while True:
+            data = chan.recv(READ_CHUNK_SIZE)
+            if not data:
+                break
+
+            entries = (remainder + data).split(b'\0')
+            remainder = entries.pop()
+            for entry in entries:
+                found = True
+                yield parse_find_entry(entry.decode('utf8'))
+
+        exit_code = chan.recv_exit_status()
+    finally:
+        chan.close()
+
+    if not found and exit_code != 0:
+        for entry in walk_listing(list_directory, root):
+            yield entry
+
+
 class SshClusterConnection(AbstractConnection):
+
+    supports_tar = True
+
     def __init__(self, girder_token, cluster):
         self._girder_token = girder_token
         self._cluster = cluster
+        self._pooled = None
+        self._client = None
 
     def _load_rsa_key(self, path, passphrase):
         return RSAKey.from_private_key_file(path, password=passphrase)
 
-    def __enter__(self):
-        self._client = SSHClient()
-        self._client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
+    def _connection_params(self):
         username = parse('config.ssh.user').find(self._cluster)[0].value
         hostname = parse('config.host').find(self._cluster)[0].value
 
@@ -71,15 +151,45 @@ class SshClusterConnection(AbstractConnection):
         key_path = os.path.join(cumulus.config.ssh.keyStore,
                                 key_name)
 
-        private_key = self._load_rsa_key(key_path, passphrase)
+        return (hostname, port, username, key_path, passphrase)
 
-        self._client.connect(hostname=hostname, port=port,
-                             username=username, pkey=private_key)
+    def __enter__(self):
+        (hostname, port, username, key_path, passphrase) \
+            = self._connection_params()
+
+        # Include the key's mtime so a regenerated key gets a new connection
+        try:
+            key_mtime = os.path.getmtime(key_path)
+        except OSError:
+            key_mtime = None
+
+        def connect():
+            client = SSHClient()
+            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            private_key = self._load_rsa_key(key_path, passphrase)
+            client.connect(hostname=hostname, port=port,
+                           username=username, pkey=private_key)
+
+            transport = client.get_transport()
+            if transport:
+                transport.set_keepalive(KEEPALIVE_INTERVAL)
+
+            return client
+
+        key = (hostname, port, username, key_path, key_mtime)
+        self._pooled = get_ssh_connection_pool().acquire(key, connect)
+        self._client = self._pooled.client
 
         return self
 
     def __exit__(self, type, value, traceback):
-        self._client.close()
+        # Don't hand a connection that failed at the transport level to the
+        # next task.
+        discard = type is not None and \
+            issubclass(type, (EOFError, socket.error, SSHException))
+        get_ssh_connection_pool().release(self._pooled, discard=discard)
+        self._pooled = None
+        self._client = None
 
     def execute(self, command, ignore_exit_status=False, source_profile=True):
         if source_profile:
@@ -97,31 +207,119 @@ class SshClusterConnection(AbstractConnection):
 
         return output
 
+    def _close_sftp(self):
+        sftp = self._pooled.sftp
+        self._pooled.sftp = None
+        if sftp is not None:
+            try:
+                sftp.close()
+            except Exception:
+                pass
+
     @contextmanager
-    def get(self, remote_path):
-        sftp = None
-        file = None
+    def _sftp(self):
+        """
+        Yields the SFTP session for this connection. The session is opened
+        lazily and kept with the pooled connection, so it is reused by all file
+        operations until a channel error occurs, at which point it is closed
+        and the next operation will open a new one.
+        """
+        if self._pooled.sftp is None:
+            self._pooled.sftp = self._client.open_sftp()
+
+        try:
+            yield self._pooled.sftp
+        except (EOFError, socket.error, SSHException):
+            self._close_sftp()
+            raise
+
+    @contextmanager
+    def transfer_channel(self):
+        """
+        Yields a connection sharing this connection's SSH transport but with
+        its own SFTP session, so transfers can run concurrently on several
+        channels. The session is closed on exit.
+        """
+        channel = SshClusterConnection(self._girder_token, self._cluster)
+        channel._client = self._client
+        channel._pooled = _SftpChannel()
         try:
-            sftp = self._client.get_transport().open_sftp_client()
-            file = sftp.open(remote_path)
-            yield file
+            yield channel
         finally:
-            if file:
-                file.close()
-                sftp.close()
+            channel._close_sftp()
 
-    def isfile(self, remote_path):
+    @contextmanager
+    def _exec_channel(self, command):
+        """
+        Yields a channel running command, on a clean exit the channel's stdin
+        is closed and command is checked for success.
+        """
+        chan = self._client.get_transport().open_session()
+        try:
+            chan.exec_command(command)
+            yield chan
+            chan.shutdown_write()
+            exit_code = chan.recv_exit_status()
+            if exit_code != 0:
+                stderr = chan.makefile_stderr('r', -1)
+                raise SshCommandException(command, exit_code,
+                                          stderr.readlines())
+        finally:
+            chan.close()
 
-        with self._client.get_transport().open_sftp_client() as sftp:
+    @contextmanager
+    def tar_writer(self, remote_path, compress=False):
+        command = 'mkdir -p %s && tar -x%sf - -C %s' % (
+            shlex_quote(remote_path), 'z' if compress else '',
+            shlex_quote(remote_path))
+
+        with self._exec_channel(command) as chan:
+            stdin = chan.makefile('wb', -1)
+            yield stdin
+            stdin.flush()
+
+    @contextmanager
+    def tar_reader(self, remote_path, compress=False):
+        # Follow symlinks, as a transfer over SFTP would
+        command = 'tar -ch%sf - -C %s .' % ('z' if compress else '',
+                                            shlex_quote(remote_path))
+
+        with self._exec_channel(command) as chan:
+            stdout = chan.makefile('rb', -1)
+            yield stdout
+            # Drain anything left, so tar can exit
+            while stdout.read(READ_CHUNK_SIZE):
+                pass
+
+    @contextmanager
+    def get(self, remote_path):
+        with self._sftp() as sftp:
+            with sftp.open(remote_path) as file:
+                yield file
+
+    def read(self, remote_path, offset=0, size=-1):
+        with self._sftp() as sftp:
+            with sftp.open(remote_path) as fp:
+                fp.seek(offset)
+                if size < 0:
+                    return fp.read()
+
+                return fp.read(size)
+
+    def isfile(self, remote_path):
+        with self._sftp() as sftp:
             try:
                 s = sftp.stat(remote_path)
             except IOError:
                 return False
 
-            return stat.S_ISDIR(s.st_mode)
+            # Anything that exists and isn't a directory is a file. This
+            # used to return True only for directories, the opposite of
+            # NewtClusterConnection.isfile(...) and of what callers expect.
+            return not stat.S_ISDIR(s.st_mode)
 
     def mkdir(self, remote_path, ignore_failure=False):
-        with self._client.get_transport().open_sftp_client() as sftp:
+        with self._sftp() as sftp:
             try:
                 sftp.mkdir(remote_path)
             except IOError:
@@ -129,7 +327,7 @@ class SshClusterConnection(AbstractConnection):
                     raise
 
     def makedirs(self, remote_path):
-        with self._client.get_transport().open_sftp_client() as sftp:
+        with self._sftp() as sftp:
             current_path = ''
             if remote_path[0] == '/':
                 current_path = '/'
@@ -144,26 +342,24 @@ class SshClusterConnection(AbstractConnection):
                     sftp.mkdir(current_path)
 
     def put(self, stream, remote_path):
-        with self._client.get_transport().open_sftp_client() as sftp:
+        with self._sftp() as sftp:
             sftp.putfo(stream, remote_path)
 
     def stat(self, remote_path):
-        with self._client.get_transport().open_sftp_client() as sftp:
+        with self._sftp() as sftp:
             return sftp.stat(remote_path)
 
     def remove(self, remote_path):
-        with self._client.get_transport().open_sftp_client() as sftp:
+        with self._sftp() as sftp:
             return sftp.remove(remote_path)
 
     def list(self, remote_path):
-        with self._client.get_transport().open_sftp_client() as sftp:
-            for path in sftp.listdir_iter(remote_path):
-                yield {
-                    'name': path.filename,
-                    'user': path.st_uid,
-                    'group': path.st_gid,
-                    'mode': path.st_mode,
-                    # For now just pass mtime through
-                    'date': path.st_mtime,
-                    'size': path.st_size
-                }
+        with self._sftp() as sftp:
+            for entry in sftp_list(sftp, remote_path):
+                yield entry
+
+    def walk(self, root):
+        """
+        Lists the whole tree with a single remote find, see find_walk(...).
+        """
+        return find_walk(self._client, root, self.list)
@@ -620,6 +620,71 @@ class ClusterTestCase(AssertCallsMixin, base.TestCase):
 
         self.assertCalls(submit.call_args_list, expected_submit_call)
 
+    @mock.patch('cumulus.tasks.job.submit_batch')
+    def test_submit_jobs(self, submit_batch):
+        body = {
+            'profileId': str(self._user_profile['_id']),
+            'name': 'test'
+        }
+
+        json_body = json.dumps(body)
+
+        r = self.request('/clusters', method='POST',
+                         type='application/json', body=json_body, user=self._user)
+        self.assertStatus(r, 201)
+        cluster_id = r.json['_id']
+
+        jobs = [{
+            'name': 'test%d' % i,
+            'commands': ['ls'],
+            'params': {
+                'index': i
+            }
+        } for i in range(3)]
+
+        r = self.request('/clusters/%s/jobs' % str(cluster_id), method='POST',
+                         type='application/json',
+                         body=json.dumps({'jobs': jobs}), user=self._user)
+        self.assertStatus(r, 400)
+        self.assertEqual(r.json['message'], 'Cluster is not running')
+
+        # Move cluster into running state
+        r = self.request(
+            '/clusters/%s' % str(cluster_id), method='PATCH',
+            type='application/json', body=json.dumps({'status': 'running'}),
+            user=self._cumulus)
+        self.assertStatusOk(r)
+
+        # One invalid job means none are created
+        invalid_jobs = jobs + [{'name': 'invalid'}]
+        r = self.request('/clusters/%s/jobs' % str(cluster_id), method='POST',
+                         type='application/json',
+                         body=json.dumps({'jobs': invalid_jobs}),
+                         user=self._user)
+        self.assertStatus(r, 400)
+        self.assertEqual(self.model('job', 'cumulus').find().count(), 0)
+
+        r = self.request('/clusters/%s/jobs' % str(cluster_id), method='POST',
+                         type='application/json',
+                         body=json.dumps({'jobs': jobs}), user=self._user)
+        self.assertStatus(r, 201)
+        self.assertEqual([job['name'] for job in r.json],
+                         ['test0', 'test1', 'test2'])
+        for job in r.json:
+            self.assertEqual(job['status'], 'created')
+            self.assertEqual(job['clusterId'], cluster_id)
+
+        # All the jobs are submitted together
+        self.assertEqual(submit_batch.call_count, 1)
+        (token, cluster, submitted) = submit_batch.call_args[0]
+        self.assertEqual(cluster['_id'], cluster_id)
+        self.assertEqual([job['_id'] for job in submitted],
+                         [job['_id'] for job in r.json])
+        self.assertEqual([job['params'] for job in submitted],
+                         [{'index': i} for i in range(3)])
+        for job in submitted:
+            self.assertNotIn('access', job)
+
     @mock.patch('cumulus.ansible.tasks.cluster.terminate_cluster.delay')
     def test_terminate(self, terminate_cluster):
 
@@ -21,10 +21,12 @@ import cherrypy
 import mock
 import os
 import six
+import stat
 import json
 
 from tests import base
 import cumulus
+from cumulus.transport.abstract import AbstractConnection
 from cumulus.transport.files.download import download_path
 from girder.constants import AssetstoreType
 
@@ -71,9 +73,36 @@ class DownloadTestCase(base.TestCase):
 
         self._token = self.model('token').createToken(user=self._user)
 
+    def _listings_by_path(self, root):
+        """
+        The fixture holds the listings in the order a depth first walk of the
+        tree would request them, map each listing to its path so they can be
+        served whatever order the walk requests them in.
+        """
+        listings = iter(self.paths)
+        by_path = {}
+
+        def walk(path):
+            entries = six.next(listings)
+            by_path[path] = entries
+            for entry in entries:
+                if stat.S_ISDIR(entry['mode']):
+                    walk(os.path.join(path, entry['name']))
+
+        walk(root)
+
+        return by_path
+
     def test_download(self):
         cluster_connection = mock.MagicMock()
-        cluster_connection.list.side_effect = self.paths
+        listings = self._listings_by_path('/test')
+        cluster_connection.list.side_effect \
+            = lambda path: listings[os.path.normpath(path)]
+        # Use the default walk, which lists each directory
+        cluster_connection.walk.side_effect \
+            = lambda root: AbstractConnection.walk(cluster_connection, root)
+        cluster_connection.transfer_channel.return_value.__enter__\
+            .return_value = cluster_connection
 
         download_path(cluster_connection, self._token['_id'], self._folder['_id'] , '/test',
                 'sftp_assetstores', self._assetstore['_id'], upload=False)
@@ -104,4 +133,17 @@ class DownloadTestCase(base.TestCase):
         self.assertEqual(files, expected['files'])
         self.assertEqual(folders, expected['folders'])
 
-
+        # The sizes of the files are added to their items
+        for item in self.model('item').find():
+            files_size = sum([f['size'] for f in
+                              self.model('file').find({'itemId': item['_id']})])
+            self.assertEqual(item['size'], files_size)
+
+        # Downloading again reuses the existing items and files
+        item_count = self.model('item').find().count()
+        file_count = self.model('file').find().count()
+        download_path(cluster_connection, self._token['_id'],
+                      self._folder['_id'], '/test', 'sftp_assetstores',
+                      self._assetstore['_id'], upload=False)
+        self.assertEqual(self.model('item').find().count(), item_count)
+        self.assertEqual(self.model('file').find().count(), file_count)
@@ -19,6 +19,8 @@
 
 from tests import base
 import json
+import mock
+from bson.objectid import ObjectId
 
 
 def setUpModule():
@@ -415,6 +417,103 @@ class JobTestCase(base.TestCase):
         self.assertStatusOk(r)
         self.assertEqual(len(r.json['log']), 1)
 
+    def test_log_paging(self):
+        body = {
+            'commands': [
+                ''
+            ],
+            'name': 'test',
+            'output': []
+        }
+
+        json_body = json.dumps(body)
+        r = self.request('/jobs', method='POST',
+                         type='application/json', body=json_body, user=self._user)
+        self.assertStatus(r, 201)
+        job_id = r.json['_id']
+
+        for (i, level) in enumerate(['INFO', 'ERROR', 'INFO', 'ERROR']):
+            log_entry = {
+                'msg': 'message %d' % i,
+                'levelname': level,
+                'levelno': 40 if level == 'ERROR' else 20
+            }
+            r = self.request('/jobs/%s/log' % str(job_id), method='POST',
+                             type='application/json', body=json.dumps(log_entry),
+                             user=self._user)
+            self.assertStatusOk(r)
+
+        # The log is no longer embedded in the job
+        job = self.model('job', 'cumulus').load(job_id, force=True)
+        self.assertNotIn('log', job)
+
+        r = self.request('/jobs/%s/log' % str(job_id), method='GET',
+                         params={'limit': 3}, user=self._user)
+        self.assertStatusOk(r)
+        self.assertEqual([e['msg'] for e in r.json['log']],
+                         ['message 0', 'message 1', 'message 2'])
+        self.assertIsNotNone(r.json['next'])
+
+        r = self.request('/jobs/%s/log' % str(job_id), method='GET',
+                         params={'limit': 3, 'after': r.json['next']},
+                         user=self._user)
+        self.assertStatusOk(r)
+        self.assertEqual([e['msg'] for e in r.json['log']], ['message 3'])
+        self.assertIsNone(r.json['next'])
+
+        r = self.request('/jobs/%s/log' % str(job_id), method='GET',
+                         params={'level': 'error'}, user=self._user)
+        self.assertStatusOk(r)
+        self.assertEqual([e['msg'] for e in r.json['log']],
+                         ['message 1', 'message 3'])
+
+        r = self.request('/jobs/%s/log' % str(job_id), method='GET',
+                         params={'level': 'bogus'}, user=self._user)
+        self.assertStatus(r, 400)
+
+    def test_log_migration(self):
+        job_model = self.model('job', 'cumulus')
+        log_model = self.model('log', 'cumulus')
+        body = {
+            'commands': [''],
+            'name': 'test',
+            'output': []
+        }
+        r = self.request('/jobs', method='POST', type='application/json',
+                         body=json.dumps(body), user=self._user)
+        self.assertStatus(r, 201)
+        job_id = r.json['_id']
+
+        # A job from before logs were moved out of the job document
+        job_model.update({'_id': ObjectId(job_id)}, {'$set': {
+            'log': [{'msg': 'old 0'}, {'msg': 'old 1'}]
+        }})
+        r = self.request('/jobs/%s/log' % job_id, method='POST',
+                         type='application/json',
+                         body=json.dumps({'msg': 'new'}), user=self._user)
+        self.assertStatusOk(r)
+
+        # Simulate being interrupted after the copy but before the embedded
+        # log is removed, the copy is repeated without duplicating records
+        log_model._meta.delete_many({})
+        with mock.patch.object(job_model, 'update'):
+            log_model.migrate('job', job_model)
+        log_model.migrate('job', job_model)
+
+        r = self.request('/jobs/%s/log' % job_id, method='GET',
+                         user=self._user)
+        self.assertStatusOk(r)
+        self.assertEqual([e['msg'] for e in r.json['log']],
+                         ['old 0', 'old 1', 'new'])
+        self.assertNotIn('log', job_model.load(job_id, force=True))
+
+        # Once migrated we don't look again
+        job_model.update({'_id': ObjectId(job_id)}, {'$set': {
+            'log': [{'msg': 'ignored'}]
+        }})
+        log_model.migrate('job', job_model)
+        self.assertIn('log', job_model.load(job_id, force=True))
+
     def test_get_status(self):
         body = {
             'onComplete': {
@@ -448,6 +547,98 @@ class JobTestCase(base.TestCase):
         expected_status = {u'status': u'created'}
         self.assertEqual(r.json, expected_status)
 
+    def test_array_elements(self):
+        body = {
+            'commands': [
+                ''
+            ],
+            'name': 'test',
+            'output': [],
+            'array': {
+                'start': 1,
+                'end': 7,
+                'step': 2
+            }
+        }
+
+        # The array must be valid
+        invalid_body = dict(body, array={'start': 2, 'end': 1})
+        r = self.request('/jobs', method='POST', type='application/json',
+                         body=json.dumps(invalid_body), user=self._user)
+        self.assertStatus(r, 400)
+
+        r = self.request('/jobs', method='POST', type='application/json',
+                         body=json.dumps(body), user=self._user)
+        self.assertStatus(r, 201)
+        job_id = r.json['_id']
+
+        # Until the job is polled the elements are queued
+        r = self.request('/jobs/%s/elements' % job_id, method='GET',
+                         user=self._user)
+        self.assertStatusOk(r)
+        self.assertEqual(r.json, [
+            {'index': 1, 'status': 'queued'},
+            {'index': 3, 'status': 'queued'},
+            {'index': 5, 'status': 'queued'},
+            {'index': 7, 'status': 'queued'}
+        ])
+
+        # Element states must be queue states
+        update = {
+            'status': 'running',
+            'elements': {
+                '1': 'uploading'
+            }
+        }
+        r = self.request('/jobs/%s' % job_id, method='PATCH',
+                         type='application/json', body=json.dumps(update),
+                         user=self._user)
+        self.assertStatus(r, 400)
+
+        update = {
+            'status': 'running',
+            'elements': {
+                '1': 'complete',
+                '3': 'running',
+                '5': 'queued',
+                '7': 'queued'
+            }
+        }
+        r = self.request('/jobs/%s' % job_id, method='PATCH',
+                         type='application/json', body=json.dumps(update),
+                         user=self._user)
+        self.assertStatusOk(r)
+
+        r = self.request('/jobs/%s/elements' % job_id, method='GET',
+                         params={'offset': 1, 'limit': 2}, user=self._user)
+        self.assertStatusOk(r)
+        self.assertEqual(r.json, [
+            {'index': 3, 'status': 'running'},
+            {'index': 5, 'status': 'queued'}
+        ])
+
+        # Only the elements that have changed are updated
+        update = {
+            'status': 'running',
+            'elements': {
+                '5': 'running'
+            }
+        }
+        r = self.request('/jobs/%s' % job_id, method='PATCH',
+                         type='application/json', body=json.dumps(update),
+                         user=self._user)
+        self.assertStatusOk(r)
+
+        r = self.request('/jobs/%s/elements' % job_id, method='GET',
+                         user=self._user)
+        self.assertStatusOk(r)
+        self.assertEqual(r.json, [
+            {'index': 1, 'status': 'complete'},
+            {'index': 3, 'status': 'running'},
+            {'index': 5, 'status': 'running'},
+            {'index': 7, 'status': 'queued'}
+        ])
+
     def test_delete(self):
         body = {
             'onComplete': {
@@ -94,23 +94,28 @@ class UploadTestCase(base.TestCase):
 
     def test_upload(self):
         cluster_connection = mock.MagicMock()
+        # Transfers happen on channels, use the same mock so we can check them
+        cluster_connection.transfer_channel.return_value.__enter__\
+            .return_value = cluster_connection
         token = self.model('token').createToken(self._user)
-        upload_path(cluster_connection, str(token['_id']),
-                    self._folder['_id'], '/tmp')
+        timings = upload_path(cluster_connection, str(token['_id']),
+                              self._folder['_id'], '/tmp')
 
-        cluster_connection.mkdir.assert_has_calls(
-            [mock.call(u'/tmp/subfolder')])
+        cluster_connection.execute.assert_has_calls(
+            [mock.call(u'mkdir -p /tmp/subfolder')])
 
+        # Files are uploaded concurrently so the order isn't fixed
         self.assertEqual(len(cluster_connection.put.call_args_list), 3)
-        _, (request, path), _ = cluster_connection.put.mock_calls[0]
-        self.assertEqual(path, '/tmp/bill.txt')
-        self.assertEqual(request.read().decode('utf8').strip(), 'bill')
-
-        _, (request, path), _ = cluster_connection.put.mock_calls[1]
-        self.assertEqual(path, '/tmp/bob.txt')
-        self.assertEqual(request.read().decode('utf8').strip(), 'bob')
-
-        _, (request, path), _ = cluster_connection.put.mock_calls[2]
-        self.assertEqual(path, '/tmp/subfolder/will.txt')
-        self.assertEqual(request.read().decode('utf8').strip(), 'will')
-
+        uploaded = {}
+        for (_, (request, path), _) in cluster_connection.put.mock_calls:
+            uploaded[path] = request.read().decode('utf8').strip()
+
+        self.assertEqual(uploaded, {
+            '/tmp/bill.txt': 'bill',
+            '/tmp/bob.txt': 'bob',
+            '/tmp/subfolder/will.txt': 'will'
+        })
+
+        self.assertEqual(sorted([f['path'] for f in timings['files']]),
+                         sorted(uploaded.keys()))
+        self.assertTrue('total' in timings)
@@ -17,6 +17,8 @@
 #  limitations under the License.
 ###############################################################################
 
+from girder.utility.model_importer import ModelImporter
+
 from .cluster import Cluster
 from .job import Job
 from .script import Script
@@ -31,3 +33,9 @@ def load(info):
     info['apiRoot'].volumes = Volume()
     # Augment user resource with aws profiles
     aws.load(info['apiRoot'])
+
+    # Move any log records embedded in documents into the log collection
+    log_model = ModelImporter.model('log', 'cumulus')
+    for resource_type in ['job', 'cluster', 'volume']:
+        log_model.migrate(resource_type,
+                          ModelImporter.model(resource_type, 'cumulus'))
@@ -29,6 +29,7 @@ from girder.api.docs import addModel
 from girder.api.rest import RestException, getBodyJson, loadmodel
 from girder.models.model_base import ValidationException
 from .base import BaseResource
+from .job import validate_job
 from cumulus.constants import ClusterType, ClusterStatus
 from .utility.cluster_adapters import get_cluster_adapter
 from cumulus.ssh.tasks.key import generate_key_pair
@@ -51,6 +52,9 @@ class Cluster(BaseResource):
         self.route('GET', (':id', 'status'), self.status)
         self.route('PUT', (':id', 'terminate'), self.terminate)
         self.route('PUT', (':id', 'job', ':jobId', 'submit'), self.submit_job)
+        self.route('POST', (':id', 'jobs'), self.submit_jobs)
+        self.route('PUT', (':id', 'monitor'), self.acquire_monitor)
+        self.route('DELETE', (':id', 'monitor'), self.release_monitor)
         self.route('GET', (':id', ), self.get)
         self.route('DELETE', (':id', ), self.delete)
         self.route('GET', (), self.find)
@@ -430,16 +434,11 @@ class Cluster(BaseResource):
     @access.user
     def log(self, id, params):
         user = self.getCurrentUser()
-        offset = 0
-        if 'offset' in params:
-            offset = int(params['offset'])
 
         if not self._model.load(id, user=user, level=AccessType.READ):
             raise RestException('Cluster not found.', code=404)
 
-        log_records = self._model.log_records(user, id, offset)
-
-        return {'log': log_records}
+        return self._model.log_records(user, id, params)
 
     log.description = (Description(
         'Get log entries for cluster'
@@ -450,7 +449,20 @@ class Cluster(BaseResource):
         .param(
             'offset',
             'The offset to start getting entries at.', required=False,
-            paramType='query'))
+            paramType='query')
+        .param(
+            'limit',
+            'The maximum number of entries to return, if provided the '
+            'response includes the cursor for the next page.',
+            required=False, paramType='query')
+        .param(
+            'after',
+            'Cursor, only return entries after this one.', required=False,
+            paramType='query')
+        .param(
+            'level',
+            'Only return entries with at least this level, for example '
+            'WARNING.', required=False, paramType='query'))
 
     @access.user
     def submit_job(self, id, jobId, params):
@@ -480,7 +492,7 @@ class Cluster(BaseResource):
 
         cluster_adapter = get_cluster_adapter(cluster)
         del job['access']
-        del job['log']
+        job.pop('log', None)
         cluster_adapter.submit_job(job)
 
     submit_job.description = (
@@ -498,6 +510,127 @@ class Cluster(BaseResource):
             'The properties to template on submit.', dataType='object',
             paramType='body'))
 
+    @access.user
+    def submit_jobs(self, id, params):
+        user = self.getCurrentUser()
+        cluster = self._model.load(id, user=user, level=AccessType.ADMIN)
+
+        if not cluster:
+            raise RestException('Cluster not found.', code=404)
+
+        if cluster['status'] != ClusterStatus.RUNNING:
+            raise RestException('Cluster is not running', code=400)
+
+        body = getBodyJson()
+        self.requireParams(['jobs'], body)
+        if not isinstance(body['jobs'], list) or not body['jobs']:
+            raise RestException('jobs must be a non-empty list', code=400)
+
+        # Validate all the jobs before creating any of them
+        job_params = []
+        for job_body in body['jobs']:
+            # Parameters used when templating the job script
+            job_params.append(job_body.pop('params', None))
+            validate_job(user, job_body)
+
+        job_model = self.model('job', 'cumulus')
+        jobs = []
+        for (job_body, params) in zip(body['jobs'], job_params):
+            # Set the clusterId on the job for termination
+            job_body['clusterId'] = ObjectId(id)
+            if params:
+                job_body['params'] = params
+
+            jobs.append(job_model.create(user, job_body))
+
+        response = [job_model.filter(job, user) for job in jobs]
+
+        for job in jobs:
+            del job['access']
+            job.pop('log', None)
+
+        cluster_adapter = get_cluster_adapter(cluster)
+        cluster_adapter.submit_jobs(jobs)
+
+        cherrypy.response.status = 201
+
+        return response
+
+    addModel('SubmitJobsParams', {
+        'id': 'SubmitJobsParams',
+        'required': ['jobs'],
+        'properties': {
+            'jobs': {
+                'type': 'array',
+                'description': 'The jobs to create, each may also include the '
+                'params to template its script with.',
+                'items': {
+                    '$ref': '#/definitions/JobParameters'
+                }
+            }
+        }
+    }, 'clusters')
+
+    submit_jobs.description = (
+        Description('Create a batch of jobs and submit them to the cluster')
+        .param(
+            'id',
+            'The cluster to submit the jobs to.', required=True,
+            paramType='path')
+        .param(
+            'body',
+            'The jobs to create.', dataType='SubmitJobsParams',
+            paramType='body', required=True))
+
+    @access.user
+    def acquire_monitor(self, id, params):
+        self.requireParams(['taskId', 'ttl'], params)
+        user = self.getCurrentUser()
+
+        try:
+            ttl = float(params['ttl'])
+        except ValueError:
+            raise RestException('ttl must be a number.', code=400)
+
+        (acquired, expires_in) = self._model.acquire_monitor(
+            user, id, params['taskId'], ttl)
+
+        return {
+            'acquired': acquired,
+            'expiresIn': expires_in
+        }
+
+    acquire_monitor.description = (
+        Description('Acquire or renew the job monitor lease for a cluster')
+        .param(
+            'id',
+            'The cluster id.', paramType='path', required=True)
+        .param(
+            'taskId',
+            'The id of the monitor task.', paramType='query', required=True)
+        .param(
+            'ttl',
+            'The number of seconds the lease should be held for.',
+            paramType='query', required=True)
+        .notes('Internal - Used by Celery tasks'))
+
+    @access.user
+    def release_monitor(self, id, params):
+        self.requireParams(['taskId'], params)
+        user = self.getCurrentUser()
+
+        self._model.release_monitor(user, id, params['taskId'])
+
+    release_monitor.description = (
+        Description('Release the job monitor lease for a cluster')
+        .param(
+            'id',
+            'The cluster id.', paramType='path', required=True)
+        .param(
+            'taskId',
+            'The id of the monitor task.', paramType='query', required=True)
+        .notes('Internal - Used by Celery tasks'))
+
     @access.user
     def get(self, id, params):
         user = self.getCurrentUser()
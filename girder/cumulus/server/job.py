@@ -19,16 +19,125 @@
 
 import cherrypy
 import cumulus
+import six
+from bson.objectid import ObjectId
 
 from girder.api import access
 from girder.api.describe import Description, describeRoute
 from girder.constants import AccessType, SortDir
 from girder.api.docs import addModel
 from girder.api.rest import RestException, getBodyJson, loadmodel
+from girder.utility.model_importer import ModelImporter
 from .base import BaseResource
 
 from cumulus import tasks
-from cumulus.constants import JobState
+from cumulus.constants import JobState, JobQueueState
+from cumulus.queue.abstract import array_indices
+
+# The maximum number of elements in a job array, the state of each element is
+# stored in the job.
+MAX_ARRAY_SIZE = 100000
+
+# The states of the elements of a job array are their queue states
+ELEMENT_STATES = set([JobQueueState.QUEUED, JobQueueState.RUNNING,
+                      JobQueueState.COMPLETE, JobQueueState.ERROR])
+
+
+def _element_status(job_status):
+    """
+    Returns the state of the elements of a job array that have not been polled
+    yet, based on the status of the job.
+    """
+    if job_status == JobState.COMPLETE:
+        return JobQueueState.COMPLETE
+    elif job_status in [JobState.ERROR, JobState.UNEXPECTEDERROR,
+                        JobState.TERMINATED]:
+        return JobQueueState.ERROR
+
+    return JobQueueState.QUEUED
+
+
+def _validate_array(array):
+    if not isinstance(array, dict):
+        raise RestException('array must be an object', 400)
+
+    for key in ['start', 'end']:
+        if key not in array:
+            raise RestException('Parameter \'%s\' is required.' % key,
+                                400)
+
+    for key in ['start', 'end', 'step', 'limit']:
+        if key in array and \
+                not isinstance(array[key], six.integer_types):
+            raise RestException('array %s must be an integer' % key, 400)
+
+    if array['start'] < 0 or array['end'] < array['start']:
+        raise RestException('array end must not be before start', 400)
+
+    for key in ['step', 'limit']:
+        if key in array and array[key] < 1:
+            raise RestException('array %s must be positive' % key, 400)
+
+    size = len(array_indices(array))
+    if size > MAX_ARRAY_SIZE:
+        raise RestException(
+            'array can have at most %d elements' % MAX_ARRAY_SIZE, 400)
+
+
+def validate_job(user, body):
+    """
+    Validate the parameters of a new job, resolving any scripts they refer to.
+    """
+    if 'name' not in body:
+        raise RestException('Parameter \'name\' is required.', code=400)
+
+    if 'commands' not in body and 'scriptId' not in body:
+        raise RestException('command or scriptId must be provided',
+                            code=400)
+
+    script_model = ModelImporter.model('script', 'cumulus')
+    if 'scriptId' in body:
+        script = script_model.load(body['scriptId'], user=user,
+                                   level=AccessType.READ)
+        if not script:
+            raise RestException('Script not found', 400)
+
+        del body['scriptId']
+        body['commands'] = script['commands']
+
+    if 'onTerminate' in body and 'scriptId' in body['onTerminate']:
+        script = script_model.load(body['onTerminate']['scriptId'],
+                                   user=user, level=AccessType.READ)
+        if not script:
+            raise RestException('onTerminate script not found', 400)
+
+        del body['onTerminate']['scriptId']
+        body['onTerminate']['commands'] = script['commands']
+
+    if 'input' in body:
+        if not isinstance(body['input'], list):
+            raise RestException('input must be a list', 400)
+
+        for i in body['input']:
+            if i['path'] == body['name']:
+                raise RestException('input can\'t be the same as job name',
+                                    400)
+
+    if 'output' in body:
+        if not isinstance(body['output'], list):
+            raise RestException('output must be a list', 400)
+
+    if 'array' in body:
+        _validate_array(body['array'])
+
+
+def create_job(user, body):
+    """
+    Validate the parameters of a new job and create it.
+    """
+    validate_job(user, body)
+
+    return ModelImporter.model('job', 'cumulus').create(user, body)
 
 
 class Job(BaseResource):
@@ -42,6 +151,7 @@ class Job(BaseResource):
         self.route('POST', (':id', 'log'), self.append_to_log)
         self.route('GET', (':id', 'log'), self.log)
         self.route('GET', (':id', 'output'), self.output)
+        self.route('GET', (':id', 'elements'), self.elements)
         self.route('DELETE', (':id', ), self.delete)
         self.route('GET', (':id',), self.get)
         self.route('GET', (), self.find)
@@ -50,7 +160,7 @@ class Job(BaseResource):
 
     def _clean(self, job):
         del job['access']
-        del job['log']
+        job.pop('log', None)
         job['_id'] = str(job['_id'])
         job['userId'] = str(job['userId'])
 
@@ -62,46 +172,7 @@ class Job(BaseResource):
 
         body = getBodyJson()
 
-        self.requireParams(['name'], body)
-
-        if 'commands' not in body and 'scriptId' not in body:
-            raise RestException('command or scriptId must be provided',
-                                code=400)
-
-        if 'scriptId' in body:
-            script = self.model('script', 'cumulus').load(body['scriptId'],
-                                                          user=user,
-                                                          level=AccessType.READ)
-            if not script:
-                raise RestException('Script not found', 400)
-
-            del body['scriptId']
-            body['commands'] = script['commands']
-
-        if 'onTerminate' in body and 'scriptId' in body['onTerminate']:
-            script = self.model('script', 'cumulus') \
-                .load(body['onTerminate']['scriptId'], user=user,
-                      level=AccessType.READ)
-            if not script:
-                raise RestException('onTerminate script not found', 400)
-
-            del body['onTerminate']['scriptId']
-            body['onTerminate']['commands'] = script['commands']
-
-        if 'input' in body:
-            if not isinstance(body['input'], list):
-                raise RestException('input must be a list', 400)
-
-            for i in body['input']:
-                if i['path'] == body['name']:
-                    raise RestException('input can\'t be the same as job name',
-                                        400)
-
-        if 'output' in body:
-            if not isinstance(body['output'], list):
-                raise RestException('output must be a list', 400)
-
-        job = self._model.create(user, body)
+        job = create_job(user, body)
 
         cherrypy.response.status = 201
         cherrypy.response.headers['Location'] = '/jobs/%s' % job['_id']
@@ -120,6 +191,30 @@ class Job(BaseResource):
         }
     }, 'jobs')
 
+    addModel('JobArrayParams', {
+        'id': 'JobArrayParams',
+        'required': ['start', 'end'],
+        'properties': {
+            'start': {
+                'type': 'integer',
+                'description': 'The first index.'
+            },
+            'end': {
+                'type': 'integer',
+                'description': 'The last index, inclusive.'
+            },
+            'step': {
+                'type': 'integer',
+                'description': 'The step between indices, defaults to 1.'
+            },
+            'limit': {
+                'type': 'integer',
+                'description': 'The maximum number of elements to run at '
+                'once.'
+            }
+        }
+    }, 'jobs')
+
     addModel('InputItem', {
         'id': 'InputItem',
         'properties': {
@@ -183,6 +278,9 @@ class Job(BaseResource):
             },
             'onComplete': {
                 '$ref': '#/definitions/JobOnCompleteParams'
+            },
+            'array': {
+                '$ref': '#/definitions/JobArrayParams'
             }
         }
     }, 'jobs')
@@ -229,10 +327,19 @@ class Job(BaseResource):
         user = self.getCurrentUser()
         body = getBodyJson()
 
-        job = self._model.load(id, user=user, level=AccessType.WRITE)
+        # The element states of a job array are updated separately
+        job = self._model.load(id, user=user, level=AccessType.WRITE,
+                               fields={'elements': False})
         if not job:
             raise RestException('Job not found.', code=404)
 
+        elements = body.get('elements', {})
+        if not isinstance(elements, dict) or \
+                not all(index.isdigit() for index in elements) or \
+                not set(elements.values()) <= ELEMENT_STATES:
+            raise RestException('elements must map indices to one of: %s'
+                                % ', '.join(sorted(ELEMENT_STATES)), 400)
+
         if 'status' in body:
             job['status'] = body['status']
 
@@ -254,12 +361,12 @@ class Job(BaseResource):
         if 'metadata' in body:
             job['metadata'] = body['metadata']
 
-        job = self._model.update_job(user, job)
+        job = self._model.update_job(user, job, elements=elements)
 
         # Don't return the access object
         del job['access']
         # Don't return the log
-        del job['log']
+        job.pop('log', None)
 
         return job
 
@@ -273,7 +380,11 @@ class Job(BaseResource):
             'queueJobId': {'type': 'integer',
                            'description': 'The native queue job id. (optional)'},
             'metadata': {'type': 'object',
-                         'description': 'Application metadata. (optional)'}
+                         'description': 'Application metadata. (optional)'},
+            'elements': {'type': 'object',
+                         'description': 'The new state of the elements of a '
+                         'job array whose state has changed, keyed by index. '
+                         '(optional)'}
         }
     }, 'jobs')
 
@@ -334,16 +445,12 @@ class Job(BaseResource):
     @access.user
     def log(self, id, params):
         user = self.getCurrentUser()
-        offset = 0
-        if 'offset' in params:
-            offset = int(params['offset'])
-
         job = self._model.load(id, user=user, level=AccessType.READ)
 
         if not job:
             raise RestException('Job not found.', code=404)
 
-        return {'log': job['log'][offset:]}
+        return self._model.log_records(user, id, params)
 
     log.description = (
         Description('Get log entries for job')
@@ -353,7 +460,20 @@ class Job(BaseResource):
         .param(
             'offset',
             'The offset to start getting entries at.', required=False,
-            paramType='query'))
+            paramType='query')
+        .param(
+            'limit',
+            'The maximum number of entries to return, if provided the '
+            'response includes the cursor for the next page.',
+            required=False, paramType='query')
+        .param(
+            'after',
+            'Cursor, only return entries after this one.', required=False,
+            paramType='query')
+        .param(
+            'level',
+            'Only return entries with at least this level, for example '
+            'WARNING.', required=False, paramType='query'))
 
     @access.user
     def output(self, id, params):
@@ -400,6 +520,45 @@ class Job(BaseResource):
             'The offset to start getting entries at.', required=False,
             paramType='query'))
 
+    @access.user
+    def elements(self, id, params):
+        user = self.getCurrentUser()
+        job = self._model.load(id, user=user, level=AccessType.READ)
+
+        if not job:
+            raise RestException('Job not found.', code=404)
+
+        if not job.get('array'):
+            raise RestException('Job is not a job array.', code=400)
+
+        limit = int(params.get('limit', 0))
+        offset = int(params.get('offset', 0))
+
+        indices = array_indices(job['array'])[offset:]
+        if limit:
+            indices = indices[:limit]
+
+        elements = job.get('elements', {})
+        status = _element_status(job['status'])
+
+        return [{
+            'index': index,
+            'status': elements.get(str(index), status)
+        } for index in indices]
+
+    elements.description = (
+        Description('Get the status of the elements of a job array')
+        .param(
+            'id',
+            'The job id.', paramType='path', required=True)
+        .param(
+            'offset',
+            'The offset into the elements', paramType='query', required=False)
+        .param(
+            'limit',
+            'Maximum number of elements to return', paramType='query',
+            required=False))
+
     @access.user
     def get(self, id, params):
         user = self.getCurrentUser()
@@ -462,9 +621,22 @@ class Job(BaseResource):
         limit = int(params.get('limit', 0))
         offset = int(params.get('offset', 0))
 
-        jobs = self._model.find(
-            query=query, offset=offset, limit=limit,
-            sort=[('name', SortDir.ASCENDING)])
+        if 'status' in params:
+            query['status'] = {'$in': params['status'].split(',')}
+
+        if 'clusterId' in params:
+            # Jobs on a cluster may belong to several users so filter by
+            # access rather than owner.
+            del query['userId']
+            query['clusterId'] = ObjectId(params['clusterId'])
+            cursor = self._model.find(
+                query=query, sort=[('name', SortDir.ASCENDING)])
+            jobs = self._model.filterResultsByPermission(
+                cursor, user, AccessType.READ, limit=limit, offset=offset)
+        else:
+            jobs = self._model.find(
+                query=query, offset=offset, limit=limit,
+                sort=[('name', SortDir.ASCENDING)])
 
         return [self._clean(job) for job in jobs]
 
@@ -476,4 +648,12 @@ class Job(BaseResource):
         .param(
             'limit',
             'Maximum number of jobs to return', paramType='query',
-            required=False))
+            required=False)
+        .param(
+            'clusterId',
+            'Only return jobs submitted to this cluster', paramType='query',
+            required=False)
+        .param(
+            'status',
+            'Comma separated list of statuses to filter on',
+            paramType='query', required=False))
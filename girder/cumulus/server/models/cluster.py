@@ -17,7 +17,9 @@
 #  limitations under the License.
 ###############################################################################
 
+import time
 from jsonpath_rw import parse
+from pymongo import ReturnDocument
 from girder.models.model_base import ValidationException
 from bson.objectid import ObjectId, InvalidId
 from girder.constants import AccessType
@@ -27,7 +29,8 @@ from cumulus.constants import ClusterType, ClusterStatus, QueueType
 
 from ..utility.cluster_adapters import get_cluster_adapter
 from cumulus.common.girder import send_status_notification, \
-    send_log_notification, check_group_membership
+    send_log_notification, check_group_membership, log_response, \
+    to_log_records
 import cumulus
 from cumulus import queue
 import six
@@ -143,7 +146,6 @@ class Cluster(BaseModel):
         cluster = {
             'name': name,
             'profileId': profile['_id'],
-            'log': [],
             'status': ClusterStatus.CREATED,
             'config': dict(config, **{
                 'scheduler': {
@@ -166,7 +168,6 @@ class Cluster(BaseModel):
     def create_traditional(self, user, name, config):
         cluster = {
             'name': name,
-            'log': [],
             'status': 'creating',
             'config': config,
             'type': ClusterType.TRADITIONAL
@@ -186,7 +187,6 @@ class Cluster(BaseModel):
             config.setdefault('scheduler', {})['type'] = QueueType.SLURM
         cluster = {
             'name': name,
-            'log': [],
             'status': 'creating',
             'config': config,
             'type': ClusterType.NEWT
@@ -209,13 +209,11 @@ class Cluster(BaseModel):
 
             return new_value
         # Load first to force access check
-        log = mongo_safe_value(record)
+        records = [mongo_safe_value(r) for r in to_log_records(record)]
         cluster = self.load(id, user=user, level=AccessType.WRITE)
-        self.update({'_id': ObjectId(id)},
-                    {'$push': {
-                        'log': mongo_safe_value(record)
-                    }})
-        send_log_notification('cluster', cluster, log)
+        self.model('log', 'cumulus').append_many('cluster', id, records)
+        for log in records:
+            send_log_notification('cluster', cluster, log)
 
     def update_status(self, id, status):
         self.update({'_id': ObjectId(id)},
@@ -238,13 +236,70 @@ class Cluster(BaseModel):
 
         return self.save(current_cluster)
 
-    def log_records(self, user, id, offset=0):
-        # TODO Need to figure out perms a remove this force
-        cluster = self.load(id, user=user, level=AccessType.READ)
+    def acquire_monitor(self, user, id, task_id, ttl):
+        """
+        Try to take the job monitor lease for a cluster. The lease is granted
+        if no one holds it, it has expired or it is already held by task_id, in
+        which case it is renewed.
+
+        :returns: A tuple of whether the lease was acquired and the number of
+                  seconds until the current lease expires, None if the lease
+                  has been released since we tried to take it.
+        """
+        # Load first to force access check
+        self.load(id, user=user, level=AccessType.WRITE)
+
+        now = time.time()
+        query = {
+            '_id': ObjectId(id),
+            '$or': [
+                {'monitor': {'$exists': False}},
+                {'monitor.expires': {'$lt': now}},
+                {'monitor.taskId': task_id}
+            ]
+        }
+        update = {
+            '$set': {
+                'monitor': {
+                    'taskId': task_id,
+                    'expires': now + ttl
+                }
+            }
+        }
+
+        cluster = self.collection.find_one_and_update(
+            query, update, return_document=ReturnDocument.AFTER)
+        acquired = cluster is not None
 
-        return cluster['log'][offset:]
+        if not acquired:
+            cluster = self.collection.find_one({'_id': ObjectId(id)},
+                                               {'monitor': True})
+
+        # The lease may have been released since our update
+        expires = (cluster or {}).get('monitor', {}).get('expires')
+        if expires is None:
+            return (acquired, None)
+
+        return (acquired, expires - now)
+
+    def release_monitor(self, user, id, task_id):
+        # Load first to force access check
+        self.load(id, user=user, level=AccessType.WRITE)
+        self.update({'_id': ObjectId(id), 'monitor.taskId': task_id},
+                    {'$unset': {'monitor': ''}})
+
+    def log_records(self, user, id, params):
+        # Load first to force access check
+        self.load(id, user=user, level=AccessType.READ)
+
+        return log_response(self.model('log', 'cumulus'), 'cluster', id,
+                            params)
 
     def delete(self, user, id):
         cluster = self.load(id, user=user, level=AccessType.ADMIN)
 
         self.remove(cluster)
+
+    def remove(self, cluster, **kwargs):
+        self.model('log', 'cumulus').remove_records('cluster', cluster['_id'])
+        super(Cluster, self).remove(cluster, **kwargs)
@@ -17,12 +17,13 @@
 #  limitations under the License.
 ###############################################################################
 
+import six
 from girder.models.model_base import ValidationException
 from bson.objectid import ObjectId
 from girder.constants import AccessType
 from .base import BaseModel
 from cumulus.common.girder import send_status_notification, \
-    send_log_notification
+    send_log_notification, log_response, to_log_records
 
 
 class Job(BaseModel):
@@ -43,7 +44,6 @@ class Job(BaseModel):
     def create(self, user, job):
 
         job['status'] = 'created'
-        job['log'] = []
 
         self.setUserAccess(job, user=user, level=AccessType.ADMIN)
         group = {
@@ -75,22 +75,44 @@ class Job(BaseModel):
 
         return job
 
-    def update_job(self, user, job):
+    def update_job(self, user, job, elements=None):
+        """
+        Update a job, the states of the elements of a job array are not part
+        of the update, instead the elements whose state has changed are given
+        as a dict keyed by index and only those elements are written.
+        """
         job_id = job['_id']
-        current_job = self.load(job_id, user=user, level=AccessType.WRITE)
+        current_job = self.load(job_id, user=user, level=AccessType.WRITE,
+                                fields={'elements': False})
         new_status = job['status']
 
         if current_job['status'] != new_status:
             send_status_notification('job', job)
 
-        return self.save(job)
+        job = self.validate(job)
+        update = {
+            key: value for (key, value) in six.iteritems(job)
+            if key not in ['_id', 'elements']
+        }
+        for (index, state) in six.iteritems(elements or {}):
+            update['elements.%s' % index] = state
+        self.update({'_id': job_id}, {'$set': update})
+
+        return job
 
     def append_to_log(self, user, _id, record):
         job = self.load(_id, user=user, level=AccessType.WRITE)
-        self.update({'_id': ObjectId(_id)}, {'$push': {'log': record}})
-        send_log_notification('job', job, record)
+        records = to_log_records(record)
+        self.model('log', 'cumulus').append_many('job', _id, records)
+        for log in records:
+            send_log_notification('job', job, log)
 
-    def log_records(self, user, id, offset=0):
-        job = self.load(id, user=user, level=AccessType.READ)
+    def log_records(self, user, id, params):
+        # Load first to force access check
+        self.load(id, user=user, level=AccessType.READ)
+
+        return log_response(self.model('log', 'cumulus'), 'job', id, params)
 
-        return job['log'][offset:]
+    def remove(self, job, **kwargs):
+        self.model('log', 'cumulus').remove_records('job', job['_id'])
+        super(Job, self).remove(job, **kwargs)
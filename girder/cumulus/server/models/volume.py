@@ -28,7 +28,7 @@ from ..utility.volume_adapters import get_volume_adapter
 from cumulus.constants import VolumeType
 from cumulus.constants import VolumeState
 from cumulus.common.girder import send_log_notification, \
-    send_status_notification
+    send_status_notification, log_response, to_log_records
 
 
 class Volume(BaseModel):
@@ -85,8 +85,7 @@ class Volume(BaseModel):
                 'id': None
             },
             'profileId': profileId,
-            'status': VolumeState.CREATED,
-            'log': []
+            'status': VolumeState.CREATED
         }
 
         if fs:
@@ -108,8 +107,10 @@ class Volume(BaseModel):
 
     def append_to_log(self, user, id, record):
         volume = self.load(id, user=user, level=AccessType.WRITE)
-        self.update({'_id': ObjectId(id)}, {'$push': {'log': record}})
-        send_log_notification('volume', volume, record)
+        records = to_log_records(record)
+        self.model('log', 'cumulus').append_many('volume', id, records)
+        for log in records:
+            send_log_notification('volume', volume, log)
 
     def update_volume(self, user, volume):
         volume_id = volume['_id']
@@ -124,7 +125,13 @@ class Volume(BaseModel):
 
         return self.save(current_volume)
 
-    def log_records(self, user, id, offset=0):
-        volume = self.load(id, user=user, level=AccessType.READ)
+    def log_records(self, user, id, params):
+        # Load first to force access check
+        self.load(id, user=user, level=AccessType.READ)
 
-        return volume['log'][offset:]
+        return log_response(self.model('log', 'cumulus'), 'volume', id,
+                            params)
+
+    def remove(self, volume, **kwargs):
+        self.model('log', 'cumulus').remove_records('volume', volume['_id'])
+        super(Volume, self).remove(volume, **kwargs)
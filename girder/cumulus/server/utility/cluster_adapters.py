@@ -109,6 +109,13 @@ class AbstractClusterAdapter(ModelImporter):
             self._model.filter(self.cluster, getCurrentUser(), passphrase=False),
             job, log_url)
 
+    def submit_jobs(self, jobs):
+        girder_token = get_task_token()['_id']
+        cumulus.tasks.job.submit_batch(
+            girder_token,
+            self._model.filter(self.cluster, getCurrentUser(), passphrase=False),
+            jobs)
+
 
 class AnsibleClusterAdapter(AbstractClusterAdapter):
     """
@@ -302,7 +309,7 @@ class TraditionClusterAdapter(AbstractClusterAdapter):
         # Don't return the access object
         del self.cluster['access']
         # Don't return the log
-        del self.cluster['log']
+        self.cluster.pop('log', None)
         # Don't return the passphrase
         if parse('config.ssh.passphrase').find(self.cluster):
             del self.cluster['config']['ssh']['passphrase']
@@ -353,7 +360,7 @@ class NewtClusterAdapter(AbstractClusterAdapter):
         # Don't return the access object
         del self.cluster['access']
         # Don't return the log
-        del self.cluster['log']
+        self.cluster.pop('log', None)
 
         return self.cluster
 
@@ -382,6 +389,13 @@ class NewtClusterAdapter(AbstractClusterAdapter):
             self._model.filter(self.cluster, getCurrentUser(), passphrase=False),
             job, log_url)
 
+    def submit_jobs(self, jobs):
+        girder_token = get_task_token(self.cluster)['_id']
+        cumulus.tasks.job.submit_batch(
+            girder_token,
+            self._model.filter(self.cluster, getCurrentUser(), passphrase=False),
+            jobs)
+
 
 type_to_adapter = {
     ClusterType.EC2: AnsibleClusterAdapter,
@@ -482,16 +482,11 @@ class Volume(BaseResource):
     @access.user
     def log(self, id, params):
         user = getCurrentUser()
-        offset = 0
-        if 'offset' in params:
-            offset = int(params['offset'])
 
         if not self._model.load(id, user=user, level=AccessType.READ):
             raise RestException('Volume not found.', code=404)
 
-        log_records = self._model.log_records(user, id, offset)
-
-        return {'log': log_records}
+        return self._model.log_records(user, id, params)
 
     log.description = (Description(
         'Get log entries for volume'
@@ -502,4 +497,17 @@ class Volume(BaseResource):
         .param(
             'offset',
             'The offset to start getting entries at.', required=False,
-            paramType='query'))
+            paramType='query')
+        .param(
+            'limit',
+            'The maximum number of entries to return, if provided the '
+            'response includes the cursor for the next page.',
+            required=False, paramType='query')
+        .param(
+            'after',
+            'Cursor, only return entries after this one.', required=False,
+            paramType='query')
+        .param(
+            'level',
+            'Only return entries with at least this level, for example '
+            'WARNING.', required=False, paramType='query'))
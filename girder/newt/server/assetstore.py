@@ -26,6 +26,8 @@ from girder.models.model_base import ValidationException, GirderException
 from girder.utility.abstract_assetstore_adapter import AbstractAssetstoreAdapter
 from girder.api.rest import getCurrentUser
 
+from cumulus.common.download_cache import get_download_cache
+
 BUF_LEN = 65536
 
 
@@ -47,23 +49,78 @@ class NewtAssetstoreAdapter(AbstractAssetstoreAdapter):
 
         return doc
 
+    def _session_id(self):
+        session_id = parse('newt.sessionId').find(getCurrentUser())
+        if len(session_id) > 0:
+            session_id = session_id[0].value
+
+        if session_id is None:
+            raise GirderException('Missing NEWT session id')
+
+        return session_id
+
+    def _cached_download(self, cache, file, offset, headers, end_byte):
+        """
+        Serve the download through the download cache, fetching the blocks
+        that are not cached from NEWT.
+        """
+        full_path = file['path']
+        size = file['size']
+        if end_byte is None or end_byte > size:
+            end_byte = size
+
+        cookies = dict(newt_sessionid=self._session_id())
+
+        # The modification date is part of the key so a file that has changed
+        # on the machine is not served from the cache.
+        url = '%s/file/%s/%s' % (self.newt_base_url, self.machine, full_path)
+        r = requests.get(url, cookies=cookies)
+        r.raise_for_status()
+        key = (str(self.assetstore['_id']), full_path, size,
+               r.json()[0].get('date'))
+
+        def fetch(start, end):
+            # NEWT doesn't support ranges, so skip to the start of the range.
+            r = requests.get('%s?view=read' % url, cookies=cookies,
+                             stream=True)
+            r.raise_for_status()
+            position = 0
+            for chunk in r.iter_content(chunk_size=BUF_LEN):
+                chunk_end = position + len(chunk)
+                if chunk_end > start:
+                    yield chunk[max(start - position, 0):end - position]
+                position = chunk_end
+                if position >= end:
+                    break
+
+        if headers:
+            cherrypy.response.headers['Accept-Ranges'] = 'bytes'
+            self.setContentHeaders(file, offset, end_byte)
+
+        def stream():
+            for data in cache.read(key, size, offset, end_byte, fetch):
+                yield data
+
+        return stream
+
     def downloadFile(self, file, offset=0, headers=True, endByte=None,
                      **kwargs):
 
         if 'path' not in file:
             raise Exception('Missing path property')
 
+        # Downloads are proxied when the cache is enabled, so they can be
+        # served from and added to it.
+        cache = get_download_cache()
+        if cache is not None:
+            return self._cached_download(cache, file, offset, headers, endByte)
+
         full_path = file['path']
         url = '%s/file/%s/%s?view=read' % (self.newt_base_url, self.machine, full_path)
         if headers:
             raise cherrypy.HTTPRedirect(url)
         else:
-            session_id = parse('newt.sessionId').find(getCurrentUser())
-            if len(session_id) > 0:
-                session_id = session_id[0].value
-
-            if session_id is None:
-                raise GirderException('Missing NEWT session id')
+            session_id = self._session_id()
 
             def stream():
                 cookies = dict(newt_sessionid=session_id)
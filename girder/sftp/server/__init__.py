@@ -24,7 +24,7 @@ from girder.constants import AssetstoreType
 from girder.utility.model_importer import ModelImporter
 from girder.utility.assetstore_utilities import setAssetstoreAdapter
 
-from .assetstore import SftpAssetstoreAdapter
+from .assetstore import SftpAssetstoreAdapter, invalidate_credentials
 from .credentials import retrieve_credentials
 from .rest import SftpAssetstoreResource
 
@@ -46,11 +46,19 @@ def updateAssetstore(event):
             'keystore': params.get('host', assetstore['sftp']['keystore'])
         }
 
+
+def clusterChanged(event):
+    # The cluster's key or user may have changed
+    invalidate_credentials(str(event.info['_id']))
+
+
 def load(info):
 
     AssetstoreType.SFTP = 'sftp'
     setAssetstoreAdapter(AssetstoreType.SFTP, SftpAssetstoreAdapter)
     events.bind('assetstore.update', 'sftp', updateAssetstore)
     events.bind('assetstore.sftp.credentials.get', 'sftp', retrieve_credentials)
+    events.bind('model.cluster.save.after', 'sftp', clusterChanged)
+    events.bind('model.cluster.remove', 'sftp', clusterChanged)
 
     info['apiRoot'].sftp_assetstores = SftpAssetstoreResource()
@@ -18,20 +18,130 @@
 ###############################################################################
 
 import cherrypy
+import itertools
 import os
 import paramiko
+import socket
 import stat
+import threading
+import time
 from contextlib import contextmanager
 
 from girder.models.model_base import ValidationException
 from girder.utility.abstract_assetstore_adapter import AbstractAssetstoreAdapter
 from girder import events
-from girder.api.rest import RestException
+from girder.api.rest import getCurrentUser
 
 from paramiko.ssh_exception import SSHException
 
+import cumulus
+from cumulus.common.download_cache import get_download_cache
+from cumulus.common.jsonpath import get_property
+from cumulus.transport.pool import SshConnectionPool
+from cumulus.transport.ssh import find_walk, sftp_list
+
 
 BUFFER_SIZE = 32768
+# Reads start at BUFFER_SIZE, so the first bytes are sent quickly, and double
+# up to this size as the download progresses.
+MAX_READ_SIZE = 1024 * 1024
+# The number of bytes requested ahead of the data being sent, requests for the
+# next window are sent before the current one is consumed so there are always
+# requests outstanding.
+READ_AHEAD_WINDOW = 8 * 1024 * 1024
+# How long, in seconds, credentials are cached for. Credentials are cached per
+# Girder user, so access to the cluster is rechecked at least this often.
+DEFAULT_CREDENTIALS_TTL = 60
+SSH_PORT = 22
+# Each download being streamed holds a connection, so the assetstore has its
+# own pool, with room for many more concurrent connections per host than the
+# worker's. It is configured using the sftp.pool section of the cumulus
+# configuration.
+DEFAULT_MAX_CONNECTIONS_PER_HOST = 32
+DEFAULT_ACQUIRE_TIMEOUT = 30
+
+# (Girder user id, host, user, authKey) => (expires, credentials)
+_credentials = {}
+_credentials_lock = threading.Lock()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_connection_pool():
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = SshConnectionPool.from_config(
+                'sftp.pool',
+                max_connections_per_host=DEFAULT_MAX_CONNECTIONS_PER_HOST,
+                acquire_timeout=DEFAULT_ACQUIRE_TIMEOUT)
+
+    return _pool
+
+
+def invalidate_credentials(auth_key):
+    """
+    Forget the cached credentials for an authKey, and close the idle pooled
+    connections made with them. Used when a cluster's key changes.
+    """
+    with _credentials_lock:
+        for key in list(_credentials):
+            if key[3] == auth_key:
+                del _credentials[key]
+
+    _get_connection_pool().close_idle(
+        lambda key: len(key) > 3 and key[3] == auth_key)
+
+
+def _read_windows(offset, end_byte):
+    """
+    Split the range from offset to end_byte into windows of up to
+    READ_AHEAD_WINDOW bytes, each a list of (offset, length) reads. The read
+    size grows from BUFFER_SIZE to MAX_READ_SIZE.
+    """
+    read_size = BUFFER_SIZE
+    while offset < end_byte:
+        window = []
+        window_end = min(offset + READ_AHEAD_WINDOW, end_byte)
+        while offset < window_end:
+            length = min(read_size, window_end - offset)
+            window.append((offset, length))
+            offset += length
+            read_size = min(read_size * 2, MAX_READ_SIZE)
+
+        yield window
+
+
+def _pipelined_read(sftp_file, offset, end_byte):
+    """
+    Yields the bytes of sftp_file from offset up to end_byte. Each window is
+    read using readv(...), which pipelines the SFTP requests, and the next
+    window is requested before the current one is consumed, so the link is
+    never idle waiting for a request. At most two windows are buffered.
+    """
+    previous = None
+    for window in _read_windows(offset, end_byte):
+        reader = sftp_file.readv(window)
+        # Starting the generator sends the requests for the window
+        first = next(reader, None)
+
+        if previous is not None:
+            for data in previous:
+                # The file is shorter than expected
+                if not data:
+                    return
+                yield data
+
+        previous = itertools.chain([first], reader)
+
+    if previous is not None:
+        for data in previous:
+            if not data:
+                return
+            yield data
+
 
 class SftpAssetstoreAdapter(AbstractAssetstoreAdapter):
     def __init__(self, assetstore):
@@ -53,6 +163,24 @@ class SftpAssetstoreAdapter(AbstractAssetstoreAdapter):
         return doc
 
     def _get_credentials(self):
+        user = getCurrentUser()
+        cache_key = (user['_id'] if user else None, self.host, self.user,
+                     self.authKey)
+        now = time.time()
+        with _credentials_lock:
+            cached = _credentials.get(cache_key)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+
+        credentials = self._retrieve_credentials()
+        ttl = get_property('sftp.credentialsTtl', cumulus.config,
+                           default=DEFAULT_CREDENTIALS_TTL)
+        with _credentials_lock:
+            _credentials[cache_key] = (now + ttl, credentials)
+
+        return credentials
+
+    def _retrieve_credentials(self):
         private_key=None
         private_key_pass=None
 
@@ -69,22 +197,60 @@ class SftpAssetstoreAdapter(AbstractAssetstoreAdapter):
         return (private_key, private_key_pass)
 
     @contextmanager
-    def open_ssh_connection(self):
-        ssh = None
-
+    def _pooled_connection(self):
         (private_key, private_key_pass) = self._get_credentials()
 
-        try:
+        # A regenerated key gets a new connection
+        key_mtime = None
+        if private_key and os.path.exists(private_key):
+            key_mtime = os.path.getmtime(private_key)
+        key = (self.host, SSH_PORT, self.user, self.authKey, private_key,
+               key_mtime)
+
+        def connect():
             ssh = paramiko.SSHClient()
             ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            ssh.connect(hostname=self.host, username=self.user,
-                        key_filename=private_key,
+            ssh.connect(hostname=self.host, port=SSH_PORT,
+                        username=self.user, key_filename=private_key,
                         password=private_key_pass)
 
-            yield ssh
+            return ssh
+
+        pool = _get_connection_pool()
+        pooled = pool.acquire(key, connect)
+        discard = False
+        try:
+            yield pooled
+        except (EOFError, socket.error, SSHException):
+            discard = True
+            raise
         finally:
-            if ssh:
-                ssh.close()
+            pool.release(pooled, discard=discard)
+
+    @contextmanager
+    def open_ssh_connection(self):
+        """
+        Yields an SSH client from the process wide pool, it is returned to the
+        pool on exit so must not be closed.
+        """
+        with self._pooled_connection() as pooled:
+            yield pooled.client
+
+    @contextmanager
+    def open_sftp(self):
+        """
+        Yields an SFTP session over a pooled connection, the session is kept
+        with the connection and reused.
+        """
+        with self._pooled_connection() as pooled:
+            if pooled.sftp is None:
+                pooled.sftp = pooled.client.open_sftp()
+
+            try:
+                yield pooled.sftp
+            except (EOFError, socket.error, SSHException):
+                pooled.sftp = None
+                raise
 
     def downloadFile(self, file, offset=0, headers=True, end_byte=None,
                      **kwargs):
@@ -96,59 +262,77 @@ class SftpAssetstoreAdapter(AbstractAssetstoreAdapter):
             cherrypy.response.headers['Accept-Ranges'] = 'bytes'
             self.setContentHeaders(file, offset, end_byte)
 
-        def stream():
-            bytes_read = offset
-
-            with self.open_ssh_connection() as ssh:
-                with ssh.open_sftp() as sftp_client:
-                    with sftp_client.open(path,
-                                      mode='r', bufsize=-1) as sftp_file:
+        cache = get_download_cache()
 
-                        # If we are fetching the whole file then use prefetch
-                        if offset == 0 and end_byte == file['size']:
-                            sftp_file.prefetch(file['size'])
+        def stream():
+            with self.open_sftp() as sftp_client:
+                with sftp_client.open(path, mode='r', bufsize=-1) as sftp_file:
+                    if cache is None:
+                        data = _pipelined_read(sftp_file, offset, end_byte)
+                    else:
+                        # The mtime is part of the key so a file that has
+                        # changed on the cluster is not served from the cache.
+                        key = (str(self.assetstore['_id']), path, file['size'],
+                               sftp_file.stat().st_mtime)
+                        data = cache.read(
+                            key, file['size'], offset, end_byte,
+                            lambda start, end: _pipelined_read(sftp_file,
+                                                               start, end))
+                    for d in data:
+                        yield d
 
-                        if offset > 0:
-                            sftp_file.seek(offset)
+        return stream
 
-                        while True:
-                            read_len = min(BUFFER_SIZE, end_byte - bytes_read)
-                            if read_len <= 0:
-                                break
+    def _walk(self, ssh, path):
+        """
+        List the tree below path, directories are listed before their
+        contents. An SFTP session is only opened if the tree has to be listed
+        one directory at a time.
+        """
+        sftp = []
 
-                            data = sftp_file.read(read_len)
-                            bytes_read += read_len
+        def list_directory(dir_path):
+            if not sftp:
+                sftp.append(ssh.open_sftp())
 
-                            if not data:
-                                break
-                            yield data
+            return sftp_list(sftp[0], dir_path)
 
-        return stream
+        try:
+            for entry in find_walk(ssh, path, list_directory):
+                yield entry
+        finally:
+            if sftp:
+                sftp[0].close()
 
     def _import_path(self, parent, user, path, parent_type='folder', ssh=None):
-        with ssh.open_sftp() as sftp_client:
-            for p in sftp_client.listdir_iter(path=path):
-                name  = p.filename
-
-                full_path = os.path.join(path, name)
-                if name in ['.', '..']:
-                    continue
-                if stat.S_ISDIR(p.st_mode):
-                    folder = self.model('folder').createFolder(
-                        parent=parent, name=name, parentType=parent_type,
-                        creator=user, reuseExisting=True)
-
-                    self._import_path(folder, user, full_path, parent_type='folder', ssh=ssh)
-                else:
-                    size = p.st_size
-                    item = self.model('item').createItem(
-                        name=name, creator=user, folder=parent, reuseExisting=True)
-                    file = self.model('file').createFile(
-                        name=name, creator=user, item=item, reuseExisting=True,
-                        assetstore=self.assetstore, mimeType=None, size=size)
-                    file['imported'] = True
-                    file['path'] = full_path
-                    self.model('file').save(file)
+        # Map of relative paths to the folders created for them, a directory
+        # is always walked before its contents.
+        folders = {
+            '': (parent, parent_type)
+        }
+        for entry in self._walk(ssh, path):
+            rel_path = entry['path']
+            (dir_path, name) = os.path.split(rel_path)
+            if dir_path not in folders:
+                # The parent directory wasn't listed, we couldn't read it
+                continue
+
+            (folder, folder_type) = folders[dir_path]
+            full_path = os.path.join(path, rel_path)
+            if stat.S_ISDIR(entry['mode']):
+                folders[rel_path] = (self.model('folder').createFolder(
+                    parent=folder, name=name, parentType=folder_type,
+                    creator=user, reuseExisting=True), 'folder')
+            else:
+                item = self.model('item').createItem(
+                    name=name, creator=user, folder=folder, reuseExisting=True)
+                file = self.model('file').createFile(
+                    name=name, creator=user, item=item, reuseExisting=True,
+                    assetstore=self.assetstore, mimeType=None,
+                    size=entry['size'])
+                file['imported'] = True
+                file['path'] = full_path
+                self.model('file').save(file)
 
     def importData(self, parent, parentType, params, progress, user, **kwargs):
         import_path = params.get('importPath', '').strip()
@@ -27,6 +27,9 @@ from girder.constants import SettingKey
 from girder.constants import AssetstoreType, AccessType
 from girder.api.docs import addModel
 
+from cumulus.common.download_cache import get_download_cache
+from cumulus.common.girder import create_imported_files
+
 class SftpAssetstoreResource(Resource):
     def __init__(self):
         super(SftpAssetstoreResource, self).__init__()
@@ -34,6 +37,8 @@ class SftpAssetstoreResource(Resource):
 
         self.route('POST', (), self.create_assetstore)
         self.route('POST', (':id', 'files'), self.create_file)
+        self.route('POST', (':id', 'files', 'bulk'), self.create_files)
+        self.route('GET', ('cache',), self.cache_stats)
 
     @access.user
     def create_assetstore(self, params):
@@ -123,7 +128,53 @@ class SftpAssetstoreResource(Resource):
         .param('body', 'The parameter to create the file with.', required=True,
                paramType='body', dataType='CreateFileParams'))
 
+    @access.user
+    @loadmodel(model='assetstore')
+    def create_files(self, assetstore, params):
+        params = getBodyJson()
+        self.requireParams(('parentId', 'files'), params)
+        user = self.getCurrentUser()
+
+        parent = self.model('folder').load(id=params['parentId'], user=user,
+                                           level=AccessType.WRITE, exc=True)
+
+        for entry in params['files']:
+            self.requireParams(('folder', 'name', 'size', 'path'), entry)
+
+        create_imported_files(user, assetstore, parent, params['files'])
+
+    addModel('CreateFilesParams', {
+        'id': 'CreateFilesParams',
+        'required': ['parentId', 'files'],
+        'properties': {
+            'parentId': {'type': 'string',
+                         'description': 'The folder to create the files in.'},
+            'files': {'type': 'array',
+                      'description': 'The files to create, each with the '
+                                     'folder path relative to the parent, '
+                                     'the name, size and full path of the '
+                                     'file and optionally its mimeType.'}
+            }
+        }, 'sftp')
+
+    create_files.description = (
+        Description('Create a batch of files in this assetstore, along with '
+                    'any folders and items they need.')
+        .param('id', 'The the assetstore to create the files in',
+               required=True, paramType='path')
+        .param('body', 'The files to create.', required=True,
+               paramType='body', dataType='CreateFilesParams'))
 
+    @access.admin
+    def cache_stats(self, params):
+        cache = get_download_cache()
+        if cache is None:
+            return {'enabled': False}
 
+        stats = cache.stats()
+        stats['enabled'] = True
 
+        return stats
 
+    cache_stats.description = (
+        Description('Get the hit rate and size of the download cache.'))
@@ -103,3 +103,82 @@ class TaskTestCase(base.TestCase):
         self.assertEqual(notifications[0]['type'], 'taskflow.status', 'Expecting a message with type \'taskflow.status\'')
         self.assertEqual(notifications[1]['type'], 'task.status', 'Expecting a message with type \'task.status\'')
         self.assertEqual(notifications[2]['type'], 'task.log', 'Expecting a message with type \'task.log\'')
+
+    def test_task_counts(self):
+        task_ids = []
+        for celery_task_id in ['2016', '2017']:
+            r = self.request('/taskflows/%s/tasks' % self._taskflow['_id'],
+                             method='POST', type='application/json',
+                             body=json.dumps({
+                                 'celeryTaskId': celery_task_id,
+                                 'name': 'test_task'
+                             }), user=self._user)
+            self.assertStatus(r, 201)
+            task_ids.append(r.json['_id'])
+
+        def update_status(task_id, status):
+            r = self.request('/tasks/%s' % task_id, method='PATCH',
+                             type='application/json',
+                             body=json.dumps({'status': status}),
+                             user=self._user)
+            self.assertStatusOk(r)
+
+        def taskflow():
+            r = self.request('/taskflows/%s' % self._taskflow['_id'],
+                             method='GET', user=self._user)
+            self.assertStatusOk(r)
+
+            return r.json
+
+        self.assertEqual(taskflow()['taskCounts'], {'created': 2})
+
+        update_status(task_ids[0], 'running')
+        tf = taskflow()
+        self.assertEqual(tf['taskCounts'], {'created': 1, 'running': 1})
+        self.assertEqual(tf['status'], 'running')
+
+        update_status(task_ids[0], 'complete')
+        update_status(task_ids[1], 'running')
+        update_status(task_ids[1], 'complete')
+        tf = taskflow()
+        self.assertEqual(tf['taskCounts'],
+                         {'created': 0, 'running': 0, 'complete': 2})
+        self.assertEqual(tf['status'], 'complete')
+
+        # Counts are rebuilt for taskflows that don't have them
+        model = self.model('taskflow', 'taskflow')
+        model.update({'_id': tf['_id']}, {'$unset': {'taskCounts': ''}})
+        doc = model.load(tf['_id'], force=True)
+        self.assertEqual(model.status(self._user, doc), 'complete')
+        self.assertEqual(taskflow()['taskCounts'], {'complete': 2})
+
+        # A task added to a taskflow without counts doesn't leave a partial
+        # count
+        model.update({'_id': tf['_id']}, {'$unset': {'taskCounts': ''}})
+        r = self.request('/taskflows/%s/tasks' % tf['_id'], method='POST',
+                         type='application/json',
+                         body=json.dumps({
+                             'celeryTaskId': '2018',
+                             'name': 'test_task'
+                         }),
+                         user=self._user)
+        self.assertStatus(r, 201)
+        legacy_task_id = r.json['_id']
+        self.assertEqual(taskflow()['taskCounts'],
+                         {'created': 1, 'complete': 2})
+
+        # Neither does a task changing state
+        model.update({'_id': tf['_id']}, {'$unset': {'taskCounts': ''}})
+        update_status(legacy_task_id, 'running')
+        tf = taskflow()
+        self.assertEqual(tf['taskCounts'], {'running': 1, 'complete': 2})
+        self.assertEqual(tf['status'], 'running')
+
+        # The counts can be repaired
+        model.update({'_id': tf['_id']}, {'$set': {'taskCounts.running': 5}})
+        r = self.request('/taskflows/%s/taskcounts' % tf['_id'], method='PUT',
+                         user=self._user)
+        self.assertStatusOk(r)
+        self.assertEqual(r.json['taskCounts'], {'running': 1, 'complete': 2})
+        self.assertEqual(taskflow()['taskCounts'],
+                         {'running': 1, 'complete': 2})
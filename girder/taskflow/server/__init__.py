@@ -17,6 +17,8 @@
 #  limitations under the License.
 ###############################################################################
 
+from girder.utility.model_importer import ModelImporter
+
 from .tasks import Tasks
 from .taskflows import TaskFlows
 
@@ -24,3 +26,9 @@ from .taskflows import TaskFlows
 def load(info):
     info['apiRoot'].tasks = Tasks()
     info['apiRoot'].taskflows = TaskFlows()
+
+    # Move any log records embedded in documents into the log collection
+    log_model = ModelImporter.model('log', 'taskflow')
+    for resource_type in ['taskflow', 'task']:
+        log_model.migrate(resource_type,
+                          ModelImporter.model(resource_type, 'taskflow'))
@@ -17,12 +17,13 @@
 #  limitations under the License.
 ###############################################################################
 import datetime
+from pymongo import ReturnDocument
 
 from girder.models.model_base import AccessControlledModel
 from girder.constants import AccessType
 
 from cumulus.common.girder import send_status_notification, \
-    send_log_notification
+    send_log_notification, to_log_records
 
 
 class Task(AccessControlledModel):
@@ -31,7 +32,7 @@ class Task(AccessControlledModel):
         self.name = 'tasks'
         self.ensureIndices(['taskFlowId', 'celeryTaskId'])
         self.exposeFields(level=AccessType.READ, fields=(
-            '_id', 'taskFlowId', 'status', 'log', 'name', 'created'))
+            '_id', 'taskFlowId', 'status', 'name', 'created'))
 
     def validate(self, doc):
         return doc
@@ -47,18 +48,24 @@ class Task(AccessControlledModel):
 
         task['taskFlowId'] = taskflow['_id']
         task['status'] = 'created'
-        task['log'] = []
         now = datetime.datetime.utcnow()
         task['created'] = now
 
         model = self.model('taskflow', 'taskflow')
 
         doc = self.setUserAccess(task, user, level=AccessType.ADMIN, save=True)
-        # increment the number of active tasks
+        # increment the number of active tasks and the number of tasks in the
+        # created state
         query = {
             '_id': taskflow['_id']
         }
-        model.increment(query, 'activeTaskCount', 1)
+        update = {
+            '$inc': {
+                'activeTaskCount': 1
+            }
+        }
+        model.update(query, update, multi=False)
+        model.task_state_changed(taskflow['_id'], None, task['status'])
 
         send_status_notification('task', doc)
 
@@ -106,30 +113,29 @@ class Task(AccessControlledModel):
 
     def append_to_log(self, task, log):
         """
-        Append a log entry the tasks log
+        Append a log entry, or a list of entries, the tasks log
         """
-        # This needs to be done in the database to prevent lost updates
-        query = {
-            '_id': task['_id']
-        }
-        update = {
-            '$push': {
-                'log': log
-            }
-        }
-        result = self.update(query, update, multi=False)
-        send_log_notification('task', task, log)
-        return result
+        records = to_log_records(log)
+        self.model('log', 'taskflow').append_many('task', task['_id'], records)
+        for record in records:
+            send_log_notification('task', task, record)
 
     def update_task(self, user, task, status=None):
         if status and task['status'] != status:
+            # Swap the status atomically so we know which state the task moved
+            # out of, even if it is being updated concurrently.
+            previous = self.collection.find_one_and_update(
+                {'_id': task['_id']}, {'$set': {'status': status}},
+                projection=['status'], return_document=ReturnDocument.BEFORE)
             task['status'] = status
-            task = self.save(task)
 
-            # Update the state of the parent taskflow
-            self.model('taskflow', 'taskflow').update_state(
-                user, task['taskFlowId'])
+            if previous['status'] != status:
+                # Update the state of the parent taskflow
+                taskflow_model = self.model('taskflow', 'taskflow')
+                taskflow_model.task_state_changed(
+                    task['taskFlowId'], previous['status'], status)
+                taskflow_model.update_state(user, task['taskFlowId'])
 
-            send_status_notification('task', task)
+                send_status_notification('task', task)
 
         return task
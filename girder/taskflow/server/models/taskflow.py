@@ -22,7 +22,7 @@ from girder.constants import AccessType
 
 from cumulus.taskflow import TaskFlowState, TaskState
 from cumulus.common.girder import send_status_notification, \
-    send_log_notification
+    send_log_notification, to_log_records
 import six
 
 from ..utility import to_object_id, merge_access, \
@@ -36,15 +36,15 @@ class Taskflow(AccessControlledModel):
     def initialize(self):
         self.name = 'taskflows'
         self.exposeFields(level=AccessType.READ, fields=(
-            '_id', 'status', 'log', 'activeTaskCount', 'taskFlowClass',
-            'meta'))
+            '_id', 'status', 'activeTaskCount', 'taskCounts',
+            'taskFlowClass', 'meta'))
 
     def validate(self, doc):
         return doc
 
     def create(self, user, taskflow):
         taskflow['status'] = TaskFlowState.CREATED
-        taskflow['log'] = []
+        taskflow['taskCounts'] = {}
 
         taskflow = self.setUserAccess(
             taskflow, user, level=AccessType.ADMIN, save=True)
@@ -121,21 +121,13 @@ class Taskflow(AccessControlledModel):
 
     def append_to_log(self, taskflow, log):
         """
-        Append a log entry to the taskflows log
+        Append a log entry, or a list of entries, to the taskflows log
         """
-        # This needs to be done in the database to prevent lost updates
-        query = {
-            '_id': taskflow['_id']
-        }
-        update = {
-            '$push': {
-                'log': log
-            }
-        }
-
-        result = self.update(query, update, multi=False)
-        send_log_notification('taskflow', taskflow, log)
-        return result
+        records = to_log_records(log)
+        self.model('log', 'taskflow').append_many(
+            'taskflow', taskflow['_id'], records)
+        for record in records:
+            send_log_notification('taskflow', taskflow, record)
 
     def _to_paths(self, d, path=''):
         """
@@ -197,9 +189,62 @@ class Taskflow(AccessControlledModel):
             'taskFlowId': taskflow['_id']
         }
 
-        self.model('task', 'taskflow').removeWithQuery(query)
+        task_model = self.model('task', 'taskflow')
+        log_model = self.model('log', 'taskflow')
+        log_model.remove_many_records(
+            'task', [task['_id'] for task in task_model.find(query,
+                                                             fields=['_id'])])
+
+        task_model.removeWithQuery(query)
+        log_model.remove_records('taskflow', taskflow['_id'])
         self.remove(taskflow)
 
+    def task_state_changed(self, taskflow_id, old_status, new_status):
+        """
+        Move a task between the per state task counts of a taskflow. The
+        task must already have been saved with its new status.
+
+        :param taskflow_id: The id of the taskflow the task belongs to.
+        :param old_status: The status the task had, None for a new task.
+        :param new_status: The status the task now has.
+        """
+        inc = {
+            'taskCounts.%s' % new_status: 1
+        }
+        if old_status is not None:
+            inc['taskCounts.%s' % old_status] = -1
+
+        # Only increment existing counts, a taskflow created before the
+        # counts were maintained would otherwise be left with a partial
+        # count. Such taskflows are recounted instead, the recount includes
+        # this change.
+        query = {
+            '_id': taskflow_id,
+            'taskCounts': {'$exists': True}
+        }
+        result = self.collection.update_one(query, {'$inc': inc})
+        if result.matched_count == 0:
+            self.rebuild_task_counts({'_id': taskflow_id})
+
+    def rebuild_task_counts(self, taskflow):
+        """
+        Recount the tasks of a taskflow in each state. Used for taskflows
+        created before the counts were maintained, or to repair the counts.
+        """
+        pipeline = [{
+            '$match': {'taskFlowId': taskflow['_id']}
+        }, {
+            '$group': {'_id': '$status', 'count': {'$sum': 1}}
+        }]
+        tasks = self.model('task', 'taskflow').collection
+        counts = {r['_id']: r['count'] for r in tasks.aggregate(pipeline)}
+
+        self.update({'_id': taskflow['_id']},
+                    {'$set': {'taskCounts': counts}}, multi=False)
+        taskflow['taskCounts'] = counts
+
+        return taskflow
+
     def status(self, user, taskflow):
         """
         Utility function to extract the status.
@@ -215,11 +260,11 @@ class Taskflow(AccessControlledModel):
                                       TaskFlowState.DELETING]:
                 return taskflow['status']
 
-        tasks = self.model('task', 'taskflow').find_by_taskflow_id(
-            user, taskflow['_id'])
+        if 'taskCounts' not in taskflow:
+            taskflow = self.rebuild_task_counts(taskflow)
 
-        task_status = [t['status'] for t in tasks]
-        task_status = set(task_status)
+        task_status = {status for (status, count)
+                       in six.iteritems(taskflow['taskCounts']) if count > 0}
 
         status = TaskFlowState.CREATED
         if len(task_status) == 1:
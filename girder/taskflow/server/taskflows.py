@@ -33,6 +33,7 @@ import sys
 from bson.objectid import ObjectId
 
 from cumulus.taskflow import load_class, TaskFlowState
+from cumulus.common.girder import log_response
 import cumulus
 
 logger = logging.getLogger('girder')
@@ -61,6 +62,7 @@ class TaskFlows(Resource):
         self.route('PUT', (':id', 'tasks', ':taskId', 'finished'),
                    self.task_finished)
         self.route('GET', (':id', 'log'), self.get_log)
+        self.route('PUT', (':id', 'taskcounts'), self.rebuild_task_counts)
 
         self._model = self.model('taskflow', 'taskflow')
 
@@ -127,7 +129,8 @@ class TaskFlows(Resource):
     )
     def update(self, taskflow, params):
         user = self.getCurrentUser()
-        immutable = ['access', '_id', 'taskFlowClass', 'log', 'activeTaskCount']
+        immutable = ['access', '_id', 'taskFlowClass', 'log', 'activeTaskCount',
+                     'taskCounts']
         updates = getBodyJson()
         if not updates:
             raise RestException('A body must be provided', code=400)
@@ -365,6 +368,19 @@ class TaskFlows(Resource):
         return self._model.collection.find_one_and_update(
             query, update, return_document=ReturnDocument.AFTER)
 
+    @access.user
+    @filtermodel(model='taskflow', plugin='taskflow')
+    @loadmodel(model='taskflow', plugin='taskflow', level=AccessType.ADMIN)
+    @describeRoute(
+        Description('Recount the tasks of a taskflow in each state')
+        .param(
+            'id',
+            'The id of taskflow',
+            required=True, paramType='path')
+    )
+    def rebuild_task_counts(self, taskflow, params):
+        return self._model.rebuild_task_counts(taskflow)
+
     @access.token
     @loadmodel(model='taskflow', plugin='taskflow', level=AccessType.ADMIN)
     @describeRoute(None)
@@ -382,13 +398,23 @@ class TaskFlows(Resource):
             'offset',
             'A offset in to the log.', required=False,
             paramType='query')
+        .param(
+            'limit',
+            'The maximum number of entries to return, if provided the '
+            'response includes the cursor for the next page.',
+            required=False, paramType='query')
+        .param(
+            'after',
+            'Cursor, only return entries after this one.', required=False,
+            paramType='query')
+        .param(
+            'level',
+            'Only return entries with at least this level, for example '
+            'WARNING.', required=False, paramType='query')
     )
     def get_log(self, taskflow, params):
-        offset = 0
-        if 'offset' in params:
-            offset = int(params['offset'])
-
-        return {'log': taskflow['log'][offset:]}
+        return log_response(self.model('log', 'taskflow'), 'taskflow',
+                            taskflow['_id'], params)
 
     addModel('ShareProperties', {
         'id': 'ShareProperties',
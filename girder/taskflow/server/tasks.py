@@ -27,6 +27,8 @@ from girder.api import access
 from girder.api.describe import Description, describeRoute
 from girder.constants import AccessType
 
+from cumulus.common.girder import log_response
+
 
 class Tasks(Resource):
 
@@ -111,10 +113,20 @@ class Tasks(Resource):
         .param('id', 'The task to get log entries for.', paramType='path')
         .param('offset', 'A offset in to the log.', required=False,
                paramType='query')
+        .param(
+            'limit',
+            'The maximum number of entries to return, if provided the '
+            'response includes the cursor for the next page.',
+            required=False, paramType='query')
+        .param(
+            'after',
+            'Cursor, only return entries after this one.', required=False,
+            paramType='query')
+        .param(
+            'level',
+            'Only return entries with at least this level, for example '
+            'WARNING.', required=False, paramType='query')
     )
     def get_log(self, task, params):
-        offset = 0
-        if 'offset' in params:
-            offset = int(params['offset'])
-
-        return {'log': task['log'][offset:]}
+        return log_response(self.model('log', 'taskflow'), 'task',
+                            task['_id'], params)
@@ -86,7 +86,13 @@ class AnsibleRunTestCase(unittest.TestCase):
         with open(self.requests_file, "rb") as fh:
             contents = fh.read().decode('utf8')
 
-        return [json.loads(l) for l in contents.split("\n") if l != '']
+        # Records are POSTed in batches
+        records = []
+        for line in contents.split("\n"):
+            if line != '':
+                records += json.loads(line)
+
+        return records
 
     def test_run(self):
         sources = self.run_playbook("test_run_playbook.yml")
@@ -19,11 +19,13 @@
 
 import unittest
 
-from cumulus.testing import AssertCallsMixin
+from cumulus.testing import AssertCallsMixin, LogHandlerMixin
 
-class ClusterTestCase(AssertCallsMixin, unittest.TestCase):
+
+class ClusterTestCase(LogHandlerMixin, AssertCallsMixin, unittest.TestCase):
 
     def setUp(self):
+        super(ClusterTestCase, self).setUp()
         self._get_status_called  = False
         self._set_status_called  = False
 
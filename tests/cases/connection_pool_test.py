@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import unittest
+import mock
+
+from cumulus.transport.pool import DEFAULT_IDLE_TIMEOUT, SshConnectionPool, \
+    SshConnectionPoolException
+
+
+def _mock_client(active=True):
+    client = mock.MagicMock()
+    client.get_transport.return_value.is_active.return_value = active
+
+    return client
+
+
+class SshConnectionPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._pool = SshConnectionPool(max_connections_per_host=2,
+                                       idle_timeout=300,
+                                       acquire_timeout=0)
+        self._key = ('localhost', 22, 'bob', '/keys/bob', 1)
+
+    def test_reuse(self):
+        client = _mock_client()
+        connect = mock.Mock(return_value=client)
+
+        pooled = self._pool.acquire(self._key, connect)
+        self._pool.release(pooled)
+        pooled = self._pool.acquire(self._key, connect)
+
+        self.assertEqual(pooled.client, client)
+        self.assertEqual(connect.call_count, 1)
+
+    def test_inactive_not_reused(self):
+        client = _mock_client()
+        connect = mock.Mock(side_effect=[client, _mock_client()])
+
+        pooled = self._pool.acquire(self._key, connect)
+        self._pool.release(pooled)
+        client.get_transport.return_value.is_active.return_value = False
+        pooled = self._pool.acquire(self._key, connect)
+
+        self.assertNotEqual(pooled.client, client)
+        self.assertTrue(client.close.called)
+        self.assertEqual(connect.call_count, 2)
+
+    def test_discard(self):
+        client = _mock_client()
+        connect = mock.Mock(side_effect=[client, _mock_client()])
+
+        pooled = self._pool.acquire(self._key, connect)
+        self._pool.release(pooled, discard=True)
+        self._pool.acquire(self._key, connect)
+
+        self.assertTrue(client.close.called)
+        self.assertEqual(connect.call_count, 2)
+
+    def test_idle_eviction(self):
+        client = _mock_client()
+        connect = mock.Mock(side_effect=[client, _mock_client()])
+
+        pooled = self._pool.acquire(self._key, connect)
+        self._pool.release(pooled)
+        pooled.last_used -= 301
+        self._pool.acquire(self._key, connect)
+
+        self.assertTrue(client.close.called)
+        self.assertEqual(connect.call_count, 2)
+
+    def test_host_limit(self):
+        connect = mock.Mock(side_effect=lambda: _mock_client())
+
+        self._pool.acquire(self._key, connect)
+        self._pool.acquire(self._key, connect)
+
+        with self.assertRaises(SshConnectionPoolException):
+            self._pool.acquire(self._key, connect)
+
+        # A different host is not affected
+        self._pool.acquire(('otherhost', 22, 'bob', '/keys/bob', 1), connect)
+
+    def test_host_limit_evicts_other_key(self):
+        other_key = ('localhost', 22, 'bill', '/keys/bill', 1)
+        other_client = _mock_client()
+        connect = mock.Mock(side_effect=[other_client, _mock_client(),
+                                         _mock_client()])
+
+        pooled = self._pool.acquire(other_key, connect)
+        self._pool.acquire(self._key, connect)
+        self._pool.release(pooled)
+
+        # The idle connection for the other key should make way
+        self._pool.acquire(self._key, connect)
+        self.assertTrue(other_client.close.called)
+
+    def test_failed_connect(self):
+        connect = mock.Mock(side_effect=Exception('handshake failed'))
+
+        for _ in range(3):
+            with self.assertRaises(Exception):
+                self._pool.acquire(self._key, connect)
+
+        # Failed connects should not use up slots
+        connect = mock.Mock(side_effect=lambda: _mock_client())
+        self._pool.acquire(self._key, connect)
+        self._pool.acquire(self._key, connect)
+
+    def test_sftp_closed_with_connection(self):
+        client = _mock_client()
+        connect = mock.Mock(return_value=client)
+
+        pooled = self._pool.acquire(self._key, connect)
+        pooled.sftp = mock.MagicMock()
+        sftp = pooled.sftp
+        self._pool.release(pooled, discard=True)
+
+        self.assertTrue(sftp.close.called)
+        self.assertTrue(client.close.called)
+
+    def test_close_idle(self):
+        other_key = ('localhost', 22, 'bill', '/keys/bill', 1)
+        client = _mock_client()
+        other_client = _mock_client()
+        connect = mock.Mock(side_effect=[client, other_client])
+
+        self._pool.release(self._pool.acquire(self._key, connect))
+        self._pool.release(self._pool.acquire(other_key, connect))
+        self._pool.close_idle(lambda key: key[2] == 'bill')
+
+        self.assertTrue(other_client.close.called)
+        self.assertFalse(client.close.called)
+        self.assertEqual(self._pool.acquire(self._key, connect).client, client)
+
+    @mock.patch('cumulus.transport.pool.cumulus.config',
+                {'sftp': {'pool': {'maxConnectionsPerHost': 64}}})
+    def test_from_config(self):
+        pool = SshConnectionPool.from_config('sftp.pool', acquire_timeout=30)
+
+        self.assertEqual(pool.max_connections_per_host, 64)
+        self.assertEqual(pool.acquire_timeout, 30)
+        self.assertEqual(pool.idle_timeout, DEFAULT_IDLE_TIMEOUT)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from cumulus.common.download_cache import DownloadCache
+
+CONTENT = b''.join([bytes(bytearray([i % 256])) for i in range(100)])
+
+
+class DownloadCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._cache = DownloadCache(self._dir, max_size=1000, block_size=16)
+        self._fetches = []
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _fetch(self, start, end):
+        self._fetches.append((start, end))
+        # Return the range in uneven chunks
+        for i in range(start, end, 7):
+            yield CONTENT[i:min(i + 7, end)]
+
+    def _read(self, offset=0, end_byte=len(CONTENT), key=('a', '/f', 100, 1)):
+        return b''.join(self._cache.read(key, len(CONTENT), offset, end_byte,
+                                         self._fetch))
+
+    def test_read_through(self):
+        self.assertEqual(self._read(), CONTENT)
+        self.assertEqual(self._fetches, [(0, 100)])
+        self.assertEqual(self._read(), CONTENT)
+        self.assertEqual(self._fetches, [(0, 100)])
+
+        stats = self._cache.stats()
+        self.assertEqual(stats['misses'], 7)
+        self.assertEqual(stats['hits'], 7)
+        self.assertEqual(stats['hitRate'], 0.5)
+        self.assertEqual(stats['bytesFetched'], 100)
+        self.assertEqual(stats['bytesFromCache'], 100)
+
+    def test_ranges(self):
+        self.assertEqual(self._read(20, 40), CONTENT[20:40])
+        # Only the blocks covering the range are fetched
+        self.assertEqual(self._fetches, [(16, 48)])
+
+        self.assertEqual(self._read(10, 60), CONTENT[10:60])
+        # The cached blocks split the missing ones into two runs
+        self.assertEqual(self._fetches, [(16, 48), (0, 16), (48, 64)])
+
+        self.assertEqual(self._read(95, 200), CONTENT[95:])
+        self.assertEqual(self._read(100, 100), b'')
+
+    def test_key_change(self):
+        self._read()
+        self._read(key=('a', '/f', 100, 2))
+
+        self.assertEqual(self._fetches, [(0, 100), (0, 100)])
+
+    def test_short_fetch(self):
+        def fetch(start, end):
+            yield CONTENT[start:end - 1]
+
+        with self.assertRaises(IOError):
+            b''.join(self._cache.read(('a', '/f', 100, 1), 100, 0, 100, fetch))
+
+    def test_eviction(self):
+        self._cache.max_size = 250
+        self._read(key=('a', '/1', 100, 1))
+        self._read(key=('a', '/2', 100, 1))
+        # Make the second file the least recently used
+        entry = self._cache._entry_path(('a', '/2', 100, 1))
+        self._read(key=('a', '/1', 100, 1))
+        self._read(key=('a', '/3', 100, 1))
+
+        self.assertFalse(os.path.exists(entry))
+        self.assertTrue(os.path.exists(
+            self._cache._entry_path(('a', '/1', 100, 1))))
+        self.assertEqual(self._cache.stats()['evictions'], 1)
+        self.assertEqual(self._cache.stats()['size'], 200)
+
+    def test_index(self):
+        self._read(key=('a', '/1', 100, 1))
+        self._read(key=('a', '/2', 100, 1))
+        entry = self._cache._entry_path(('a', '/1', 100, 1))
+        os.utime(entry, (0, 0))
+
+        # The index is rebuilt from the directory, least recently used first
+        cache = DownloadCache(self._dir, max_size=150, block_size=16)
+        self.assertEqual(cache.stats()['size'], 200)
+        b''.join(cache.read(('a', '/3', 100, 1), 100, 0, 16, self._fetch))
+
+        self.assertFalse(os.path.exists(entry))
+        self.assertEqual(cache.stats()['size'], 116)
+
+    def test_block_filled_twice(self):
+        entry = self._cache._entry_path(('a', '/1', 100, 1))
+        self._cache._write_block(entry, 0, CONTENT[:16])
+        # Another reader filled the same block
+        self._cache._write_block(entry, 0, CONTENT[:16])
+
+        self.assertEqual(self._cache.stats()['size'], 16)
+        self.assertEqual(os.listdir(entry), ['0'])
@@ -4,34 +4,45 @@ import mock
 import json
 from jsonpath_rw import parse
 import stat
+import io
+import tarfile
 
 import cumulus
+from cumulus.transport.files.download import _PathImporter
 from cumulus.transport.files.download import download_path
 from cumulus.transport.files.download import _ensure_path
+from cumulus.testing import LogHandlerMixin
 
-class DownloadTestCase(unittest.TestCase):
+
+class DownloadTestCase(LogHandlerMixin, unittest.TestCase):
 
     def setUp(self):
+        super(DownloadTestCase, self).setUp()
         self._update = False
-        self._item_requests = []
         self._file_requests = []
-        self._folder_requests = []
 
     def test_import_path(self):
         file = {
                 'name': 'test.txt',
+                'path': 'test.txt',
                 'mode': 1,
                 'size': 123
         }
 
         folder = {
                   'name':  'folder',
+                  'path': 'folder',
                   'mode': stat.S_IFDIR,
                   'size': 1234
         }
 
+        nested_file = dict(file, path='folder/test.txt')
+
         cluster_connection = mock.MagicMock()
-        cluster_connection.list.side_effect = [[file, folder], [file]]
+        cluster_connection.walk.return_value = iter([file, folder,
+                                                     nested_file])
+        cluster_connection.transfer_channel.return_value.__enter__\
+            .return_value = cluster_connection
 
         girder_token = 'dummy'
         parent = {
@@ -40,86 +51,97 @@ class DownloadTestCase(unittest.TestCase):
         path = '/my/path'
         assetstore_id = 'dummy_id'
 
-        # Mock create item
-        def _create_item(url, request):
-            content = {
-                '_id': 'dummy'
-            }
-            content = json.dumps(content).encode('utf8')
-            headers = {
-                'content-length': len(content),
-                'content-type': 'application/json'
-            }
-
-            self._item_requests.append(request)
-
-            return httmock.response(200, content, headers, request=request)
-
-        item_url = '/api/v1/item'
-        create_item = httmock.urlmatch(
-            path=r'^%s$' % item_url, method='POST')(_create_item)
-
-        # Mock create file
-        def _create_file(url, request):
-            content = {
-                '_id': 'dummy'
-            }
-            content = json.dumps(content).encode('utf8')
-            headers = {
-                'content-length': len(content),
-                'content-type': 'application/json'
-            }
-
-            self._file_requests.append(request)
-
-            return httmock.response(200, content, headers, request=request)
-
-        file_url = '/api/v1/sftp_assetstores/%s/files' % assetstore_id
-        create_file = httmock.urlmatch(
-            path=r'^%s$' % file_url, method='POST')(_create_file)
-
-        # Mock create folder
-        def _create_folder(url, request):
-            content = {
-                '_id': 'dummy'
-            }
-            content = json.dumps(content).encode('utf8')
+        # Mock bulk file creation
+        def _create_files(url, request):
+            content = json.dumps({}).encode('utf8')
             headers = {
                 'content-length': len(content),
                 'content-type': 'application/json'
             }
 
-            self._folder_requests.append(request)
-
-            return httmock.response(200, content, headers, request=request)
-
-        folder_url = '/api/v1/folder'
-        create_folder = httmock.urlmatch(
-            path=r'^%s$' % folder_url, method='POST')(_create_folder)
-
-        # Mock list folder
-        def _list_folder(url, request):
-            content = []
-            content = json.dumps(content).encode('utf8')
-            headers = {
-                'content-length': len(content),
-                'content-type': 'application/json'
-            }
+            self._file_requests.append(json.loads(request.body))
 
             return httmock.response(200, content, headers, request=request)
 
-        folder_url = '/api/v1/folder'
-        list_folder = httmock.urlmatch(
-            path=r'^%s$' % folder_url, method='GET')(_list_folder)
+        file_url = '/api/v1/sftp_assetstores/%s/files/bulk' % assetstore_id
+        create_files = httmock.urlmatch(
+            path=r'^%s$' % file_url, method='POST')(_create_files)
 
-        with httmock.HTTMock(create_item, create_file, create_folder, list_folder):
+        with httmock.HTTMock(create_files):
             download_path(cluster_connection, girder_token, parent, path,
                 'sftp_assetstores', assetstore_id, upload=False)
 
+        # The tree is listed in one walk
+        cluster_connection.walk.assert_called_once_with('/my/path')
+        # Both files are created with a single request
+        self.assertEqual(len(self._file_requests), 1)
+        self.assertEqual(self._file_requests[0]['parentId'], parent)
+        files = sorted(self._file_requests[0]['files'],
+                       key=lambda f: f['folder'])
+        self.assertEqual(files, [{
+            'folder': '.',
+            'name': 'test.txt',
+            'size': 123,
+            'path': '/my/path/test.txt'
+        }, {
+            'folder': 'folder',
+            'name': 'test.txt',
+            'size': 123,
+            'path': '/my/path/folder/test.txt'
+        }])
+
+    @mock.patch('cumulus.transport.files.download.use_tar',
+                return_value=True)
+    def test_import_path_tar(self, _):
+        contents = {
+            'a.txt': b'a',
+            'dir/b.txt': b'bb',
+            'dir/excluded.txt': b'excluded'
+        }
+        stream = io.BytesIO()
+        with tarfile.open(fileobj=stream, mode='w') as tar:
+            for (name, content) in contents.items():
+                info = tarfile.TarInfo('./%s' % name)
+                info.size = len(content)
+                tar.addfile(info, io.BytesIO(content))
+        stream.seek(0)
 
-        self.assertEqual(len(self._item_requests), 2)
-        self.assertEqual(len(self._file_requests), 2)
-        self.assertEqual(len(self._folder_requests), 1)
+        cluster_connection = mock.MagicMock()
+        cluster_connection.walk.return_value = iter(
+            [{'path': 'dir', 'name': 'dir', 'mode': stat.S_IFDIR,
+              'size': 4096}] +
+            [{'path': name, 'name': name.split('/')[-1], 'mode': stat.S_IFREG,
+              'size': len(content)} for (name, content) in contents.items()])
+        cluster_connection.tar_reader.return_value.__enter__.return_value \
+            = stream
+
+        girder_client = mock.MagicMock()
+        girder_client.listFolder.return_value = iter([])
+        girder_client.createFolder.return_value = {'_id': 'dir_id'}
+        girder_client.createItem.side_effect \
+            = lambda folder_id, name, description: {'_id': name}
+        uploaded = {}
+
+        def upload_file(item_id, stream, name, size, parentType):
+            uploaded[name] = stream.read(size)
+
+        girder_client.uploadFile.side_effect = upload_file
+
+        importer = _PathImporter(cluster_connection, girder_client,
+                                 'parent_id', '/my/path', 'sftp_assetstores',
+                                 'assetstore_id', upload=True,
+                                 exclude=['.*excluded'])
+        importer.run()
+
+        cluster_connection.tar_reader.assert_called_once_with(
+            '/my/path', compress=False)
+        self.assertFalse(cluster_connection.get.called)
+        self.assertEqual(uploaded, {
+            'a.txt': b'a',
+            'b.txt': b'bb'
+        })
+        girder_client.createFolder.assert_called_once_with(
+            'parent_id', 'dir', parentType='folder')
 
     def test_ensure_path(self):
         girder_client = mock.MagicMock()
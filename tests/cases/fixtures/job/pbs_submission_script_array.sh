@@ -0,0 +1,17 @@
+#!/bin/sh
+#                             _
+#                            | |
+#   ___ _   _ _ __ ___  _   _| |_   _ ___
+#  / __| | | | '_ ` _ \| | | | | | | / __|
+# | (__| |_| | | | | | | |_| | | |_| \__ \
+#  \___|\__,_|_| |_| |_|\__,_|_|\__,_|___/
+#
+#
+#PBS -N dummy-123432423
+#PBS -t 0,3,6
+cd $PBS_O_WORKDIR
+export CUMULUS_ARRAY_INDEX=$PBS_ARRAYID
+
+ls
+sleep 20
+mpirun -n 1000000 parallel $CUMULUS_ARRAY_INDEX
@@ -0,0 +1,20 @@
+#!/bin/sh
+#                             _
+#                            | |
+#   ___ _   _ _ __ ___  _   _| |_   _ ___
+#  / __| | | | '_ ` _ \| | | | | | | / __|
+# | (__| |_| | | | | | | |_| | | |_| \__ \
+#  \___|\__,_|_| |_| |_|\__,_|_|\__,_|___/
+#
+
+#
+#$ -S /bin/bash
+#$ -N dummy-123432423
+#$ -t 1-99:2
+#$ -tc 5
+cd $SGE_O_WORKDIR
+export CUMULUS_ARRAY_INDEX=$SGE_TASK_ID
+
+ls
+sleep 20
+mpirun -n 1000000 parallel $CUMULUS_ARRAY_INDEX
@@ -0,0 +1,20 @@
+#!/bin/sh
+#                             _
+#                            | |
+#   ___ _   _ _ __ ___  _   _| |_   _ ___
+#  / __| | | | '_ ` _ \| | | | | | | / __|
+# | (__| |_| | | | | | | |_| | | |_| \__ \
+#  \___|\__,_|_| |_| |_|\__,_|_|\__,_|___/
+#
+#
+#SBATCH --job-name=dummy-123432423
+#SBATCH --output=dummy-123432423.o%A_%a
+#SBATCH --error=dummy-123432423.e%A_%a
+#SBATCH --workdir=
+#SBATCH --array=0-99%10
+#SBATCH --unbuffered
+export CUMULUS_ARRAY_INDEX=$SLURM_ARRAY_TASK_ID
+
+ls
+sleep 20
+mpirun -n 1000000 parallel $CUMULUS_ARRAY_INDEX
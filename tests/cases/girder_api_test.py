@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import unittest
+import mock
+from httmock import urlmatch, HTTMock
+
+from cumulus.common.api import GirderApi
+
+
+class GirderApiTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._api = GirderApi()
+        self._tokens = []
+
+        @urlmatch(netloc=r'localhost', path='/api/v1/jobs/123')
+        def job(url, request):
+            self._tokens.append(request.headers.get('Girder-Token'))
+
+            return {
+                'status_code': 200,
+                'content': {'_id': '123'},
+                'headers': {'content-type': 'application/json'}
+            }
+
+        self._mock = HTTMock(job)
+        self._mock.__enter__()
+
+    def tearDown(self):
+        self._mock.__exit__(None, None, None)
+
+    def test_token_per_call(self):
+        url = 'http://localhost/api/v1/jobs/123'
+        r = self._api.get(url, girder_token='bob')
+        self.assertEqual(r.json(), {'_id': '123'})
+        self._api.patch(url, headers={'Girder-Token': 'bill'}, json={})
+        self._api.get(url)
+
+        self.assertEqual(self._tokens, ['bob', 'bill', None])
+        self.assertNotIn('Girder-Token', self._api.session.headers)
+
+    def test_session_reused(self):
+        session = self._api.session
+        self.assertIs(self._api.session, session)
+
+        client = self._api.girder_client('bob', 'http://localhost/api/v1')
+        self.assertIs(client._session, session)
+        client.get('jobs/123')
+        self.assertEqual(self._tokens, ['bob'])
+
+    def test_new_session_after_fork(self):
+        session = self._api.session
+
+        with mock.patch('cumulus.common.api.os.getpid', return_value=-1):
+            self.assertIsNot(self._api.session, session)
+
+    def test_retry_policy(self):
+        retry = self._api.session.get_adapter('http://localhost').max_retries
+
+        self.assertTrue(retry.is_retry('GET', 503))
+        self.assertTrue(retry.is_retry('PATCH', 502))
+        # Some of our PUTs are not idempotent
+        self.assertFalse(retry.is_retry('PUT', 503))
+        self.assertFalse(retry.is_retry('POST', 503))
@@ -0,0 +1,378 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import unittest
+import httmock
+import mock
+import json
+import os
+import shutil
+import stat
+import tempfile
+from six.moves.urllib.parse import parse_qsl
+
+from cumulus.girderclient import JobInputDownloader, DirectoryUploader, \
+    InputCache, upload_journal
+
+
+class JobInputDownloaderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._dest = tempfile.mkdtemp()
+        self._base_url = 'http://localhost/api/v1'
+        self._files = {
+            'file1': {
+                '_id': 'file1',
+                'name': 'a.txt',
+                'size': 10
+            },
+            'file2': {
+                '_id': 'file2',
+                'name': 'b.txt',
+                'size': 5
+            }
+        }
+        self._contents = {
+            'file1': b'0123456789',
+            'file2': b'abcde'
+        }
+        self._ranges = {}
+        self._downloads = []
+        self._updates = []
+
+    def tearDown(self):
+        shutil.rmtree(self._dest)
+
+    def _json(self, request, body):
+        content = json.dumps(body).encode('utf8')
+        headers = {
+            'content-length': len(content),
+            'content-type': 'application/json'
+        }
+
+        return httmock.response(200, content, headers, request=request)
+
+    def _mocks(self):
+        @httmock.urlmatch(path=r'^/api/v1/jobs/job1$', method='GET')
+        def get_job(url, request):
+            return self._json(request, {
+                'input': [{
+                    'itemId': 'item1',
+                    'path': 'input'
+                }]
+            })
+
+        @httmock.urlmatch(path=r'^/api/v1/jobs/job1$', method='PATCH')
+        def patch_job(url, request):
+            self._updates.append(json.loads(request.body.decode('utf8')))
+            return self._json(request, {})
+
+        @httmock.urlmatch(path=r'^/api/v1/item/item1/files$', method='GET')
+        def item_files(url, request):
+            return self._json(request, list(self._files.values()))
+
+        @httmock.urlmatch(path=r'^/api/v1/file/([^/]+)/download$',
+                          method='GET')
+        def download(url, request):
+            file_id = url.path.split('/')[-2]
+            self._downloads.append(file_id)
+            content = self._contents[file_id]
+            range = request.headers.get('Range')
+            self._ranges[file_id] = range
+            status = 200
+            if range:
+                start = int(range[len('bytes='):-1])
+                content = content[start:]
+                status = 206
+
+            headers = {
+                'content-length': len(content),
+                'content-type': 'application/octet-stream'
+            }
+
+            return httmock.response(status, content, headers, request=request)
+
+        return (get_job, patch_job, item_files, download)
+
+    def _read(self, name):
+        with open(os.path.join(self._dest, 'input', name), 'rb') as fp:
+            return fp.read()
+
+    def test_download(self):
+        downloader = JobInputDownloader('token', self._base_url, 'job1',
+                                        self._dest, max_workers=2)
+        with httmock.HTTMock(*self._mocks()):
+            downloader.run()
+
+        self.assertEqual(self._read('a.txt'), self._contents['file1'])
+        self.assertEqual(self._read('b.txt'), self._contents['file2'])
+        self.assertEqual(sorted(os.listdir(os.path.join(self._dest, 'input'))),
+                         ['a.txt', 'b.txt'])
+        self.assertEqual(len(self._updates), 1)
+        self.assertTrue('download' in self._updates[0]['timings'])
+
+    def test_resume(self):
+        input_dir = os.path.join(self._dest, 'input')
+        os.makedirs(input_dir)
+        # A partial download of the first file
+        with open(os.path.join(input_dir, 'a.txt.part'), 'wb') as fp:
+            fp.write(b'01234')
+        # The second file is complete
+        with open(os.path.join(input_dir, 'b.txt'), 'wb') as fp:
+            fp.write(self._contents['file2'])
+
+        downloader = JobInputDownloader('token', self._base_url, 'job1',
+                                        self._dest)
+        with httmock.HTTMock(*self._mocks()):
+            downloader.run()
+
+        self.assertEqual(self._downloads, ['file1'])
+        self.assertEqual(self._ranges['file1'], 'bytes=5-')
+        self.assertEqual(self._read('a.txt'), self._contents['file1'])
+        self.assertFalse(os.path.exists(os.path.join(input_dir, 'a.txt.part')))
+
+    def test_cache(self):
+        self._files['file1']['sha512'] = 'sha1'
+        cache_dir = os.path.join(self._dest, 'cache')
+
+        for job in ['job1', 'job2']:
+            cache = InputCache(cache_dir, 1024)
+            downloader = JobInputDownloader('token', self._base_url, 'job1',
+                                            os.path.join(self._dest, job),
+                                            cache=cache)
+            with httmock.HTTMock(*self._mocks()):
+                downloader.run()
+
+        # The second job's copy of the first file came from the cache
+        self.assertEqual(sorted(self._downloads),
+                         ['file1', 'file2', 'file2'])
+        self.assertEqual(cache.stats(), {
+            'hits': 1,
+            'misses': 0,
+            'bytesSaved': 10,
+            'evicted': 0
+        })
+        self.assertEqual(self._updates[-1]['timings']['downloadCache'],
+                         cache.stats())
+        job1_file = os.path.join(self._dest, 'job1', 'input', 'a.txt')
+        job2_file = os.path.join(self._dest, 'job2', 'input', 'a.txt')
+        blob = os.path.join(cache_dir, 'blobs', 'sha1')
+        self.assertTrue(os.path.samefile(job1_file, blob))
+        self.assertTrue(os.path.samefile(job2_file, blob))
+        # The cached content is read-only
+        self.assertFalse(os.stat(blob).st_mode &
+                         (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+    def test_cache_evict(self):
+        cache_dir = os.path.join(self._dest, 'cache')
+        cache = InputCache(cache_dir, 20)
+        for (name, mtime) in [('linked', 0), ('old', 1), ('new', 2)]:
+            path = os.path.join(cache_dir, 'blobs', name)
+            with open(path, 'wb') as fp:
+                fp.write(b'0123456789')
+            os.utime(path, (mtime, mtime))
+        # Still linked into a job directory, so kept
+        os.link(os.path.join(cache_dir, 'blobs', 'linked'),
+                os.path.join(self._dest, 'linked'))
+
+        cache.evict()
+
+        self.assertEqual(sorted(os.listdir(os.path.join(cache_dir, 'blobs'))),
+                         ['linked', 'new'])
+        self.assertEqual(cache.evicted, 1)
+
+    def test_cache_evict_symbolic(self):
+        cache_dir = os.path.join(self._dest, 'cache')
+        cache = InputCache(cache_dir, 0, link='symbolic')
+        with open(os.path.join(cache_dir, 'blobs', 'old'), 'wb') as fp:
+            fp.write(b'0123456789')
+
+        cache.evict()
+
+        self.assertEqual(os.listdir(os.path.join(cache_dir, 'blobs')),
+                         ['old'])
+        self.assertEqual(cache.evicted, 0)
+
+    def test_incomplete(self):
+        self._contents['file2'] = b'abc'
+
+        downloader = JobInputDownloader('token', self._base_url, 'job1',
+                                        self._dest)
+        with httmock.HTTMock(*self._mocks()):
+            with self.assertRaises(Exception):
+                downloader.run()
+
+        # The partial file is kept so the download can be resumed
+        self.assertTrue(os.path.exists(
+            os.path.join(self._dest, 'input', 'b.txt.part')))
+
+
+class DirectoryUploaderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._dir = tempfile.mkdtemp()
+        os.chdir(self._dir)
+        os.makedirs('output')
+        with open(os.path.join('output', 'a.txt'), 'wb') as fp:
+            fp.write(b'0123456789')
+        with open(os.path.join('output', 'b.txt'), 'wb') as fp:
+            fp.write(b'abcde')
+
+        self._base_url = 'http://localhost/api/v1'
+        self._uploads = {}
+        self._chunks = []
+        self._updates = []
+        self._offsets = {}
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        shutil.rmtree(self._dir)
+
+    def _json(self, request, body, status=200):
+        content = json.dumps(body).encode('utf8')
+        headers = {
+            'content-length': len(content),
+            'content-type': 'application/json'
+        }
+
+        return httmock.response(status, content, headers, request=request)
+
+    def _mocks(self):
+        @httmock.urlmatch(path=r'^/api/v1/jobs/job1$', method='GET')
+        def get_job(url, request):
+            return self._json(request, {
+                'output': [{
+                    'itemId': 'item1',
+                    'path': 'output',
+                    'exclude': '^output/excluded'
+                }]
+            })
+
+        @httmock.urlmatch(path=r'^/api/v1/jobs/job1$', method='PATCH')
+        def patch_job(url, request):
+            self._updates.append(json.loads(request.body.decode('utf8')))
+            return self._json(request, {})
+
+        @httmock.urlmatch(path=r'^/api/v1/file$', method='POST')
+        def init_upload(url, request):
+            params = dict(parse_qsl(url.query))
+            upload_id = 'upload_%s' % params['name']
+            self._uploads[upload_id] = params
+
+            return self._json(request, {'_id': upload_id})
+
+        @httmock.urlmatch(path=r'^/api/v1/file/chunk$', method='POST')
+        def chunk(url, request):
+            params = dict(parse_qsl(url.query))
+            body = request.body
+            if hasattr(body, 'read'):
+                body = body.read()
+            self._chunks.append((params['uploadId'], int(params['offset']),
+                                 body))
+
+            return self._json(request, {'_id': params['uploadId']})
+
+        @httmock.urlmatch(path=r'^/api/v1/file/offset$', method='GET')
+        def offset(url, request):
+            params = dict(parse_qsl(url.query))
+            if params['uploadId'] not in self._offsets:
+                return self._json(request, {'message': 'Not found'}, 400)
+
+            return self._json(request, {
+                'offset': self._offsets[params['uploadId']]
+            })
+
+        return (get_job, patch_job, init_upload, chunk, offset)
+
+    def _data(self, upload_id):
+        return b''.join(c[2] for c in sorted(self._chunks)
+                        if c[0] == upload_id)
+
+    @mock.patch('cumulus.girderclient.max_chunk_size', 4)
+    def test_upload(self):
+        with open(os.path.join('output', 'excluded.txt'), 'wb') as fp:
+            fp.write(b'excluded')
+
+        uploader = DirectoryUploader('token', self._base_url, 'job1',
+                                     max_workers=2)
+        with httmock.HTTMock(*self._mocks()):
+            uploader.run()
+
+        self.assertEqual(sorted(self._uploads.keys()),
+                         ['upload_output/a.txt', 'upload_output/b.txt'])
+        self.assertEqual(self._data('upload_output/a.txt'), b'0123456789')
+        self.assertEqual(self._data('upload_output/b.txt'), b'abcde')
+        # 3 chunks for a.txt and 2 for b.txt
+        self.assertEqual(len(self._chunks), 5)
+
+        self.assertEqual(len(self._updates), 1)
+        timings = self._updates[0]['timings']
+        self.assertTrue('upload' in timings)
+        files = sorted(timings['uploadFiles'], key=lambda f: f['path'])
+        self.assertEqual([(f['path'], f['size']) for f in files],
+                         [('output/a.txt', 10), ('output/b.txt', 5)])
+        self.assertTrue(all('throughput' in f for f in files))
+
+        # The journal is removed once everything is uploaded
+        self.assertFalse(os.path.exists(upload_journal))
+
+    @mock.patch('cumulus.girderclient.max_chunk_size', 4)
+    def test_resume(self):
+        def state(path, **kwargs):
+            s = os.stat(path)
+            return dict(parentId='item1', size=s.st_size, mtime=s.st_mtime,
+                        **kwargs)
+
+        a = os.path.abspath(os.path.join('output', 'a.txt'))
+        b = os.path.abspath(os.path.join('output', 'b.txt'))
+        with open(upload_journal, 'w') as fp:
+            for entry in [[a, state(a)],
+                          [a, state(a, uploadId='upload1')],
+                          [b, state(b, uploadId='upload2')],
+                          [b, state(b, complete=True)]]:
+                fp.write('%s\n' % json.dumps(entry))
+            # Interrupted while writing an update
+            fp.write('["%s", {"par' % a)
+        self._offsets['upload1'] = 4
+
+        uploader = DirectoryUploader('token', self._base_url, 'job1')
+        with httmock.HTTMock(*self._mocks()):
+            uploader.run()
+
+        # a.txt is resumed, b.txt is already uploaded
+        self.assertEqual(self._uploads, {})
+        self.assertEqual([(c[0], c[1]) for c in sorted(self._chunks)],
+                         [('upload1', 4), ('upload1', 8)])
+        self.assertEqual(self._data('upload1'), b'456789')
+
+    def test_journal(self):
+        with open(upload_journal, 'w') as fp:
+            fp.write('["a", {"size": 1}]\n["a", {"size": 2}]\n["b", {"si')
+
+        uploader = DirectoryUploader('token', self._base_url, 'job1')
+        uploader._load_journal()
+        uploader._open_journal()
+        uploader._update_journal('b', {'size': 3})
+        uploader._journal_file.close()
+
+        # The half written line is dropped and updates are appended
+        with open(upload_journal) as fp:
+            lines = [json.loads(line) for line in fp]
+        self.assertEqual(lines, [['a', {'size': 2}], ['b', {'size': 3}]])
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import unittest
+import mock
+
+from cumulus.transport.files.cache import InputCache, input_cache_config
+
+
+class InputCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._blobs = set()
+        self._commands = []
+        self._find_output = []
+        self._connection = mock.MagicMock()
+        self._connection.execute.side_effect = self._execute
+
+    def _execute(self, command, ignore_exit_status=False,
+                 source_profile=True):
+        self._commands.append(command)
+        if command.startswith('find '):
+            return self._find_output
+        elif command.startswith('ln -f /cache/blobs/'):
+            sha512 = command.split()[2].split('/')[-1]
+            if sha512 not in self._blobs:
+                raise Exception('No such file')
+        elif command.startswith('ln -f '):
+            sha512 = command.split()[-1].split('/')[-1]
+            self._blobs.add(sha512)
+
+        return []
+
+    def test_config(self):
+        self.assertIsNone(input_cache_config({'config': {}}))
+        config = input_cache_config({
+            'config': {
+                'inputCache': {
+                    'path': '/cache'
+                }
+            }
+        })
+        self.assertEqual(config['path'], '/cache')
+        self.assertEqual(config['link'], 'hard')
+        self.assertTrue(config['maxSize'] > 0)
+
+    def test_stage(self):
+        cache = InputCache('/cache', max_size=1000)
+        cache.setup(self._connection)
+        self._connection.makedirs.assert_called_once_with('/cache/blobs')
+
+        transfer = mock.Mock()
+        file = {'name': 'in.dat', 'size': 100, 'sha512': 'abc'}
+
+        # Miss, the file is transferred then added to the cache
+        self.assertFalse(cache.stage(self._connection, file, '/job1/in.dat',
+                                     transfer))
+        self.assertEqual(transfer.call_count, 1)
+        self.assertEqual(self._blobs, set(['abc']))
+        # The cached content is read-only
+        self.assertIn('chmod a-w /cache/blobs/abc.', self._commands[-1])
+
+        # Hit, the file is linked from the cache
+        self.assertTrue(cache.stage(self._connection, file, '/job2/in.dat',
+                                    transfer))
+        self.assertEqual(transfer.call_count, 1)
+        self.assertEqual(self._commands[-1],
+                         'ln -f /cache/blobs/abc /job2/in.dat && '
+                         'touch -c /cache/blobs/abc')
+
+        # No sha512, always transferred
+        cache.stage(self._connection, {'name': 'x', 'size': 1}, '/job2/x',
+                    transfer)
+        self.assertEqual(transfer.call_count, 2)
+
+        self.assertEqual(cache.stats(), {
+            'hits': 1,
+            'misses': 1,
+            'bytesSaved': 100,
+            'evicted': 0
+        })
+
+    def test_evict(self):
+        cache = InputCache('/cache', max_size=350)
+        self._find_output = [
+            'old 100 1.0 1\n',
+            'used 100 2.0 1\n',
+            'older 100 0.5 1\n',
+            'linked 100 0.0 2\n',
+            'new 100 3.0 1\n'
+        ]
+        # Used by this run, so never evicted
+        cache.stage(self._connection, {'size': 100, 'sha512': 'used'},
+                    '/job/used', mock.Mock())
+
+        self.assertEqual(cache.evict(self._connection), 2)
+        self.assertEqual(self._commands[-1],
+                         "find /cache/blobs -maxdepth 1 -type f "
+                         "-printf '%f %s %T@ %n\\n'")
+        # Content still linked into a job directory is kept
+        removed = [c[0][0] for c in self._connection.remove.call_args_list]
+        self.assertEqual(removed, ['/cache/blobs/older', '/cache/blobs/old'])
+        self.assertEqual(cache.stats()['evicted'], 2)
+
+    def test_evict_symbolic(self):
+        cache = InputCache('/cache', max_size=0, link='symbolic')
+        self._find_output = ['old 100 1.0 1\n']
+
+        self.assertEqual(cache.evict(self._connection), 0)
+        self.assertFalse(self._connection.remove.called)
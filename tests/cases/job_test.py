@@ -27,7 +27,24 @@ import sys
 import six
 
 from cumulus.tasks import job
-from cumulus.testing import AssertCallsMixin
+from cumulus.testing import AssertCallsMixin, LogHandlerMixin
+
+
+def _qstat_xml(jobs):
+    """
+    Generate qstat -xml output for a list of (job id, state).
+    """
+    output = ['<?xml version=\'1.0\'?>', '<job_info>', '  <queue_info>']
+    for (job_id, state) in jobs:
+        output += ['    <job_list state="running">',
+                   '      <JB_job_number>%s</JB_job_number>' % job_id,
+                   '      <state>%s</state>' % state,
+                   '    </job_list>']
+    output += ['  </queue_info>', '  <job_info>', '  </job_info>',
+               '</job_info>']
+
+    return output
+
 
 class MockContext(task.Context):
 
@@ -38,12 +55,15 @@ class MockContext(task.Context):
     def retry(self,args=None, kwargs=None, exc=None, throw=True, eta=None, countdown=None, max_retries=None, **options):
         pass
 
+
 def capture_mock(func):
     pass
 
-class JobTestCase(AssertCallsMixin, unittest.TestCase):
+
+class JobTestCase(LogHandlerMixin, AssertCallsMixin, unittest.TestCase):
 
     def setUp(self):
+        super(JobTestCase, self).setUp()
         self._get_status_called  = False
         self._set_status_called  = False
         self._upload_job_output = cumulus.tasks.job.upload_job_output.delay = mock.Mock()
@@ -71,7 +91,7 @@ class JobTestCase(AssertCallsMixin, unittest.TestCase):
             'output': []
         }
 
-        conn.execute.return_value = 'qstat output'
+        conn.execute.return_value = _qstat_xml([])
 
         def _get_status(url, request):
             content = {
@@ -134,7 +154,7 @@ class JobTestCase(AssertCallsMixin, unittest.TestCase):
             'dir': '/home/test/%s' % job_id
         }
 
-        conn.execute.return_value = 'qstat output'
+        conn.execute.return_value = _qstat_xml([])
 
         def _get_status(url, request):
             content = {
@@ -195,9 +215,7 @@ class JobTestCase(AssertCallsMixin, unittest.TestCase):
             'output': []
         }
 
-        conn.execute.return_value = [ 'job-ID  prior   name       user         state submit/start at     queue  slots ja-task-ID',
-                             '-----------------------------------------------------------------------------------------',
-                             '1 0.00000 hostname   sgeadmin     r     09/09/2009 14:58:14                1']
+        conn.execute.return_value = _qstat_xml([('1', 'r')])
 
         def _get_status(url, request):
             content = {
@@ -235,7 +253,6 @@ class JobTestCase(AssertCallsMixin, unittest.TestCase):
         self.assertTrue(self._get_status_called, 'Expect get status endpoint to be hit')
         self.assertTrue(self._set_status_called, 'Expect set status endpoint to be hit')
 
-
     @mock.patch('cumulus.celery.monitor.Task.retry')
     @mock.patch('cumulus.tasks.job.get_connection')
     def test_monitor_job_queued(self, get_connection, *args):
@@ -259,9 +276,7 @@ class JobTestCase(AssertCallsMixin, unittest.TestCase):
             'output': []
         }
 
-        conn.execute.return_value = [ 'job-ID  prior   name       user         state submit/start at     queue  slots ja-task-ID',
-                             '-----------------------------------------------------------------------------------------',
-                             '1 0.00000 hostname   sgeadmin     q     09/09/2009 14:58:14                1']
+        conn.execute.return_value = _qstat_xml([('1', 'q')])
 
         def _get_status(url, request):
             content = {
@@ -321,9 +336,9 @@ class JobTestCase(AssertCallsMixin, unittest.TestCase):
         }
 
         conn = get_connection.return_value.__enter__.return_value
-        conn.execute.side_effect = [ 'job-ID  prior   name       user         state submit/start at     queue  slots ja-task-ID',
-                             '-----------------------------------------------------------------------------------------',
-                             '1 0.00000 hostname   sgeadmin     r     09/09/2009 14:58:14                1'], ['i have a tail', 'asdfas']
+        conn.execute.side_effect = [_qstat_xml([('1', 'r')])]
+        conn.stat.return_value.st_size = 21
+        conn.read.return_value = b'i have a tail\nasdfas\n'
 
         def _get_status(url, request):
             content = {
@@ -339,7 +354,7 @@ class JobTestCase(AssertCallsMixin, unittest.TestCase):
             return httmock.response(200, content, headers, request=request)
 
         def _set_status(url, request):
-            expected = {u'status': u'running', u'output': [{u'content': [u'i have a tail', u'asdfas'], u'path': u'dummy/file/path', u'tail': True}], u'timings': {}}
+            expected = {u'status': u'running', u'output': [{u'content': [u'i have a tail\n', u'asdfas\n'], u'path': u'dummy/file/path', u'tail': True, u'offset': 21}], u'timings': {}}
             self._set_status_called = json.loads(request.body.decode('utf8')) == expected
 
             if not self._set_status_called:
@@ -360,6 +375,74 @@ class JobTestCase(AssertCallsMixin, unittest.TestCase):
 
         self.assertTrue(self._get_status_called, 'Expect get status endpoint to be hit')
         self.assertTrue(self._set_status_called, 'Expect set status endpoint to be hit')
+        self.assertEqual(conn.read.call_args_list,
+                         [mock.call('/home/test/dummy/file/path', 0, 21)])
+
+        # The next poll must carry on from where we got to
+        retry_job = retry.call_args[1]['args'][1]
+        self.assertEqual(retry_job['_id'], job_id)
+        self.assertEqual(retry_job['output'][0]['offset'], 21)
+
+    def test_tail_output_legacy(self):
+        conn = mock.MagicMock()
+        # Tailed before the offset was recorded
+        output = {
+            'tail': True,
+            'path': 'log.txt',
+            'content': ['line1\n', 'line2\n']
+        }
+        job_model = {
+            '_id': 'dummy',
+            'dir': '/home/test',
+            'output': [output]
+        }
+        running = job.Running(None, job=job_model, conn=conn,
+                              girder_token='s')
+
+        conn.stat.return_value.st_size = 18
+        conn.read.return_value = b'line3\n'
+        running._tail_output()
+        conn.read.assert_called_with('/home/test/log.txt', 12, 6)
+        self.assertEqual(output['content'], ['line1\n', 'line2\n', 'line3\n'])
+        self.assertEqual(output['offset'], 18)
+
+    def test_tail_output_incremental(self):
+        conn = mock.MagicMock()
+        output = {
+            'tail': True,
+            'path': 'log.txt',
+            'content': ['line1\n'],
+            'offset': 6
+        }
+        job_model = {
+            '_id': 'dummy',
+            'dir': '/home/test',
+            'output': [output]
+        }
+        running = job.Running(None, job=job_model, conn=conn,
+                              girder_token='s')
+
+        # Only complete lines are consumed
+        conn.stat.return_value.st_size = 20
+        conn.read.return_value = b'line2\nline3\npartia'
+        running._tail_output()
+        conn.read.assert_called_with('/home/test/log.txt', 6, 14)
+        self.assertEqual(output['content'], ['line1\n', 'line2\n', 'line3\n'])
+        self.assertEqual(output['offset'], 18)
+
+        # Nothing new, nothing read
+        conn.read.reset_mock()
+        conn.stat.return_value.st_size = 18
+        running._tail_output()
+        self.assertFalse(conn.read.called)
+
+        # The file has been truncated so start again
+        conn.stat.return_value.st_size = 4
+        conn.read.return_value = b'new\n'
+        running._tail_output()
+        conn.read.assert_called_with('/home/test/log.txt', 0, 4)
+        self.assertEqual(output['content'], ['new\n'])
+        self.assertEqual(output['offset'], 4)
 
     @mock.patch('cumulus.celery.command.Task.retry')
     @mock.patch('cumulus.tasks.job.monitor_job')
@@ -439,7 +522,6 @@ class JobTestCase(AssertCallsMixin, unittest.TestCase):
 
             return httmock.response(200, content, headers, request=request)
 
-
         status_url = '/api/v1/jobs/%s/status' % job_id
         get_status = httmock.urlmatch(
             path=r'^%s$' % status_url, method='GET')(_get_status)
@@ -567,6 +649,103 @@ class JobTestCase(AssertCallsMixin, unittest.TestCase):
         self.assertEqual(conn.execute.call_args_list[1], mock.call('qconf -sp mype'))
         self.assertEqual(job_model['params']['numberOfSlots'], 10)
 
+    @mock.patch('cumulus.tasks.job.monitor_jobs')
+    @mock.patch('cumulus.tasks.job.get_connection', autospec=True)
+    def test_submit_jobs(self, get_connection, monitor_jobs):
+        cluster = {
+            '_id': 'bob',
+            'type': 'trad',
+            'name': 'dummy',
+            'config': {
+                'scheduler': {
+                    'type': 'slurm'
+                }
+            }
+        }
+        jobs = [{
+            '_id': 'job%d' % i,
+            'name': 'job%d.sh' % i,
+            'commands': ['ls']
+        } for i in range(3)]
+
+        conn = get_connection.return_value.__enter__.return_value
+        conn.execute.side_effect = [
+            ['/home/test'],
+            [],
+            ['cumulus-submit:0\n', 'Submitted batch job 11\n',
+             'cumulus-submit:1\n', 'sbatch: error: invalid partition\n']
+        ]
+
+        patches = {}
+
+        def _get_status(url, request):
+            # The last job has been terminated before it could be submitted
+            status = 'terminating' if url.path.endswith('job2/status') \
+                else 'created'
+            content = json.dumps({'status': status}).encode('utf8')
+            headers = {
+                'content-length': len(content),
+                'content-type': 'application/json'
+            }
+
+            return httmock.response(200, content, headers, request=request)
+
+        def _set_status(url, request):
+            job_id = url.path.split('/')[-1]
+            body = json.loads(request.body.decode('utf8'))
+            patches[job_id] = body
+            content = json.dumps(dict(body, _id=job_id)).encode('utf8')
+            headers = {
+                'content-length': len(content),
+                'content-type': 'application/json'
+            }
+
+            return httmock.response(200, content, headers, request=request)
+
+        def _log(url, request):
+            content = json.dumps({}).encode('utf8')
+            headers = {
+                'content-length': len(content),
+                'content-type': 'application/json'
+            }
+
+            return httmock.response(200, content, headers, request=request)
+
+        get_status = httmock.urlmatch(
+            path=r'^/api/v1/jobs/[^/]+/status$', method='GET')(_get_status)
+        set_status = httmock.urlmatch(
+            path=r'^/api/v1/jobs/[^/]+$', method='PATCH')(_set_status)
+        log = httmock.urlmatch(
+            path=r'^/api/v1/jobs/[^/]+/log$', method='POST')(_log)
+
+        with httmock.HTTMock(get_status, set_status, log):
+            job.submit_jobs(cluster, jobs, girder_token='girder_token')
+
+        # One connection, a single mkdir and a single sbatch command for both
+        # jobs
+        self.assertEqual(get_connection.call_count, 1)
+        calls = conn.execute.call_args_list
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(calls[0], mock.call('pwd'))
+        self.assertEqual(
+            calls[1], mock.call('mkdir -p /home/test/job0 /home/test/job1'))
+        self.assertEqual(calls[2][0][0].count('sbatch'), 2)
+        self.assertEqual(conn.put.call_count, 2)
+        self.assertEqual(conn.put.call_args_list[0][0][1],
+                         '/home/test/job0/job0.sh')
+
+        self.assertEqual(patches['job0'], {
+            'status': 'queued',
+            'queueJobId': '11',
+            'dir': '/home/test/job0'
+        })
+        self.assertEqual(patches['job1'], {'status': 'unexpectederror'})
+        self.assertNotIn('job2', patches)
+
+        # Only the submitted job is monitored
+        monitored = monitor_jobs.s.call_args[0][1]
+        self.assertEqual([j['_id'] for j in monitored], ['job0'])
+
     @mock.patch('cumulus.tasks.job.get_connection')
     @mock.patch('cumulus.celery.monitor.Task.retry')
     def test_monitor_jobs_queued_retry(self, retry, get_connection):
@@ -598,11 +777,7 @@ class JobTestCase(AssertCallsMixin, unittest.TestCase):
             'output': []
         }
 
-
-        conn.execute.return_value = [ 'job-ID  prior   name       user         state submit/start at     queue  slots ja-task-ID',
-                             '-----------------------------------------------------------------------------------------',
-                             '1 0.00000 hostname   sgeadmin     q     09/09/2009 14:58:14                1',
-                             '2 0.00000 hostname   sgeadmin     q     09/09/2009 14:58:14                1']
+        conn.execute.return_value = _qstat_xml([('1', 'q'), ('2', 'q')])
 
         self._get_status_calls = {}
         self._set_status_calls = {}
@@ -687,9 +862,7 @@ class JobTestCase(AssertCallsMixin, unittest.TestCase):
             'output': []
         }
 
-
-        conn.execute.return_value = [ 'job-ID  prior   name       user         state submit/start at     queue  slots ja-task-ID',
-                             '-----------------------------------------------------------------------------------------']
+        conn.execute.return_value = _qstat_xml([])
 
         self._get_status_calls = {}
         self._set_status_calls = {}
@@ -743,5 +916,493 @@ class JobTestCase(AssertCallsMixin, unittest.TestCase):
         # All jobs are complete fo we shouldn't resheduled
         self.assertFalse(retry.call_args_list)
 
+    @mock.patch('cumulus.tasks.job.get_connection')
+    @mock.patch('cumulus.celery.monitor.Task.retry')
+    def test_monitor_cluster_jobs(self, retry, get_connection):
+        conn = get_connection.return_value.__enter__.return_value
+
+        cluster = {
+            '_id': 'lost',
+            'type': 'ec2',
+            'name': 'dummy',
+            'config': {
+                '_id': 'dummy',
+                'scheduler': {
+                    'type': 'sge'
+                }
+            }
+        }
+        jobs = [{
+            '_id': 'dummy1',
+            'queueJobId': '1',
+            'name': 'dummy',
+            'status': 'queued',
+            'output': []
+        }, {
+            '_id': 'dummy2',
+            'queueJobId': '2',
+            'name': 'dummy',
+            'status': 'queued',
+            'output': []
+        }]
+
+        conn.execute.return_value = _qstat_xml([('1', 'r'), ('2', 'q')])
+
+        self._set_status_calls = {}
+
+        @httmock.urlmatch(path=r'^/api/v1/clusters/lost/monitor$',
+                          method='PUT')
+        def acquire(url, request):
+            return httmock.response(200, {'acquired': True, 'expiresIn': 70},
+                                    {'content-type': 'application/json'},
+                                    request=request)
+
+        @httmock.urlmatch(path=r'^/api/v1/jobs$', method='GET')
+        def find_jobs(url, request):
+            self.assertIn('clusterId=lost', url.query)
+            return httmock.response(200, json.dumps(jobs),
+                                    {'content-type': 'application/json'},
+                                    request=request)
+
+        @httmock.urlmatch(path=r'^/api/v1/jobs/dummy[12]$', method='PATCH')
+        def set_status(url, request):
+            job_id = url.path.split('/')[-1]
+            body = json.loads(request.body.decode('utf8'))
+            self._set_status_calls[job_id] = body['status']
+
+            return httmock.response(200, None, {}, request=request)
+
+        with httmock.HTTMock(acquire, find_jobs, set_status):
+            job.monitor_cluster_jobs(cluster, girder_token='s')
+
+        # A single scheduler query for all the jobs on the cluster
+        self.assertEqual(conn.execute.call_count, 1)
+        self.assertEqual(self._set_status_calls,
+                         {'dummy1': 'running', 'dummy2': 'queued'})
+        # Make sure we are rescheduled with the job timers
+        self.assertEqual(len(retry.call_args_list), 1)
+        kwargs = retry.call_args_list[0][1]['kwargs']
+        self.assertEqual(set(kwargs['job_timers'].keys()),
+                         set(['dummy1', 'dummy2']))
+        self.assertIn('runningTime', kwargs['job_timers']['dummy1'])
+        self.assertIn('queuedTime', kwargs['job_timers']['dummy2'])
+
+    @mock.patch('cumulus.tasks.job.get_connection')
+    @mock.patch('cumulus.celery.monitor.Task.retry')
+    def test_monitor_cluster_jobs_array(self, retry, get_connection):
+        conn = get_connection.return_value.__enter__.return_value
+
+        cluster = {
+            '_id': 'lost',
+            'type': 'ec2',
+            'name': 'dummy',
+            'config': {
+                '_id': 'dummy',
+                'scheduler': {
+                    'type': 'sge'
+                }
+            }
+        }
+        jobs = [{
+            '_id': 'dummy1',
+            'queueJobId': '1',
+            'name': 'dummy',
+            'status': 'running',
+            'output': [],
+            'array': {'start': 0, 'end': 2},
+            'elements': {'0': 'running', '1': 'queued', '2': 'queued'}
+        }]
+
+        conn.execute.return_value = [
+            '<?xml version=\'1.0\'?>', '<job_info>', '  <queue_info>',
+            '    <job_list state="running">',
+            '      <JB_job_number>1</JB_job_number>',
+            '      <state>r</state>',
+            '      <tasks>0-1</tasks>',
+            '    </job_list>',
+            '    <job_list state="pending">',
+            '      <JB_job_number>1</JB_job_number>',
+            '      <state>qw</state>',
+            '      <tasks>2</tasks>',
+            '    </job_list>',
+            '  </queue_info>', '</job_info>']
+
+        self._updates = []
+
+        @httmock.urlmatch(path=r'^/api/v1/clusters/lost/monitor$',
+                          method='PUT')
+        def acquire(url, request):
+            return httmock.response(200, {'acquired': True, 'expiresIn': 70},
+                                    {'content-type': 'application/json'},
+                                    request=request)
+
+        @httmock.urlmatch(path=r'^/api/v1/jobs$', method='GET')
+        def find_jobs(url, request):
+            return httmock.response(200, json.dumps(jobs),
+                                    {'content-type': 'application/json'},
+                                    request=request)
+
+        @httmock.urlmatch(path=r'^/api/v1/jobs/dummy1$', method='PATCH')
+        def set_status(url, request):
+            self._updates.append(json.loads(request.body.decode('utf8')))
+            return httmock.response(200, None, {}, request=request)
+
+        with httmock.HTTMock(acquire, find_jobs, set_status):
+            job.monitor_cluster_jobs(cluster, girder_token='s')
+
+        # Only the element whose state changed is sent
+        self.assertEqual(len(self._updates), 1)
+        self.assertEqual(self._updates[0]['status'], 'running')
+        self.assertEqual(self._updates[0]['elements'], {'1': 'running'})
+
+        # Nothing has changed so no elements are sent
+        self._updates = []
+        jobs[0]['elements']['1'] = 'running'
+        with httmock.HTTMock(acquire, find_jobs, set_status):
+            job.monitor_cluster_jobs(cluster, girder_token='s')
+
+        self.assertEqual(len(self._updates), 1)
+        self.assertNotIn('elements', self._updates[0])
+
+    @mock.patch('cumulus.tasks.job.get_connection')
+    @mock.patch('cumulus.celery.monitor.Task.retry')
+    def test_monitor_cluster_jobs_lease_lost(self, retry, get_connection):
+        conn = get_connection.return_value.__enter__.return_value
+
+        cluster = {
+            '_id': 'lost',
+            'type': 'ec2',
+            'name': 'dummy',
+            'config': {
+                '_id': 'dummy',
+                'scheduler': {
+                    'type': 'sge'
+                }
+            }
+        }
+        jobs = [{
+            '_id': 'dummy1',
+            'queueJobId': '1',
+            'name': 'dummy',
+            'status': 'queued',
+            'output': []
+        }]
+
+        conn.execute.return_value = _qstat_xml([('1', 'q')])
+
+        # We hold the lease when we start, but it has been taken over by the
+        # time we renew it.
+        self._acquired = [True, False]
+
+        @httmock.urlmatch(path=r'^/api/v1/clusters/lost/monitor$',
+                          method='PUT')
+        def acquire(url, request):
+            return httmock.response(200, {'acquired': self._acquired.pop(0),
+                                          'expiresIn': 70},
+                                    {'content-type': 'application/json'},
+                                    request=request)
+
+        @httmock.urlmatch(path=r'^/api/v1/jobs$', method='GET')
+        def find_jobs(url, request):
+            return httmock.response(200, json.dumps(jobs),
+                                    {'content-type': 'application/json'},
+                                    request=request)
+
+        @httmock.urlmatch(path=r'^/api/v1/jobs/dummy1$', method='PATCH')
+        def set_status(url, request):
+            return httmock.response(200, None, {}, request=request)
+
+        with httmock.HTTMock(acquire, find_jobs, set_status):
+            job.monitor_cluster_jobs(cluster, girder_token='s')
+
+        self.assertFalse(self._acquired)
+        # The other task is now monitoring the cluster
+        self.assertFalse(retry.call_args_list)
+
+    @mock.patch('cumulus.tasks.job.get_connection')
+    @mock.patch('cumulus.celery.monitor.Task.retry')
+    def test_monitor_cluster_jobs_lease_held(self, retry, get_connection):
+        cluster = {
+            '_id': 'lost',
+            'type': 'ec2',
+            'name': 'dummy',
+            'config': {}
+        }
+
+        @httmock.urlmatch(path=r'^/api/v1/clusters/lost/monitor$',
+                          method='PUT')
+        def acquire(url, request):
+            return httmock.response(200, {'acquired': False, 'expiresIn': 70},
+                                    {'content-type': 'application/json'},
+                                    request=request)
+
+        with httmock.HTTMock(acquire):
+            job.monitor_cluster_jobs(cluster, girder_token='s')
+
+        self.assertFalse(get_connection.called)
+        # Check one more time once the lease has expired
+        self.assertEqual(len(retry.call_args_list), 1)
+        self.assertFalse(retry.call_args_list[0][1]['kwargs']['lease_retry'])
+        self.assertEqual(retry.call_args_list[0][1]['countdown'], 71)
+
+    @mock.patch('cumulus.tasks.job.get_job_logger')
+    @mock.patch('cumulus.tasks.job.get_connection')
+    @mock.patch('cumulus.celery.monitor.Task.retry')
+    def test_monitor_cluster_jobs_job_error(self, retry, get_connection,
+                                            get_job_logger):
+        conn = get_connection.return_value.__enter__.return_value
+
+        cluster = {
+            '_id': 'lost',
+            'type': 'ec2',
+            'name': 'dummy',
+            'config': {
+                '_id': 'dummy',
+                'scheduler': {
+                    'type': 'sge'
+                }
+            }
+        }
+        jobs = [{
+            '_id': 'dummy%d' % i,
+            'queueJobId': str(i),
+            'name': 'dummy',
+            'status': 'queued',
+            'output': []
+        } for i in [1, 2]]
+
+        conn.execute.return_value = _qstat_xml([('1', 'r'), ('2', 'r')])
+
+        self._set_status_calls = {}
+
+        @httmock.urlmatch(path=r'^/api/v1/clusters/lost/monitor$',
+                          method='PUT')
+        def acquire(url, request):
+            return httmock.response(200, {'acquired': True, 'expiresIn': 70},
+                                    {'content-type': 'application/json'},
+                                    request=request)
+
+        @httmock.urlmatch(path=r'^/api/v1/jobs$', method='GET')
+        def find_jobs(url, request):
+            return httmock.response(200, json.dumps(jobs),
+                                    {'content-type': 'application/json'},
+                                    request=request)
+
+        @httmock.urlmatch(path=r'^/api/v1/jobs/dummy[12]$', method='PATCH')
+        def set_status(url, request):
+            job_id = url.path.split('/')[-1]
+            if job_id == 'dummy1':
+                return httmock.response(400, None, {}, request=request)
+
+            body = json.loads(request.body.decode('utf8'))
+            self._set_status_calls[job_id] = body['status']
+
+            return httmock.response(200, None, {}, request=request)
+
+        @httmock.urlmatch(path=r'^/api/v1/clusters/lost$', method='PATCH')
+        def set_cluster_status(url, request):
+            self.fail('The cluster should not be put into error')
+
+        with httmock.HTTMock(acquire, find_jobs, set_status,
+                             set_cluster_status):
+            job.monitor_cluster_jobs(cluster, girder_token='s')
+
+        # The other job is still updated and we keep monitoring
+        self.assertEqual(self._set_status_calls, {'dummy2': 'running'})
+        self.assertTrue(get_job_logger.return_value.exception.called)
+        self.assertEqual(len(retry.call_args_list), 1)
+
+    @mock.patch('cumulus.tasks.job.get_connection')
+    @mock.patch('cumulus.celery.monitor.Task.retry')
+    def test_monitor_cluster_jobs_lease_released(self, retry, get_connection):
+        cluster = {
+            '_id': 'lost',
+            'type': 'ec2',
+            'name': 'dummy',
+            'config': {}
+        }
+
+        @httmock.urlmatch(path=r'^/api/v1/clusters/lost/monitor$',
+                          method='PUT')
+        def acquire(url, request):
+            return httmock.response(200, {'acquired': False,
+                                          'expiresIn': None},
+                                    {'content-type': 'application/json'},
+                                    request=request)
+
+        with httmock.HTTMock(acquire):
+            job.monitor_cluster_jobs(cluster, girder_token='s')
+
+        self.assertEqual(retry.call_args_list[0][1]['countdown'], 1)
+
+    @mock.patch('cumulus.tasks.job.get_connection')
+    @mock.patch('cumulus.celery.monitor.Task.retry')
+    def test_monitor_cluster_jobs_no_jobs(self, retry, get_connection):
+        cluster = {
+            '_id': 'lost',
+            'type': 'ec2',
+            'name': 'dummy',
+            'config': {}
+        }
+        self._released = False
+
+        @httmock.urlmatch(path=r'^/api/v1/clusters/lost/monitor$',
+                          method='PUT')
+        def acquire(url, request):
+            return httmock.response(200, {'acquired': True, 'expiresIn': 70},
+                                    {'content-type': 'application/json'},
+                                    request=request)
+
+        @httmock.urlmatch(path=r'^/api/v1/clusters/lost/monitor$',
+                          method='DELETE')
+        def release(url, request):
+            self._released = True
+            return httmock.response(200, None, {}, request=request)
+
+        @httmock.urlmatch(path=r'^/api/v1/jobs$', method='GET')
+        def find_jobs(url, request):
+            return httmock.response(200, json.dumps([]),
+                                    {'content-type': 'application/json'},
+                                    request=request)
+
+        with httmock.HTTMock(acquire, release, find_jobs):
+            job.monitor_cluster_jobs(cluster, girder_token='s')
+
+        self.assertTrue(self._released)
+        self.assertFalse(get_connection.called)
+        self.assertFalse(retry.call_args_list)
+
+    def _complete_state(self, conn, cluster_type='trad', regex='ERROR'):
+        job_model = {
+            '_id': 'dummy',
+            'name': 'test',
+            'queueJobId': '1',
+            'dir': '/home/test',
+            'output': [{
+                'path': '{{stdout}}',
+                'errorRegEx': regex
+            }]
+        }
+
+        return job.Complete(None, job=job_model, conn=conn,
+                            cluster={'type': cluster_type}, girder_token='s')
+
+    @mock.patch('cumulus.tasks.job.get_post_logger')
+    def test_complete_error_regex_remote(self, get_post_logger):
+        conn = mock.MagicMock()
+        conn.execute.return_value = ['ERROR: bad things\n',
+                                     'cumulus-grep-status:0\n']
+        state = self._complete_state(conn)
+
+        self.assertEqual(str(state.next(None)), 'error')
+        conn.execute.assert_called_once_with(
+            "grep -m1 -E -e '^(ERROR)' /home/test/test-dummy.o1; "
+            "echo cumulus-grep-status:$?")
+        self.assertFalse(conn.get.called)
+
+        conn.execute.return_value = ['cumulus-grep-status:1\n']
+        self.assertEqual(str(state.next(None)), 'complete')
+        self.assertFalse(conn.get.called)
+
+    @mock.patch('cumulus.tasks.job.get_post_logger')
+    def test_complete_error_regex_python_only(self, get_post_logger):
+        conn = mock.MagicMock()
+        conn.get.return_value.__enter__.return_value = iter(
+            [b'all good\n', b'Error 42: bad things\n'])
+        # \d means something else to grep -E, so we must not use it
+        state = self._complete_state(conn, regex='Error \\d+')
+
+        self.assertEqual(str(state.next(None)), 'error')
+        self.assertFalse(conn.execute.called)
+        conn.get.assert_called_once_with('/home/test/test-dummy.o1')
+
+    def test_is_ere_compatible(self):
+        for regex in ['ERROR', 'ERROR|FATAL', '[Ee]rror: .*', 'a\\.b',
+                      '[]x]', 'x{2,3}', '(a|b)+']:
+            self.assertTrue(job._is_ere_compatible(regex), regex)
+
+        for regex in ['\\d+', '(?i)error', 'a.*?b', '[\\w]', '\\berror',
+                      '[[:alpha:]]', 'error\\']:
+            self.assertFalse(job._is_ere_compatible(regex), regex)
+
+    @mock.patch('cumulus.tasks.job.get_post_logger')
+    def test_complete_error_regex_stream(self, get_post_logger):
+        conn = mock.MagicMock()
+        # grep failed, for example the expression isn't valid ERE
+        conn.execute.return_value = ['cumulus-grep-status:2\n']
+        conn.get.return_value.__enter__.return_value = iter(
+            [b'all good\n', b'ERROR: bad things\n', b'more\n'])
+        state = self._complete_state(conn)
+
+        self.assertEqual(str(state.next(None)), 'error')
+        conn.get.assert_called_once_with('/home/test/test-dummy.o1')
+
+        # NEWT clusters always stream
+        conn = mock.MagicMock()
+        conn.get.return_value.__enter__.return_value = iter([b'all good\n'])
+        state = self._complete_state(conn, cluster_type='newt')
+
+        self.assertEqual(str(state.next(None)), 'complete')
+        self.assertFalse(conn.execute.called)
+
+    def test_job_queue_states_accounting(self):
+        adapter = mock.MagicMock()
+        jobs = [{'queueJobId': str(i), 'timings': {}} for i in range(4)]
+        adapter.job_statuses.return_value = [
+            (jobs[0], 'running'), (jobs[1], None), (jobs[2], None),
+            (jobs[3], None)]
+        adapter.job_accounting.return_value = {
+            '1': {'state': 'error', 'exitCode': 2, 'elapsed': 10.5,
+                  'cpuTime': 20, 'maxMemory': 1024},
+            '2': {'state': 'complete', 'exitCode': 0}
+        }
+
+        states = job._job_queue_states(adapter, jobs)
+
+        # Only the jobs that have left the queue are looked up
+        adapter.job_accounting.assert_called_once_with(jobs[1:])
+        self.assertEqual([state for (_, state) in states],
+                         ['running', 'error', 'complete', None])
+        self.assertEqual(jobs[1]['timings'], {
+            'exitCode': 2, 'elapsed': 10500, 'cpuTime': 20000,
+            'maxMemory': 1024})
+        self.assertEqual(jobs[2]['timings'], {'exitCode': 0})
+
+        # Accounting failures fall back to the queue states
+        adapter.job_accounting.side_effect = Exception('no sacct')
+        states = job._job_queue_states(adapter, jobs)
+        self.assertEqual([state for (_, state) in states],
+                         ['running', None, None, None])
+
+    def test_terminating_error(self):
+        state = job.from_string('terminating', job={}, cluster={})
+
+        self.assertEqual(str(state.next('error')), 'terminated')
+
+    def test_job_queue_states_array_accounting(self):
+        adapter = mock.MagicMock()
+        array_job = {
+            'queueJobId': '1',
+            'array': {'start': 0, 'end': 2},
+            'elements': {'0': 'complete', '1': 'complete', '2': 'complete'}
+        }
+        adapter.job_statuses.return_value = [(array_job, None)]
+        adapter.job_accounting.return_value = {
+            '1_0': {'state': 'complete', 'exitCode': 0},
+            '1_1': {'state': 'error', 'exitCode': 1}
+        }
+
+        states = job._job_queue_states(adapter, [array_job])
+
+        self.assertEqual(states, [(array_job, 'error')])
+        self.assertEqual(array_job['elements'], {
+            '0': 'complete', '1': 'error', '2': 'complete'})
 
+    @mock.patch('cumulus.tasks.job.get_post_logger')
+    def test_complete_array_skips_error_regex(self, get_post_logger):
+        conn = mock.MagicMock()
+        state = self._complete_state(conn)
+        state.job['array'] = {'start': 0, 'end': 1}
 
+        self.assertEqual(str(state.next(None)), 'complete')
+        self.assertFalse(conn.execute.called)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import unittest
+import logging
+import json
+from httmock import urlmatch, HTTMock
+
+from cumulus.logging import RESTfulLogHandler, flush_handlers
+
+
+class RESTfulLogHandlerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._requests = []
+
+        @urlmatch(netloc=r'localhost', path='/api/v1/jobs/123/log',
+                  method='POST')
+        def log(url, request):
+            self._requests.append(json.loads(request.body))
+            self.assertEqual(request.headers['Girder-Token'], 'token')
+
+            return ''
+
+        self._mock = HTTMock(log)
+        self._mock.__enter__()
+
+        self._logger = logging.getLogger('log_handler_test')
+        self._logger.setLevel(logging.INFO)
+        self._logger.propagate = False
+
+    def tearDown(self):
+        for handler in list(self._logger.handlers):
+            self._logger.removeHandler(handler)
+            handler.close()
+        self._mock.__exit__(None, None, None)
+
+    def _add_handler(self, **kwargs):
+        handler = RESTfulLogHandler(
+            'token', 'http://localhost/api/v1/jobs/123/log', **kwargs)
+        self._logger.addHandler(handler)
+
+        return handler
+
+    def test_batch(self):
+        handler = self._add_handler(flush_interval=60)
+
+        for i in range(3):
+            self._logger.info('message %d' % i)
+
+        handler.flush()
+
+        self.assertEqual(len(self._requests), 1)
+        self.assertEqual([r['msg'] for r in self._requests[0]],
+                         ['message 0', 'message 1', 'message 2'])
+
+    def test_batch_size(self):
+        self._add_handler(batch_size=2, flush_interval=60)
+
+        for i in range(5):
+            self._logger.info('message %d' % i)
+
+        flush_handlers()
+
+        self.assertEqual([len(r) for r in self._requests], [2, 2, 1])
+        records = [r['msg'] for batch in self._requests for r in batch]
+        self.assertEqual(records, ['message %d' % i for i in range(5)])
+
+    def test_close(self):
+        handler = self._add_handler(flush_interval=60)
+        self._logger.info('message')
+        self._logger.removeHandler(handler)
+        handler.close()
+
+        self.assertEqual(len(self._requests), 1)
+        self.assertEqual(self._requests[0][0]['msg'], 'message')
@@ -53,6 +53,21 @@ class PbsQueueAdapterTestCase(unittest.TestCase):
 
         self.assertIsNotNone(cm.exception)
 
+    def test_submit_jobs(self):
+        jobs = [({'dir': '/tmp/job%d' % i}, 'job%d.sh' % i) for i in range(2)]
+        test_output = []
+        for i in range(2):
+            test_output += ['cumulus-submit:%d\n' % i, '%d.localhost\n' % (70 + i)]
+        self._cluster_connection.execute.return_value = test_output
+
+        results = self._adapter.submit_jobs(jobs)
+
+        expected_command = '; '.join([
+            'echo cumulus-submit:%d; (cd /tmp/job%d && qsub ./job%d.sh) 2>&1'
+            % (i, i, i) for i in range(2)])
+        self.assertEqual(self._cluster_connection.execute.call_args_list,
+                         [mock.call(expected_command)])
+        self.assertEqual(results, [(job_id, None) for job_id in ['70', '71']])
 
     def test_job_statuses(self):
         job1_id = '1126'
@@ -84,6 +99,56 @@ class PbsQueueAdapterTestCase(unittest.TestCase):
         self.assertEqual(status[0][1], 'complete')
         self.assertEqual(status[1][1], 'complete')
 
+    def test_job_statuses_many(self):
+        states = ['R', 'Q', 'C', 'E']
+        jobs = [{AbstractQueueAdapter.QUEUE_JOB_ID: str(i)}
+                for i in range(10000)]
+        output = [
+            'Job id                    Name             User            Time Use S Queue',
+            '------------------------- ---------------- --------------- -------- - -----'
+        ]
+        output += ['%d.ulex                    sleep.sh         cjh             00:00:00 %s batch'
+                   % (i, states[i % 4]) for i in range(10000)]
+        self._cluster_connection.execute.return_value = output
+
+        status = self._adapter.job_statuses(jobs)
+        expected = ['running', 'queued', 'complete', 'error']
+        self.assertEqual(len(status), 10000)
+        for (i, (queue_job, state)) in enumerate(status):
+            self.assertEqual(queue_job, jobs[i])
+            self.assertEqual(state, expected[i % 4])
+
+    def test_job_accounting(self):
+        jobs = [{AbstractQueueAdapter.QUEUE_JOB_ID: job_id}
+                for job_id in ['1126', '1127', '1128']]
+        self._cluster_connection.execute.return_value = [
+            'Job: 1126.ulex',
+            '',
+            '05/03/2016 10:00:00  S    Job Queued at request of cjh@ulex',
+            '05/03/2016 10:01:05  S    Exit_status=0 resources_used.cput=00:01:02 '
+            'resources_used.mem=2868kb resources_used.vmem=0kb '
+            'resources_used.walltime=00:01:05',
+            'Job: 1127.ulex',
+            '',
+            '05/03/2016 10:01:05  S    Exit_status=-11 resources_used.cput=00:00:00 '
+            'resources_used.walltime=00:00:01',
+            'Job: 1128.ulex',
+            '',
+            '05/03/2016 10:00:00  S    Job Queued at request of cjh@ulex'
+        ]
+
+        accounting = self._adapter.job_accounting(jobs)
+        self._cluster_connection.execute.assert_called_once_with(
+            'tracejob -q -n 2 1126 2>/dev/null; '
+            'tracejob -q -n 2 1127 2>/dev/null; '
+            'tracejob -q -n 2 1128 2>/dev/null')
+        self.assertEqual(accounting, {
+            '1126': {'state': 'complete', 'exitCode': 0, 'elapsed': 65,
+                     'cpuTime': 62, 'maxMemory': 2936832},
+            '1127': {'state': 'error', 'exitCode': -11, 'elapsed': 1,
+                     'cpuTime': 0}
+        })
+
     def test_submission_template_pbs(self):
         cluster = {
             '_id': 'dummy',
@@ -218,3 +283,72 @@ class PbsQueueAdapterTestCase(unittest.TestCase):
         }
         script = job._generate_submission_script(job_model, cluster, job_params)
         self.assertEqual(script, expected)
+
+    def test_job_statuses_array(self):
+        job1 = {
+            AbstractQueueAdapter.QUEUE_JOB_ID: '1126',
+            'array': {'start': 0, 'end': 2}
+        }
+        job2 = {
+            AbstractQueueAdapter.QUEUE_JOB_ID: '1127'
+        }
+        self._cluster_connection.execute.return_value = [
+            'Job id                    Name             User            Time Use S Queue',
+            '------------------------- ---------------- --------------- -------- - -----',
+            '1126[0].ulex              sleep.sh-0       cjh             00:00:00 C batch',
+            '1126[1].ulex              sleep.sh-1       cjh             00:00:00 R batch',
+            '1126[2].ulex              sleep.sh-2       cjh                    0 Q batch',
+            '1127.ulex                 sleep.sh         cjh             00:00:00 R batch'
+        ]
+
+        status = self._adapter.job_statuses([job1, job2])
+        self._cluster_connection.execute.assert_called_once_with(
+            'qstat -t 1126[] 1127')
+        self.assertEqual(status[0][1], 'running')
+        self.assertEqual(job1['elements'], {
+            '0': 'complete', '1': 'running', '2': 'queued'})
+        self.assertEqual(status[1][1], 'running')
+
+    def test_submit_job_array(self):
+        self._cluster_connection.execute.return_value = ['1126[].ulex']
+        job = {
+            'dir': '/tmp'
+        }
+
+        self.assertEqual(self._adapter.submit_job(job, 'test.sh'), '1126')
+
+    def test_submission_template_array(self):
+        cluster = {
+            '_id': 'dummy',
+            'type': 'trad',
+            'name': 'dummy',
+            'config': {
+                'host': 'dummy',
+                'ssh': {
+                    'user': 'dummy',
+                    'passphrase': 'its a secret'
+                },
+                'scheduler': {
+                    'type': 'pbs'
+                }
+            }
+        }
+        job_model = {
+            '_id': '123432423',
+            'queueJobId': '1',
+            'name': 'dummy',
+            'commands': ['ls', 'sleep 20',
+                         'mpirun -n 1000000 parallel $CUMULUS_ARRAY_INDEX'],
+            'output': [{'tail': True,  'path': 'dummy/file/path'}],
+            'array': {'start': 0, 'end': 6, 'step': 3}
+        }
+
+        path = os.path.join(os.environ["CUMULUS_SOURCE_DIRECTORY"],
+                            'tests', 'cases', 'fixtures', 'job',
+                            'pbs_submission_script_array.sh')
+
+        with open(path, 'r') as fp:
+            expected = fp.read()
+
+        script = job._generate_submission_script(job_model, cluster, {})
+        self.assertEqual(script, expected)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import unittest
+import mock
+import time
+
+from cumulus.common import polling
+from cumulus.constants import JobState
+
+
+class PollingTestCase(unittest.TestCase):
+
+    def test_first_poll(self):
+        self.assertEqual(polling.next_interval(JobState.QUEUED, 5), 5)
+
+    def test_backoff(self):
+        interval = polling.next_interval(JobState.QUEUED, 5,
+                                         previous_interval=5)
+        self.assertEqual(interval, 10)
+
+        interval = polling.next_interval(JobState.QUEUED, 5,
+                                         previous_interval=interval)
+        self.assertEqual(interval, 20)
+
+    def test_state_changed(self):
+        interval = polling.next_interval(JobState.RUNNING, 5,
+                                         previous_interval=60,
+                                         state_changed=True)
+        self.assertEqual(interval, 5)
+
+    def test_max_interval(self):
+        interval = polling.next_interval(JobState.QUEUED, 5,
+                                         previous_interval=200)
+        self.assertEqual(interval, 300)
+
+        interval = polling.next_interval(JobState.RUNNING, 5,
+                                         previous_interval=200)
+        self.assertEqual(interval, 60)
+
+    @mock.patch('cumulus.common.polling.cumulus.config',
+                {'monitor': {'maxInterval': {'queued': 100}}})
+    def test_configured_max_interval(self):
+        interval = polling.next_interval(JobState.QUEUED, 5,
+                                         previous_interval=200)
+        self.assertEqual(interval, 100)
+
+    def test_estimated_start(self):
+        interval = polling.next_interval(JobState.QUEUED, 5,
+                                         previous_interval=5,
+                                         estimated_start=time.time() + 120)
+        self.assertTrue(110 < interval <= 120)
+
+        # Estimates don't take us past the maximum
+        interval = polling.next_interval(JobState.QUEUED, 5,
+                                         previous_interval=5,
+                                         estimated_start=time.time() + 3600)
+        self.assertEqual(interval, 300)
+
+        # Or below the base interval
+        interval = polling.next_interval(JobState.QUEUED, 5,
+                                         previous_interval=80,
+                                         estimated_start=time.time() - 10)
+        self.assertEqual(interval, 5)
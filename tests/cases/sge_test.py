@@ -27,6 +27,40 @@ from cumulus.constants import QueueType
 from cumulus.tasks import job
 
 
+def _qstat_xml(jobs):
+    """
+    Generate qstat -xml output for a list of (job id, state, list state) and
+    optionally the tasks of an array job.
+    """
+    job_list = '''    <job_list state="%s">
+      <JB_job_number>%s</JB_job_number>
+      <JAT_prio>0.50000</JAT_prio>
+      <JB_name>test.sh</JB_name>
+      <JB_owner>cjh</JB_owner>
+      <state>%s</state>
+      <slots>1</slots>%s
+    </job_list>'''
+
+    def render(job):
+        (job_id, state, list_state) = job[:3]
+        tasks = '\n      <tasks>%s</tasks>' % job[3] if len(job) > 3 else ''
+
+        return job_list % (list_state, job_id, state, tasks)
+
+    running = [render(job) for job in jobs if job[2] == 'running']
+    pending = [render(job) for job in jobs if job[2] == 'pending']
+
+    output = ['<?xml version=\'1.0\'?>',
+              '<job_info  xmlns:xsd="http://www.w3.org/2001/XMLSchema">',
+              '  <queue_info>']
+    output += running
+    output += ['  </queue_info>', '  <job_info>']
+    output += pending
+    output += ['  </job_info>', '</job_info>']
+
+    return '\n'.join(output).split('\n')
+
+
 class SgeQueueAdapterTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -73,6 +107,21 @@ class SgeQueueAdapterTestCase(unittest.TestCase):
 
         self.assertIsNotNone(cm.exception)
 
+    def test_submit_jobs(self):
+        jobs = [({'dir': '/tmp/job%d' % i}, 'job%d.sh' % i) for i in range(2)]
+        test_output = []
+        for i in range(2):
+            test_output += ['cumulus-submit:%d\n' % i, 'Your job %d ("job%d.sh") has been submitted\n' % (74 + i, i)]
+        self._cluster_connection.execute.return_value = test_output
+
+        results = self._adapter.submit_jobs(jobs)
+
+        expected_command = '; '.join([
+            'echo cumulus-submit:%d; (cd /tmp/job%d && qsub -cwd ./job%d.sh) 2>&1'
+            % (i, i, i) for i in range(2)])
+        self.assertEqual(self._cluster_connection.execute.call_args_list,
+                         [mock.call(expected_command)])
+        self.assertEqual(results, [(job_id, None) for job_id in ['74', '75']])
 
     def test_job_statuses(self):
         job1_id = '1126'
@@ -83,13 +132,9 @@ class SgeQueueAdapterTestCase(unittest.TestCase):
         job2 = {
             AbstractQueueAdapter.QUEUE_JOB_ID: job2_id
         }
-        job_status_output = [
-            'job-ID  prior   name       user         state submit/start at     queue                          slots ja-task-ID',
-            '-----------------------------------------------------------------------------------------------------------------',
-            '%s 0.50000 test.sh    cjh          r     11/18/2015 13:18:09 main.q@ulmus.kitware.com           1' % job1_id,
-            '%s 0.50000 test.sh    cjh          q     11/18/2015 13:18:09 main.q@ulmus.kitware.com           1' % job2_id
-        ]
-        expected_calls = [mock.call('qstat')]
+        job_status_output = _qstat_xml([(job1_id, 'r', 'running'),
+                                        (job2_id, 'qw', 'pending')])
+        expected_calls = [mock.call('qstat -xml')]
         self._cluster_connection.execute.return_value = job_status_output
         status = self._adapter.job_statuses([job1])
         self.assertEqual(self._cluster_connection.execute.call_args_list, expected_calls)
@@ -97,13 +142,85 @@ class SgeQueueAdapterTestCase(unittest.TestCase):
 
         # Now try two jobs
         self._cluster_connection.reset_mock()
-        expected_calls = [mock.call('qstat')]
         self._cluster_connection.execute.return_value = job_status_output
         status = self._adapter.job_statuses([job1, job2])
         self.assertEqual(self._cluster_connection.execute.call_args_list, expected_calls)
         self.assertEqual(status[0][1], 'running')
         self.assertEqual(status[1][1], 'queued')
 
+    def test_job_statuses_many(self):
+        states = [('r', 'running'), ('qw', 'pending'), ('Eqw', 'pending')]
+        jobs = [{AbstractQueueAdapter.QUEUE_JOB_ID: str(i)}
+                for i in range(10000)]
+        self._cluster_connection.execute.return_value = _qstat_xml(
+            [(str(i), ) + states[i % 3] for i in range(10000)])
+
+        status = self._adapter.job_statuses(jobs)
+        expected = ['running', 'queued', None]
+        self.assertEqual(len(status), 10000)
+        for (i, (queue_job, state)) in enumerate(status):
+            self.assertEqual(queue_job, jobs[i])
+            self.assertEqual(state, expected[i % 3])
+
+    def test_job_statuses_extra_output(self):
+        job1 = {AbstractQueueAdapter.QUEUE_JOB_ID: '1'}
+        output = _qstat_xml([('1', 'r', 'running')])
+        # Output from the profile and stderr around the document is ignored
+        self._cluster_connection.execute.return_value = \
+            ['Welcome to the cluster'] + output + ['warning: <deprecated>']
+
+        status = self._adapter.job_statuses([job1])
+        self.assertEqual(status, [(job1, 'running')])
+
+        self._cluster_connection.execute.return_value = output[:-2]
+        with self.assertRaises(Exception):
+            self._adapter.job_statuses([job1])
+
+        self._cluster_connection.execute.return_value = \
+            output[:1] + ['<job_info><job_list>'] + output[-1:]
+        with self.assertRaises(Exception):
+            self._adapter.job_statuses([job1])
+
+    def test_job_accounting(self):
+        jobs = [{AbstractQueueAdapter.QUEUE_JOB_ID: job_id}
+                for job_id in ['1126', '1127', '1128']]
+        self._cluster_connection.execute.return_value = [
+            '==============================================================',
+            'qname        main.q',
+            'jobnumber    1126',
+            'failed       0',
+            'exit_status  0',
+            'ru_wallclock 12s',
+            'cpu          3.500s',
+            'maxvmem      1.500G',
+            '==============================================================',
+            'jobnumber    1127',
+            'failed       0',
+            'exit_status  0',
+            'ru_wallclock 10',
+            'cpu          2',
+            'maxvmem      1.000M',
+            '==============================================================',
+            'jobnumber    1127',
+            'failed       100 : assumedly after job',
+            'exit_status  137',
+            'ru_wallclock 20',
+            'cpu          3',
+            'maxvmem      2.000M'
+        ]
+
+        accounting = self._adapter.job_accounting(jobs)
+        self._cluster_connection.execute.assert_called_once_with(
+            'qacct -j 1126 2>/dev/null; qacct -j 1127 2>/dev/null; '
+            'qacct -j 1128 2>/dev/null')
+        self.assertEqual(accounting, {
+            '1126': {'state': 'complete', 'exitCode': 0, 'elapsed': 12,
+                     'cpuTime': 3.5, 'maxMemory': 1610612736},
+            # The tasks of an array job are combined
+            '1127': {'state': 'error', 'exitCode': 137, 'elapsed': 20,
+                     'cpuTime': 5, 'maxMemory': 2097152}
+        })
+
     def test_unsupported(self):
         with self.assertRaises(Exception) as cm:
             get_queue_adapter({
@@ -202,3 +319,65 @@ class SgeQueueAdapterTestCase(unittest.TestCase):
         }
         script = job._generate_submission_script(job_model, cluster, job_params)
         self.assertEqual(script, expected)
+
+    def test_job_statuses_array(self):
+        job = {
+            AbstractQueueAdapter.QUEUE_JOB_ID: '1126',
+            'array': {'start': 1, 'end': 9, 'step': 2}
+        }
+        self._cluster_connection.execute.return_value = _qstat_xml(
+            [('1126', 'r', 'running', '3'), ('1126', 'qw', 'pending', '7-9:2')])
+
+        status = self._adapter.job_statuses([job])
+        self.assertEqual(status[0][1], 'running')
+        self.assertEqual(job['elements'], {
+            '1': 'complete', '3': 'running', '5': 'complete', '7': 'queued',
+            '9': 'queued'})
+
+        self.assertEqual(self._adapter._parse_task_ids('3,5-9:2'),
+                         [3, 5, 7, 9])
+
+    def test_submit_job_array(self):
+        self._cluster_connection.execute.return_value = [
+            'Your job-array 1126.1-99:2 ("test.sh") has been submitted']
+        job = {
+            'dir': '/tmp'
+        }
+
+        self.assertEqual(self._adapter.submit_job(job, 'test.sh'), '1126')
+
+    def test_submission_template_array(self):
+        cluster = {
+            '_id': 'dummy',
+            'type': 'trad',
+            'name': 'dummy',
+            'config': {
+                'host': 'dummy',
+                'ssh': {
+                    'user': 'dummy',
+                    'passphrase': 'its a secret'
+                },
+                'scheduler': {
+                    'type': 'sge'
+                }
+            }
+        }
+        job_model = {
+            '_id': '123432423',
+            'queueJobId': '1',
+            'name': 'dummy',
+            'commands': ['ls', 'sleep 20',
+                         'mpirun -n 1000000 parallel $CUMULUS_ARRAY_INDEX'],
+            'output': [{'tail': True,  'path': 'dummy/file/path'}],
+            'array': {'start': 1, 'end': 99, 'step': 2, 'limit': 5}
+        }
+
+        path = os.path.join(os.environ["CUMULUS_SOURCE_DIRECTORY"],
+                            'tests', 'cases', 'fixtures', 'job',
+                            'sge_submission_script_array.sh')
+
+        with open(path, 'r') as fp:
+            expected = fp.read()
+
+        script = job._generate_submission_script(job_model, cluster, {})
+        self.assertEqual(script, expected)
@@ -1,5 +1,6 @@
 import unittest
 import mock
+import time
 import os
 
 from cumulus.queue import get_queue_adapter
@@ -54,6 +55,33 @@ class SlurmQueueAdapterTestCase(unittest.TestCase):
 
         self.assertIsNotNone(cm.exception)
 
+    def test_submit_jobs(self):
+        jobs = [({'dir': '/tmp/job%d' % i}, 'job%d.sh' % i) for i in range(3)]
+        test_output = ['cumulus-submit:0\n',
+                       'Submitted batch job 11\n',
+                       'cumulus-submit:1\n',
+                       'sbatch: error: Batch job submission failed\n',
+                       'cumulus-submit:2\n',
+                       'sbatch: warning: no partition specified\n',
+                       'Submitted batch job 13\n']
+        self._cluster_connection.execute.return_value = test_output
+
+        results = self._adapter.submit_jobs(jobs)
+
+        expected_command = '; '.join([
+            'echo cumulus-submit:%d; (cd /tmp/job%d && sbatch ./job%d.sh) 2>&1'
+            % (i, i, i) for i in range(3)])
+        self.assertEqual(self._cluster_connection.execute.call_args_list,
+                         [mock.call(expected_command)])
+        self.assertEqual(results[0], ('11', None))
+        self.assertIsNone(results[1][0])
+        self.assertIn('Batch job submission failed', results[1][1])
+        self.assertEqual(results[2], ('13', None))
+
+        # Nothing to submit
+        self._cluster_connection.execute.reset_mock()
+        self.assertEqual(self._adapter.submit_jobs([]), [])
+        self.assertFalse(self._cluster_connection.execute.called)
 
     def test_job_statuses(self):
         job1_id = '1126'
@@ -66,17 +94,78 @@ class SlurmQueueAdapterTestCase(unittest.TestCase):
         }
 
         job_status_output = [
-              'JOBID PARTITION     NAME     USER  ST       TIME  NODES NODELIST(REASON)',
-              '%s general-c      hello_te cdc   R       0:14      2 f16n[10-11]' % job1_id,
-              '%s general-c      hello_te cdc   F       0:14      2 f16n[10-11]' % job2_id
+            '%s|R' % job1_id,
+            '%s|F' % job2_id
         ]
-        expected_calls = [mock.call('squeue -j %s,%s' % (job1_id, job2_id))]
+        expected_calls = [mock.call('squeue --noheader --array --format="%%i|%%t" -j %s,%s'
+                                    % (job1_id, job2_id))]
         self._cluster_connection.execute.return_value = job_status_output
         status = self._adapter.job_statuses([job1, job2])
         self.assertEqual(self._cluster_connection.execute.call_args_list, expected_calls)
         self.assertEqual(status[0][1], 'running')
         self.assertEqual(status[1][1], 'error')
 
+    def test_job_statuses_many(self):
+        states = ['R', 'PD', 'CD', 'F']
+        jobs = [{AbstractQueueAdapter.QUEUE_JOB_ID: str(i)}
+                for i in range(10000)]
+        # squeue doesn't list jobs in the order requested
+        self._cluster_connection.execute.return_value = [
+            '%d|%s' % (i, states[i % 4]) for i in reversed(range(10000))]
+
+        status = self._adapter.job_statuses(jobs)
+        expected = ['running', 'queued', 'complete', 'error']
+        self.assertEqual(len(status), 10000)
+        for (i, (queue_job, state)) in enumerate(status):
+            self.assertEqual(queue_job, jobs[i])
+            self.assertEqual(state, expected[i % 4])
+
+    def test_job_accounting(self):
+        jobs = [{AbstractQueueAdapter.QUEUE_JOB_ID: job_id}
+                for job_id in ['1126', '1127', '1128', '1129']]
+        self._cluster_connection.execute.return_value = [
+            '1126|COMPLETED|0:0|65|01:02.500|',
+            '1126.batch|COMPLETED|0:0|65|01:02.500|2868K',
+            '1126.0|COMPLETED|0:0|60|00:58|1.5G',
+            '1127|FAILED|1:0|5|00:01|',
+            '1127.batch|FAILED|1:0|5|00:01|1024',
+            '1128|CANCELLED by 1000|0:15|1-00:00:00|1-00:00:00|',
+            '1129|RUNNING|0:0|10|00:00|'
+        ]
+
+        accounting = self._adapter.job_accounting(jobs)
+        self._cluster_connection.execute.assert_called_once_with(
+            'sacct --noheader --parsable2 '
+            '--format=JobID,State,ExitCode,ElapsedRaw,TotalCPU,MaxRSS '
+            '-j 1126,1127,1128,1129')
+        self.assertEqual(accounting, {
+            '1126': {'state': 'complete', 'exitCode': 0, 'elapsed': 65,
+                     'cpuTime': 62.5, 'maxMemory': 1610612736},
+            '1127': {'state': 'error', 'exitCode': 1, 'elapsed': 5,
+                     'cpuTime': 1, 'maxMemory': 1024},
+            '1128': {'state': 'error', 'exitCode': 0, 'elapsed': 86400,
+                     'cpuTime': 86400}
+        })
+
+    def test_estimated_start_times(self):
+        job1 = {
+            AbstractQueueAdapter.QUEUE_JOB_ID: '1126'
+        }
+        job2 = {
+            AbstractQueueAdapter.QUEUE_JOB_ID: '1127'
+        }
+
+        self._cluster_connection.execute.return_value = [
+            '1126 2016-05-03T10:00:00',
+            '1127 N/A'
+        ]
+        expected_calls = [mock.call('squeue --start -h -o "%i %S" -j 1126,1127')]
+        start_times = self._adapter.estimated_start_times([job1, job2])
+        self.assertEqual(self._cluster_connection.execute.call_args_list, expected_calls)
+        self.assertEqual(list(start_times.keys()), ['1126'])
+        self.assertEqual(start_times['1126'],
+                         time.mktime((2016, 5, 3, 10, 0, 0, 0, 0, -1)))
+
     def test_submission_template(self):
         cluster = {
             '_id': 'dummy',
@@ -125,6 +214,35 @@ class SlurmQueueAdapterTestCase(unittest.TestCase):
         script = job._generate_submission_script(job_model, cluster, job_params)
         self.assertEqual(script, expected)
 
+    def test_submission_template_commands(self):
+        cluster = {
+            '_id': 'dummy',
+            'type': 'trad',
+            'name': 'dummy',
+            'config': {
+                'scheduler': {
+                    'type': 'slurm'
+                }
+            }
+        }
+        job_model = {
+            '_id': '123432423',
+            'name': 'dummy',
+            'commands': ['cd {{ job._id }}',
+                         '{% for i in range(numberOfRuns) %}',
+                         './run {{ i }}',
+                         '{% endfor %}'],
+            'output': []
+        }
+
+        script = job._generate_submission_script(job_model, cluster,
+                                                 {'numberOfRuns': 2})
+        self.assertIn('cd 123432423\n', script)
+        self.assertIn('./run 0\n', script)
+        self.assertIn('./run 1\n', script)
+        self.assertNotIn('{', script)
+        # The job itself is left untouched
+        self.assertEqual(job_model['commands'][0], 'cd {{ job._id }}')
 
     def test_submission_template_nodes(self):
         cluster = {
@@ -220,3 +338,64 @@ class SlurmQueueAdapterTestCase(unittest.TestCase):
         }
         script = job._generate_submission_script(job_model, cluster, job_params)
         self.assertEqual(script, expected)
+
+    def test_job_statuses_array(self):
+        job1 = {
+            AbstractQueueAdapter.QUEUE_JOB_ID: '1126',
+            'array': {'start': 0, 'end': 3}
+        }
+        job2 = {
+            AbstractQueueAdapter.QUEUE_JOB_ID: '1127',
+            'array': {'start': 0, 'end': 1},
+            'elements': {'0': 'error'}
+        }
+        self._cluster_connection.execute.return_value = [
+            '1126_1|R',
+            '1126_2|PD',
+            '1126_3|PD',
+            '1127_1|F'
+        ]
+
+        status = self._adapter.job_statuses([job1, job2])
+        self.assertEqual(status[0][1], 'running')
+        self.assertEqual(job1['elements'], {
+            '0': 'complete', '1': 'running', '2': 'queued', '3': 'queued'})
+        # Failed elements stay failed once they leave the queue
+        self.assertEqual(status[1][1], 'error')
+        self.assertEqual(job2['elements'], {'0': 'error', '1': 'error'})
+
+    def test_submission_template_array(self):
+        cluster = {
+            '_id': 'dummy',
+            'type': 'trad',
+            'name': 'dummy',
+            'config': {
+                'host': 'dummy',
+                'ssh': {
+                    'user': 'dummy',
+                    'passphrase': 'its a secret'
+                },
+                'scheduler': {
+                    'type': 'slurm'
+                }
+            }
+        }
+        job_model = {
+            '_id': '123432423',
+            'queueJobId': '1',
+            'name': 'dummy',
+            'commands': ['ls', 'sleep 20',
+                         'mpirun -n 1000000 parallel $CUMULUS_ARRAY_INDEX'],
+            'output': [{'tail': True,  'path': 'dummy/file/path'}],
+            'array': {'start': 0, 'end': 99, 'limit': 10}
+        }
+
+        path = os.path.join(os.environ["CUMULUS_SOURCE_DIRECTORY"],
+                            'tests', 'cases', 'fixtures', 'job',
+                            'slurm_submission_script_array.sh')
+
+        with open(path, 'r') as fp:
+            expected = fp.read()
+
+        script = job._generate_submission_script(job_model, cluster, {})
+        self.assertEqual(script, expected)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import os
+import shutil
+import tempfile
+import unittest
+import mock
+
+from cumulus.common.templates import TemplateRegistry
+
+
+class TemplateRegistryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._registry = TemplateRegistry(cache_size=10)
+        self._dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_from_string_compiled_once(self):
+        compile = mock.Mock(wraps=self._registry.environment.compile)
+        self._registry.environment.compile = compile
+
+        for name in ['bob', 'bill']:
+            template = self._registry.from_string('echo {{ name }}')
+            self.assertEqual(template.render(name=name), 'echo %s' % name)
+
+        self.assertEqual(compile.call_count, 1)
+
+        self._registry.from_string('echo {{ other }}')
+        self.assertEqual(compile.call_count, 2)
+
+    def test_get_template(self):
+        compile = mock.Mock(wraps=self._registry.environment.compile)
+        self._registry.environment.compile = compile
+
+        cluster = {
+            'config': {
+                'scheduler': {
+                    'type': 'slurm'
+                }
+            }
+        }
+        job = {
+            '_id': 'dummy',
+            'name': 'dummy',
+            'commands': ['ls']
+        }
+
+        for _ in range(2):
+            script = self._registry.get_template('template.sh').render(
+                cluster=cluster, job=job)
+            self.assertIn('#SBATCH', script)
+
+        # template.sh and the slurm template
+        self.assertEqual(compile.call_count, 2)
+
+    def test_configured_scheduler_template(self):
+        path = os.path.join(self._dir, 'slurm.sh')
+        with open(path, 'w') as fp:
+            fp.write('#SITE --job-name={{ job.name }}\n')
+
+        config = {
+            'scheduler': {
+                'templates': {
+                    'slurm': path
+                }
+            }
+        }
+        with mock.patch('cumulus.common.templates.cumulus.config', config):
+            template = self._registry.get_template('schedulers/slurm.sh')
+            self.assertEqual(template.render(job={'name': 'test'}),
+                             '#SITE --job-name=test')
+
+            # Other schedulers still use the shipped templates
+            template = self._registry.get_template('schedulers/sge.sh')
+            self.assertIn('#$', template.render(job={'name': 'test'},
+                                                cluster={'config': {}}))
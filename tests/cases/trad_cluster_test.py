@@ -23,11 +23,13 @@ import httmock
 import json
 
 from cumulus.tasks import cluster
-from cumulus.testing import AssertCallsMixin
+from cumulus.testing import AssertCallsMixin, LogHandlerMixin
 
-class TradClusterTestCase(AssertCallsMixin, unittest.TestCase):
+
+class TradClusterTestCase(LogHandlerMixin, AssertCallsMixin, unittest.TestCase):
 
     def setUp(self):
+        super(TradClusterTestCase, self).setUp()
         self._expected_status = 'error'
         self._set_status_called  = False
         self._set_status_valid  = False
@@ -104,7 +106,6 @@ class TradClusterTestCase(AssertCallsMixin, unittest.TestCase):
         get_cluster = httmock.urlmatch(
             path=r'^%s$' % cluster_url, method='GET')(_get_cluster)
 
-
         conn = get_connection.return_value.__enter__.return_value
         conn.execute.return_value = ['/usr/bin/qsub']
         self._expected_status = 'running'
@@ -22,12 +22,15 @@ import mock
 import httmock
 import os
 import json
+import stat
 from jsonpath_rw import parse
 
 import cumulus
 from cumulus.ssh.tasks import key
 from cumulus.transport import get_connection
-from cumulus.transport.ssh import SshClusterConnection
+from cumulus.transport.abstract import AbstractConnection, parse_find_entry
+from cumulus.transport.newt import NewtClusterConnection
+from cumulus.transport.ssh import SshClusterConnection, SshCommandException
 
 class TransportTestCase(unittest.TestCase):
     def setUp(self):
@@ -61,4 +64,128 @@ class TransportTestCase(unittest.TestCase):
         with get_connection('girder_token', cluster) as ssh:
             self.assertTrue(isinstance(ssh, SshClusterConnection))
 
+    def test_parse_find_entry(self):
+        entry = parse_find_entry('f 644 123 1462286723.5 1000 100 dir/my file')
+        self.assertEqual(entry, {
+            'path': 'dir/my file',
+            'name': 'my file',
+            'user': 1000,
+            'group': 100,
+            'mode': stat.S_IFREG | 0o644,
+            'date': 1462286723,
+            'size': 123
+        })
 
+        entry = parse_find_entry('d 755 4096 1462286723.0 1000 100 dir')
+        self.assertTrue(stat.S_ISDIR(entry['mode']))
+
+    def test_default_walk(self):
+        listings = {
+            '/root': [
+                {'name': '.', 'mode': stat.S_IFDIR},
+                {'name': 'a.txt', 'mode': stat.S_IFREG},
+                {'name': 'dir', 'mode': stat.S_IFDIR}
+            ],
+            '/root/dir': [
+                {'name': 'b.txt', 'mode': stat.S_IFREG}
+            ]
+        }
+        connection = AbstractConnection()
+        connection.list = mock.Mock(
+            side_effect=lambda path: iter(listings[os.path.normpath(path)]))
+
+        paths = [entry['path'] for entry in connection.walk('/root')]
+        self.assertEqual(paths, ['a.txt', 'dir', 'dir/b.txt'])
+
+    def _ssh_connection(self, output, exit_code=0):
+        connection = SshClusterConnection('girder_token', {})
+        connection._client = mock.MagicMock()
+        chan = connection._client.get_transport.return_value.open_session\
+            .return_value
+        chan.recv.side_effect = output + [b'']
+        chan.recv_exit_status.return_value = exit_code
+
+        return (connection, chan)
+
+    def test_ssh_isfile(self):
+        connection = SshClusterConnection('girder_token', {})
+        connection._sftp = mock.MagicMock()
+        sftp = connection._sftp.return_value.__enter__.return_value
+
+        sftp.stat.return_value = mock.Mock(st_mode=stat.S_IFREG | 0o644)
+        self.assertTrue(connection.isfile('/job/a.txt'))
+
+        sftp.stat.return_value = mock.Mock(st_mode=stat.S_IFDIR | 0o755)
+        self.assertFalse(connection.isfile('/job'))
+
+        sftp.stat.side_effect = IOError()
+        self.assertFalse(connection.isfile('/job/missing'))
+
+    def test_ssh_walk(self):
+        # Entries split across reads
+        (connection, chan) = self._ssh_connection([
+            b'd 755 4096 1462286723.0 1000 100 dir\0f 644 12',
+            b'3 1462286723.0 1000 100 dir/a b.txt\0'
+        ])
+
+        entries = list(connection.walk('/root'))
+
+        command = chan.exec_command.call_args[0][0]
+        self.assertTrue(command.startswith('find /root/ -mindepth 1'))
+        self.assertEqual([e['path'] for e in entries], ['dir', 'dir/a b.txt'])
+        self.assertEqual(entries[1]['size'], 123)
+        self.assertTrue(chan.close.called)
+
+    def test_ssh_walk_fallback(self):
+        (connection, chan) = self._ssh_connection([], exit_code=1)
+        connection.list = mock.Mock(return_value=iter([
+            {'name': 'a.txt', 'mode': stat.S_IFREG}
+        ]))
+
+        entries = list(connection.walk('/root'))
+
+        self.assertEqual([e['path'] for e in entries], ['a.txt'])
+
+    def test_newt_walk(self):
+        connection = NewtClusterConnection('token', {
+            'config': {
+                'host': 'cori'
+            }
+        })
+        connection.execute = mock.Mock(return_value=[
+            'f 644 123 1462286723.0 1000 100 a b.txt', ''
+        ])
+
+        entries = list(connection.walk('/my dir; rm -rf'))
+
+        connection.execute.assert_called_once_with(
+            "find '/my dir; rm -rf/' -mindepth 1 "
+            "-printf '%y %m %s %T@ %U %G %P\\n'")
+        self.assertEqual([e['path'] for e in entries], ['a b.txt'])
+
+    def test_ssh_tar_writer(self):
+        (connection, chan) = self._ssh_connection([])
+
+        with connection.tar_writer('/job dir', compress=True) as stream:
+            self.assertEqual(stream, chan.makefile.return_value)
+
+        chan.exec_command.assert_called_once_with(
+            "mkdir -p '/job dir' && tar -xzf - -C '/job dir'")
+        self.assertTrue(chan.shutdown_write.called)
+        self.assertTrue(chan.close.called)
+
+        # The extraction failed
+        (connection, chan) = self._ssh_connection([], exit_code=2)
+        with self.assertRaises(SshCommandException):
+            with connection.tar_writer('/job'):
+                pass
+
+    def test_ssh_tar_reader(self):
+        (connection, chan) = self._ssh_connection([])
+        stdout = chan.makefile.return_value
+        stdout.read.return_value = b''
+
+        with connection.tar_reader('/job') as stream:
+            self.assertEqual(stream, stdout)
+
+        chan.exec_command.assert_called_once_with('tar -chf - -C /job .')
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import unittest
+import io
+import mock
+import tarfile
+
+from cumulus.transport.files import batch_commands, use_tar
+from cumulus.transport.files.upload import _PathUploader
+
+
+class PathUploaderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # folder id => (items, folders)
+        self._folders = {
+            'root': ([{'_id': 'item1'}, {'_id': 'item2'}],
+                     [{'_id': 'sub', 'name': 'sub'}]),
+            'sub': ([{'_id': 'item3'}], [])
+        }
+        self._files = {
+            'item1': [{'_id': 'file1', 'name': 'small.txt', 'size': 1}],
+            'item2': [{'_id': 'file2', 'name': 'large.txt', 'size': 100}],
+            'item3': [{'_id': 'file3', 'name': 'medium.txt', 'size': 10}]
+        }
+
+        self._girder_client = mock.MagicMock()
+        self._girder_client.listItem.side_effect \
+            = lambda folder_id: self._folders[folder_id][0]
+        self._girder_client.listFolder.side_effect \
+            = lambda folder_id: self._folders[folder_id][1]
+        self._girder_client.get.side_effect \
+            = lambda url, parameters: self._files[url.split('/')[1]]
+
+    @mock.patch('cumulus.transport.files.upload._upload_file')
+    def test_run(self, upload_file):
+        conn = mock.MagicMock()
+        channel = conn.transfer_channel.return_value.__enter__.return_value
+        progress = mock.Mock()
+
+        uploader = _PathUploader(conn, self._girder_client, progress=progress,
+                                 max_workers=1)
+        timings = uploader.run('root', '/job')
+
+        conn.execute.assert_called_once_with('mkdir -p /job/sub')
+
+        # Largest first
+        uploaded = [(c[0][0], c[0][2]['name'], c[0][3])
+                    for c in upload_file.call_args_list]
+        self.assertEqual(uploaded, [
+            (channel, 'large.txt', '/job'),
+            (channel, 'medium.txt', '/job/sub'),
+            (channel, 'small.txt', '/job')
+        ])
+
+        progress.assert_called_with(3, 3, 111, 111)
+        self.assertEqual([f['path'] for f in timings['files']],
+                         ['/job/large.txt', '/job/sub/medium.txt',
+                          '/job/small.txt'])
+        self.assertTrue('total' in timings)
+
+    @mock.patch('cumulus.transport.files.upload._upload_file')
+    def test_run_cached(self, upload_file):
+        conn = mock.MagicMock()
+        channel = conn.transfer_channel.return_value.__enter__.return_value
+        cache = mock.MagicMock()
+
+        # Only the large file is in the cache
+        def stage(connection, file, dest, transfer):
+            if file['name'] == 'large.txt':
+                return True
+
+            transfer()
+            return False
+
+        cache.stage.side_effect = stage
+
+        uploader = _PathUploader(conn, self._girder_client, max_workers=1,
+                                 cache=cache)
+        timings = uploader.run('root', '/job')
+
+        self.assertEqual(cache.stage.call_args_list[0][0][:3],
+                         (channel, self._files['item2'][0], '/job/large.txt'))
+        uploaded = [c[0][2]['name'] for c in upload_file.call_args_list]
+        self.assertEqual(uploaded, ['medium.txt', 'small.txt'])
+        self.assertEqual([f['cached'] for f in timings['files']],
+                         [True, False, False])
+
+    # The large file is too large to prefetch
+    @mock.patch('cumulus.transport.files.upload.MAX_PREFETCH_SIZE', 50)
+    @mock.patch('cumulus.transport.files.upload.use_tar', return_value=True)
+    @mock.patch('cumulus.transport.files.upload._download')
+    @mock.patch('cumulus.transport.files.upload._upload_file')
+    def test_run_tar(self, upload_file, download, _):
+        contents = {
+            'file1': b'1',
+            'file2': b'0' * 100,
+            'file3': b'0' * 10
+        }
+
+        def _download(girder_client, file):
+            r = mock.MagicMock()
+            r.raw = io.BytesIO(contents[file['_id']])
+            return r
+
+        download.side_effect = _download
+
+        conn = mock.MagicMock()
+        stream = io.BytesIO()
+        conn.tar_writer.return_value.__enter__.return_value = stream
+        progress = mock.Mock()
+
+        uploader = _PathUploader(conn, self._girder_client, progress=progress,
+                                 max_workers=1)
+        timings = uploader.run('root', '/job')
+
+        # Everything is sent in a single stream
+        self.assertFalse(upload_file.called)
+        conn.tar_writer.assert_called_once_with('/job', compress=False)
+        stream.seek(0)
+        with tarfile.open(fileobj=stream) as tar:
+            members = dict((m.name, tar.extractfile(m).read()) for m in tar)
+        self.assertEqual(members, {
+            'small.txt': contents['file1'],
+            'large.txt': contents['file2'],
+            'sub/medium.txt': contents['file3']
+        })
+
+        progress.assert_called_with(3, 3, 111, 111)
+        self.assertEqual(len(timings['files']), 1)
+        self.assertTrue(timings['files'][0]['archive'])
+        self.assertEqual(timings['files'][0]['files'], 3)
+        self.assertEqual(download.call_count, 3)
+
+    @mock.patch('cumulus.transport.files.upload.use_tar', return_value=True)
+    @mock.patch('cumulus.transport.files.upload._download')
+    def test_run_tar_download_error(self, download, _):
+        download.side_effect = Exception('download failed')
+        conn = mock.MagicMock()
+        stream = io.BytesIO()
+        conn.tar_writer.return_value.__enter__.return_value = stream
+
+        uploader = _PathUploader(conn, self._girder_client, max_workers=2)
+        with self.assertRaises(Exception) as cm:
+            uploader.run('root', '/job')
+        self.assertEqual(str(cm.exception), 'download failed')
+        # The archive isn't finished
+        self.assertEqual(stream.getvalue(), b'')
+
+    def test_use_tar(self):
+        conn = mock.MagicMock()
+        conn.supports_tar = True
+        self.assertTrue(use_tar(conn, 1000, 1000 * 1024))
+        # Too few files
+        self.assertFalse(use_tar(conn, 10, 10))
+        # Too large on average
+        self.assertFalse(use_tar(conn, 1000, 1000 * 1024 ** 3))
+
+        conn.supports_tar = False
+        self.assertFalse(use_tar(conn, 1000, 1000 * 1024))
+
+    def test_batch_commands(self):
+        commands = batch_commands('mkdir -p', ['a', 'b c', 'd'],
+                                  max_length=16)
+        self.assertEqual(commands, ["mkdir -p a 'b c'", 'mkdir -p d'])
+        self.assertEqual(batch_commands('mkdir -p', []), [])
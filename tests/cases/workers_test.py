@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import unittest
+import threading
+import time
+
+from cumulus.common.workers import WorkerPool
+
+
+class WorkerPoolTestCase(unittest.TestCase):
+
+    def test_priority(self):
+        done = []
+        with WorkerPool(1) as pool:
+            # Hold the only worker until everything is queued
+            started = threading.Event()
+            pool.submit(started.wait)
+            for i in [3, 1, 2]:
+                pool.submit(done.append, (i,), priority=i)
+            started.set()
+
+        self.assertEqual(done, [1, 2, 3])
+
+    def test_submit_from_work(self):
+        done = []
+
+        def work(pool, depth):
+            done.append(depth)
+            if depth < 3:
+                pool.submit(work, (pool, depth + 1))
+
+        with WorkerPool(2) as pool:
+            pool.submit(work, (pool, 0))
+
+        self.assertEqual(sorted(done), [0, 1, 2, 3])
+
+    def test_error(self):
+        done = []
+
+        def fail():
+            raise ValueError('failed')
+
+        with self.assertRaises(ValueError):
+            with WorkerPool(1) as pool:
+                pool.submit(fail)
+                pool.submit(done.append, (1,), priority=1)
+
+        self.assertEqual(done, [])
+
+    def test_context(self):
+        entered = []
+        lock = threading.Lock()
+
+        class Context(object):
+            def __enter__(self):
+                with lock:
+                    entered.append(self)
+                return self
+
+            def __exit__(self, *args):
+                pass
+
+        contexts = []
+
+        def work(context):
+            contexts.append(context)
+            time.sleep(0.01)
+
+        with WorkerPool(2, Context) as pool:
+            for _ in range(4):
+                pool.submit(work)
+
+        self.assertEqual(len(entered), 2)
+        self.assertEqual(len(contexts), 4)
+        self.assertTrue(set(contexts) <= set(entered))